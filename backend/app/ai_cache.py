@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+AI_CACHE_PATH = os.environ.get("AI_CACHE_PATH", "./ai_cache.db")
+AI_CACHE_TTL_SECONDS = int(os.environ.get("AI_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+AI_CACHE_MAX_BYTES = int(os.environ.get("AI_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+AI_CACHE_MEMORY_ENTRIES = int(os.environ.get("AI_CACHE_MEMORY_ENTRIES", 512))
+# Stores between full passes (expiry sweep, size recount); a store that pushes
+# the running byte total past the budget triggers one sooner
+AI_CACHE_EVICT_EVERY = int(os.environ.get("AI_CACHE_EVICT_EVERY", 100))
+
+def normalize_input(text: str) -> str:
+    """Collapse differences that don't change what the model sees: Unicode form, line endings, runs of spaces"""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r" ?\n ?", "\n", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+def cache_key(endpoint: str, model: str, prompt: str, text: str) -> str:
+    material = json.dumps([endpoint, model, prompt, normalize_input(text)], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    Two-tier cache for AI endpoint results.
+
+    Lookups check an in-memory LRU first, then a local SQLite file shared by the
+    workers on a host. Entries expire after `ttl` seconds; when the file grows
+    past `max_bytes`, the least recently used entries are evicted. Writes keep
+    a running byte total instead of re-summing the table; the full pass runs
+    when that total crosses the budget or every `evict_every` stores, which
+    also picks up what other workers have written. Each entry remembers how
+    long the upstream call took, so hits can report latency saved.
+    """
+
+    def __init__(self, path: str = None, ttl: int = None, max_bytes: int = None,
+                 memory_entries: int = None, evict_every: int = None):
+        self.path = path or AI_CACHE_PATH
+        self.ttl = ttl if ttl is not None else AI_CACHE_TTL_SECONDS
+        self.max_bytes = max_bytes if max_bytes is not None else AI_CACHE_MAX_BYTES
+        self.memory_entries = memory_entries if memory_entries is not None else AI_CACHE_MEMORY_ENTRIES
+        self.evict_every = evict_every if evict_every is not None else AI_CACHE_EVICT_EVERY
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # Bytes on disk as of the last full pass plus what this process stored since (None: not counted yet)
+        self._bytes: Optional[int] = None
+        self._stores_since_evict = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.evictions = 0
+        self.latency_saved = 0.0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ai_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    cost REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_ai_cache_last_access ON ai_cache (last_access)")
+        return self._conn
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[2] > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self.latency_saved += entry[1]
+                return entry[0]
+            if entry is not None:
+                del self._memory[key]
+
+            row = self._db().execute(
+                "SELECT value, cost, expires_at FROM ai_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db().execute("UPDATE ai_cache SET last_access = ? WHERE key = ?", (now, key))
+            value = json.loads(row[0])
+            self._remember(key, (value, row[1], row[2]))
+            self.disk_hits += 1
+            self.latency_saved += row[1]
+            return value
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Hits among `keys`, looked up under one lock; misses are simply absent"""
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self.get(key)
+                if value is not None:
+                    found[key] = value
+        return found
+
+    def set(self, key: str, value: Any, cost: float = 0.0):
+        """Store a result; `cost` is the upstream latency in seconds that a hit will save"""
+        self.set_many({key: value}, cost)
+
+    def set_many(self, values: Dict[str, Any], cost: float = 0.0):
+        """Store several results in one transaction; eviction runs as described on the class"""
+        now = time.time()
+        expires_at = now + self.ttl
+        rows = []
+        with self._lock:
+            for key, value in values.items():
+                encoded = json.dumps(value)
+                self._remember(key, (value, cost, expires_at))
+                rows.append((key, encoded, len(encoded), cost, expires_at, now))
+            db = self._db()
+            db.execute("BEGIN")
+            db.executemany(
+                "INSERT OR REPLACE INTO ai_cache (key, value, size, cost, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            db.execute("COMMIT")
+            self.stores += len(rows)
+            self._stores_since_evict += len(rows)
+            if self._bytes is not None:
+                # Replaced rows are counted twice; the next full pass corrects it
+                self._bytes += sum(row[2] for row in rows)
+            if self._bytes is None or self._bytes > self.max_bytes or self._stores_since_evict >= self.evict_every:
+                self._evict(db, now)
+
+    def _remember(self, key: str, entry: tuple):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        db.execute("DELETE FROM ai_cache WHERE expires_at <= ?", (now,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM ai_cache").fetchone()[0]
+        self._stores_since_evict = 0
+        self._bytes = total
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% so eviction doesn't run on every insert near the limit
+        excess = total - int(self.max_bytes * 0.9)
+        doomed, freed = [], 0
+        for key, size in db.execute("SELECT key, size FROM ai_cache ORDER BY last_access"):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        db.executemany("DELETE FROM ai_cache WHERE key = ?", doomed)
+        for (key,) in doomed:
+            self._memory.pop(key, None)
+        self.evictions += len(doomed)
+        self._bytes = total - freed
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db().execute("DELETE FROM ai_cache")
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+            "memory_entries": len(self._memory),
+        }
+
+response_cache = ResponseCache()
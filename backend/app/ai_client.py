@@ -0,0 +1,48 @@
+import os
+from typing import Optional
+
+# Upstream connection pool and timeouts for the shared OpenAI client
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 200))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", 50))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 5))
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 60))
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 2))
+
+_client = None
+
+def get_openai_client():
+    """
+    The worker's shared AsyncOpenAI client, created on first use.
+
+    One client means one keep-alive connection pool, so model calls reuse warm
+    TLS connections instead of handshaking per request. Returns None when no
+    API key is configured or the openai package is missing.
+    """
+    global _client
+    if _client is not None:
+        return _client
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    try:
+        import httpx
+        from openai import AsyncOpenAI
+    except ImportError:
+        return None
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+    )
+    _client = AsyncOpenAI(
+        api_key=api_key,
+        base_url=os.getenv("OPENAI_BASE_URL") or None,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=http_client,
+    )
+    return _client
+
+async def close_openai_client():
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.close()
@@ -0,0 +1,55 @@
+from collections import defaultdict, deque
+from typing import Dict
+
+class LatencySeries:
+    """Running count/mean plus percentiles over the most recent `window` observations"""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def summary(self) -> dict:
+        ordered = sorted(self.samples)
+
+        def percentile(p: float) -> float:
+            return round(ordered[min(int(len(ordered) * p), len(ordered) - 1)], 4) if ordered else 0.0
+
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else 0.0,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+        }
+
+class AIMetrics:
+    """In-process counters and latency series for the AI endpoints, per worker"""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.latencies: Dict[str, LatencySeries] = {}
+
+    def incr(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    def observe(self, name: str, seconds: float):
+        if name not in self.latencies:
+            self.latencies[name] = LatencySeries()
+        self.latencies[name].observe(seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "latency_seconds": {name: series.summary() for name, series in self.latencies.items()},
+        }
+
+    def reset(self):
+        self.counters.clear()
+        self.latencies.clear()
+
+ai_metrics = AIMetrics()
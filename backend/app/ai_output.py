@@ -0,0 +1,226 @@
+import json
+import os
+from typing import Any, List, Optional, Type
+
+from pydantic import BaseModel, Field, validator
+
+from .ai_metrics import ai_metrics
+from .ai_pipeline import estimate_tokens
+
+# Ask for the model's JSON response format (a JSON object); turn off for models without it
+AI_JSON_MODE = os.environ.get("AI_JSON_MODE", "true").lower() != "false"
+REPAIR_INPUT_CHARS = 8000
+
+REPAIR_PROMPT = "Your previous reply could not be used: it is not valid JSON for the schema below. Return only the corrected JSON object, keeping its content, with no commentary."
+
+OUTCOMES = ("valid", "repaired", "invalid")
+
+class Flashcard(BaseModel):
+    q: str
+    a: str
+
+class FlashcardSet(BaseModel):
+    cards: List[Flashcard]
+
+    @validator("cards")
+    def not_empty(cls, cards):
+        if not cards:
+            raise ValueError("no flashcards")
+        return cards
+
+class QuizQuestion(BaseModel):
+    question: str
+    options: List[str]
+    correct_answer: int
+
+    @validator("correct_answer")
+    def answer_is_an_option(cls, value, values):
+        options = values.get("options") or []
+        if len(options) < 2 or not 0 <= value < len(options):
+            raise ValueError("correct_answer must index one of at least two options")
+        return value
+
+class Quiz(BaseModel):
+    questions: List[QuizQuestion]
+
+    @validator("questions")
+    def not_empty(cls, questions):
+        if not questions:
+            raise ValueError("no questions")
+        return questions
+
+class ConceptNode(BaseModel):
+    id: int
+    label: str
+    type: str = "concept"
+
+class ConceptEdge(BaseModel):
+    from_: int = Field(..., alias="from")
+    to: int
+    label: str = "relates to"
+
+class ConceptMap(BaseModel):
+    nodes: List[ConceptNode]
+    edges: List[ConceptEdge]
+
+    @validator("nodes")
+    def not_empty(cls, nodes):
+        if not nodes:
+            raise ValueError("no nodes")
+        return nodes
+
+    @validator("edges")
+    def edges_join_nodes(cls, edges, values):
+        ids = {node.id for node in values.get("nodes") or []}
+        if any(edge.from_ not in ids or edge.to not in ids for edge in edges):
+            raise ValueError("edge refers to an unknown node")
+        return edges
+
+class NoteSubsection(BaseModel):
+    id: str
+    title: str
+    content: str = ""
+
+class NoteSection(BaseModel):
+    id: str
+    title: str
+    content: str = ""
+    subsections: List[NoteSubsection] = []
+
+class NoteSections(BaseModel):
+    sections: List[NoteSection]
+
+class TopicFlashcard(BaseModel):
+    question: str
+    answer: str
+    difficulty: Optional[str] = None
+
+class TopicFlashcards(BaseModel):
+    flashcards: List[TopicFlashcard]
+
+    @validator("flashcards")
+    def not_empty(cls, flashcards):
+        if not flashcards:
+            raise ValueError("no flashcards")
+        return flashcards
+
+class TopicQuestion(BaseModel):
+    question: str
+    options: List[str]
+    correctAnswer: int
+
+    @validator("correctAnswer")
+    def answer_is_an_option(cls, value, values):
+        options = values.get("options") or []
+        if len(options) < 2 or not 0 <= value < len(options):
+            raise ValueError("correctAnswer must index one of at least two options")
+        return value
+
+class TopicQuiz(BaseModel):
+    questions: List[TopicQuestion]
+
+    @validator("questions")
+    def not_empty(cls, questions):
+        if not questions:
+            raise ValueError("no questions")
+        return questions
+
+class StudyPackOutput(BaseModel):
+    """Only the envelope; /ai/study-pack validates each section against its own schema"""
+    summary: Any = None
+    flashcards: Any = None
+    quiz: Any = None
+    concept_map: Any = None
+
+class OutputError(ValueError):
+    """Model output that still didn't validate after the repair attempt"""
+
+def extract_json(text: str) -> Any:
+    """
+    The first complete JSON value in a reply. Tolerates code fences and prose
+    around it; each candidate '{' or '[' is decoded exactly (raw_decode), so a
+    reply with two arrays or trailing brackets isn't glued into one match.
+    """
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    decoder = json.JSONDecoder()
+    for i, char in enumerate(text):
+        if char in "{[":
+            try:
+                return decoder.raw_decode(text, i)[0]
+            except ValueError:
+                continue
+    raise ValueError("no JSON value in model output")
+
+def parse_output(text: str, schema: Type[BaseModel]) -> BaseModel:
+    data = extract_json(text)
+    fields = list(schema.__fields__)
+    # A bare array where the schema wraps one list field (prompts without JSON mode often get these)
+    if isinstance(data, list) and len(fields) == 1:
+        data = {fields[0]: data}
+    return schema.parse_obj(data)
+
+def _used_tokens(response, messages: List[dict], reply: str) -> int:
+    usage = getattr(response, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None):
+        return usage.total_tokens
+    return sum(estimate_tokens(m["content"]) for m in messages) + estimate_tokens(reply)
+
+async def _call(client, model: str, messages: List[dict], max_tokens: int, temperature: float):
+    extra = {"response_format": {"type": "json_object"}} if AI_JSON_MODE else {}
+    response = await client.chat.completions.create(
+        model=model, messages=messages, max_tokens=max_tokens, temperature=temperature, **extra
+    )
+    reply = (response.choices[0].message.content or "").strip()
+    return reply, _used_tokens(response, messages, reply)
+
+async def complete_structured(client, model: str, endpoint: str, prompt: str, content: str,
+                              max_tokens: int, schema: Type[BaseModel]) -> BaseModel:
+    """
+    One model call whose reply must validate against `schema`. JSON mode is
+    requested (AI_JSON_MODE); if the reply still doesn't parse or validate, one
+    repair call at temperature 0 gets the broken reply, the error and the
+    schema. Outcomes are counted per endpoint as <endpoint>.output.valid /
+    .repaired / .invalid, and tokens spent on unusable replies as
+    <endpoint>.output.wasted_tokens. Raises OutputError when both fail.
+    """
+    messages = [{"role": "system", "content": prompt}, {"role": "user", "content": content}]
+    reply, tokens = await _call(client, model, messages, max_tokens, 0.7)
+    try:
+        result = parse_output(reply, schema)
+        ai_metrics.incr(f"{endpoint}.output.valid")
+        return result
+    except (ValueError, TypeError) as e:
+        error = e
+        ai_metrics.incr(f"{endpoint}.output.wasted_tokens", tokens)
+
+    repair = [
+        {"role": "system", "content": f"{REPAIR_PROMPT}\n\nSchema: {schema.schema_json()}"},
+        {"role": "user", "content": f"Error: {error}\n\nReply:\n{reply[:REPAIR_INPUT_CHARS]}"},
+    ]
+    fixed, tokens = await _call(client, model, repair, max_tokens, 0)
+    try:
+        result = parse_output(fixed, schema)
+        ai_metrics.incr(f"{endpoint}.output.repaired")
+        return result
+    except (ValueError, TypeError) as e:
+        ai_metrics.incr(f"{endpoint}.output.invalid")
+        ai_metrics.incr(f"{endpoint}.output.wasted_tokens", tokens)
+        raise OutputError(f"{endpoint} output invalid after repair: {e}")
+
+def output_stats() -> dict:
+    """Per endpoint: structured-output outcomes, failure rates and tokens wasted on unusable replies"""
+    stats = {}
+    for name, count in list(ai_metrics.counters.items()):
+        endpoint, sep, outcome = name.rpartition(".output.")
+        if sep:
+            stats.setdefault(endpoint, dict.fromkeys(OUTCOMES + ("wasted_tokens",), 0))[outcome] = count
+    for entry in stats.values():
+        calls = sum(entry[outcome] for outcome in OUTCOMES)
+        # First-pass failures cost a repair call; invalid ones also cost the fallback
+        entry["parse_failure_rate"] = round((entry["repaired"] + entry["invalid"]) / calls, 4) if calls else 0.0
+        entry["unusable_rate"] = round(entry["invalid"] / calls, 4) if calls else 0.0
+    return stats
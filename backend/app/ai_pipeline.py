@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import os
+import re
+from typing import Awaitable, Callable, List, Sequence
+
+# Budgets in estimated tokens: texts up to AI_SINGLE_PASS_TOKENS go to the model
+# in one prompt, longer ones are split into chunks of at most AI_CHUNK_TOKENS
+AI_SINGLE_PASS_TOKENS = int(os.environ.get("AI_SINGLE_PASS_TOKENS", 6000))
+AI_CHUNK_TOKENS = int(os.environ.get("AI_CHUNK_TOKENS", 2000))
+AI_MAP_CONCURRENCY = int(os.environ.get("AI_MAP_CONCURRENCY", 4))
+
+HEADING_RE = re.compile(r"^(#{1,6}\s+\S.*|[A-Z][A-Z0-9 ,:&()'-]{3,80}|\d+(\.\d+)*[.)]?\s+[A-Z].{0,80})$")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+def estimate_tokens(text: str) -> int:
+    """Rough count for English prose (about 4 characters per token); no tokenizer needed"""
+    return len(text) // 4 + 1
+
+def split_sections(text: str) -> List[str]:
+    """Split on heading lines (markdown, ALL CAPS, or numbered); text before the first heading is its own section"""
+    sections, current = [], []
+    for line in text.splitlines():
+        if HEADING_RE.match(line.strip()) and any(l.strip() for l in current):
+            sections.append("\n".join(current).strip())
+            current = []
+        current.append(line)
+    if any(l.strip() for l in current):
+        sections.append("\n".join(current).strip())
+    return sections
+
+def _pieces(paragraph: str, max_tokens: int) -> List[str]:
+    """A paragraph that is over budget on its own, cut at sentence ends (or hard, as a last resort)"""
+    if estimate_tokens(paragraph) <= max_tokens:
+        return [paragraph]
+    limit = max_tokens * 4
+    pieces, current = [], ""
+    for sentence in SENTENCE_RE.split(paragraph):
+        while len(sentence) > limit:
+            pieces.append(sentence[:limit])
+            sentence = sentence[limit:]
+        if current and len(current) + 1 + len(sentence) > limit:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}".strip()
+    if current:
+        pieces.append(current)
+    return pieces
+
+def _is_anchor(paragraph: str) -> bool:
+    # Content-defined cut point: about one paragraph in four
+    return hashlib.sha1(paragraph.encode("utf-8")).digest()[0] < 64
+
+def chunk_text(text: str, max_tokens: int = None) -> List[str]:
+    """
+    Split a document into chunks of at most `max_tokens` estimated tokens.
+
+    Chunks never cross a section heading, and within a section they end at
+    paragraph boundaries. Besides the budget, a chunk that is at least half full
+    also ends after an "anchor" paragraph picked by content hash, so editing one
+    paragraph moves boundaries only until the next anchor and the remaining
+    chunks come out byte-identical (and hit the per-chunk cache).
+    """
+    max_tokens = max_tokens or AI_CHUNK_TOKENS
+    chunks = []
+    for section in split_sections(text):
+        paragraphs = [p.strip() for p in re.split(r"\n\s*\n", section) if p.strip()]
+        current, size = [], 0
+        for paragraph in paragraphs:
+            for piece in _pieces(paragraph, max_tokens):
+                cost = estimate_tokens(piece)
+                if current and size + cost > max_tokens:
+                    chunks.append("\n\n".join(current))
+                    current, size = [], 0
+                current.append(piece)
+                size += cost
+                if size >= max_tokens // 2 and _is_anchor(piece):
+                    chunks.append("\n\n".join(current))
+                    current, size = [], 0
+        if current:
+            chunks.append("\n\n".join(current))
+    return chunks
+
+async def bounded_map(items: Sequence, fn: Callable[..., Awaitable], concurrency: int = None) -> list:
+    """await fn(item) for every item, at most `concurrency` at a time, results in input order"""
+    semaphore = asyncio.Semaphore(concurrency or AI_MAP_CONCURRENCY)
+
+    async def run(item):
+        async with semaphore:
+            return await fn(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+async def reduce_hierarchically(parts: List[str], combine: Callable[[str], Awaitable[str]],
+                                max_tokens: int = None, concurrency: int = None) -> str:
+    """
+    Fold partial results into one text that fits `max_tokens`: while they don't
+    fit together, consecutive parts are grouped under the budget and each group
+    is combined by one model call, level by level. Returns the joined parts.
+    """
+    max_tokens = max_tokens or AI_SINGLE_PASS_TOKENS
+    while len(parts) > 1 and estimate_tokens("\n\n".join(parts)) > max_tokens:
+        groups, current, size = [], [], 0
+        for part in parts:
+            cost = estimate_tokens(part)
+            if current and size + cost > max_tokens:
+                groups.append(current)
+                current, size = [], 0
+            current.append(part)
+            size += cost
+        groups.append(current)
+        if len(groups) == len(parts):
+            # Every part is over budget on its own; pair them so each level shrinks
+            groups = [parts[i:i + 2] for i in range(0, len(parts), 2)]
+        parts = await bounded_map(["\n\n".join(group) for group in groups], combine, concurrency)
+    return "\n\n".join(parts)
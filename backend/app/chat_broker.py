@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Set
+
+# "memory" (single process, also used by tests) or "redis" for multi-worker deployments
+CHAT_BROKER = os.environ.get("CHAT_BROKER", "memory")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+# Workers that haven't refreshed their heartbeat within this window are ignored
+WORKER_TTL_SECONDS = 45
+
+Handler = Callable[[str], Awaitable[None]]
+
+class InMemoryBroker:
+    """
+    Pub/sub and presence held in process memory. Several ConnectionManagers can
+    share one instance to stand in for separate workers in tests.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[Handler]] = {}
+        self._presence: Dict[str, Dict[str, int]] = {}
+        self.published = 0
+
+    async def publish(self, channel: str, payload: str):
+        self.published += 1
+        for handler in list(self._subscribers.get(channel, [])):
+            await handler(payload)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self._subscribers.setdefault(channel, []).append(handler)
+
+    async def unsubscribe(self, channel: str, handler: Handler):
+        handlers = self._subscribers.get(channel, [])
+        if handler in handlers:
+            handlers.remove(handler)
+
+    async def heartbeat(self, worker_id: str):
+        pass
+
+    async def claim_worker_number(self):
+        """A single process: its pid already tells it apart"""
+        return None
+
+    async def presence_add(self, user_id: str, worker_id: str):
+        workers = self._presence.setdefault(user_id, {})
+        workers[worker_id] = workers.get(worker_id, 0) + 1
+
+    async def presence_remove(self, user_id: str, worker_id: str):
+        workers = self._presence.get(user_id, {})
+        if worker_id in workers:
+            workers[worker_id] -= 1
+            if workers[worker_id] <= 0:
+                del workers[worker_id]
+        if not workers:
+            self._presence.pop(user_id, None)
+
+    async def presence_workers(self, user_id: str) -> Set[str]:
+        return set(self._presence.get(user_id, {}))
+
+    async def close(self):
+        pass
+
+class RedisBroker:
+    """
+    Redis pub/sub for fan-out plus a presence hash per user
+    (chat:presence:<user_id> -> {worker_id: connection count}).
+    Worker liveness is tracked in a sorted set so presence left behind by a
+    crashed worker stops attracting publishes after WORKER_TTL_SECONDS. Each
+    broker keeps a copy of that set, refreshed on its own heartbeat, so routing
+    a message costs one presence read rather than two round trips.
+    """
+
+    def __init__(self, url: str = REDIS_URL, client=None):
+        if client is None:
+            import redis.asyncio as aioredis
+            client = aioredis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.published = 0
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._pubsub = None
+        self._reader = None
+        self._alive: Dict[str, float] = {}
+        # Workers a re-read already found dead, so their leftover presence costs nothing
+        self._lapsed: Set[str] = set()
+
+    async def publish(self, channel: str, payload: str):
+        self.published += 1
+        await self.redis.publish(channel, payload)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        if self._pubsub is None:
+            self._pubsub = self.redis.pubsub()
+        first = channel not in self._handlers
+        self._handlers.setdefault(channel, []).append(handler)
+        if first:
+            await self._pubsub.subscribe(channel)
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.get_running_loop().create_task(self._read())
+
+    async def unsubscribe(self, channel: str, handler: Handler):
+        handlers = self._handlers.get(channel, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers and channel in self._handlers:
+            del self._handlers[channel]
+            await self._pubsub.unsubscribe(channel)
+
+    async def _read(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Chat broker read failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+            for handler in list(self._handlers.get(message["channel"], [])):
+                try:
+                    await handler(message["data"])
+                except Exception as e:
+                    print(f"Chat broker handler failed: {e}")
+
+    async def heartbeat(self, worker_id: str):
+        await self.redis.zadd("chat:workers", {worker_id: time.time()})
+        await self._refresh_alive()
+
+    async def claim_worker_number(self) -> int:
+        """Distinct for any 1024 consecutive claims, so workers running side by side never share one"""
+        return (await self.redis.incr("chat:worker_numbers") - 1) % 1024
+
+    async def _refresh_alive(self):
+        now = time.time()
+        entries = await self.redis.zrangebyscore("chat:workers", now - WORKER_TTL_SECONDS, "+inf", withscores=True)
+        self._alive = {worker_id: float(score) for worker_id, score in entries}
+        self._lapsed -= set(self._alive)
+
+    async def presence_add(self, user_id: str, worker_id: str):
+        await self.redis.hincrby(f"chat:presence:{user_id}", worker_id, 1)
+
+    async def presence_remove(self, user_id: str, worker_id: str):
+        key = f"chat:presence:{user_id}"
+        if await self.redis.hincrby(key, worker_id, -1) <= 0:
+            await self.redis.hdel(key, worker_id)
+
+    async def presence_workers(self, user_id: str) -> Set[str]:
+        workers = set(await self.redis.hkeys(f"chat:presence:{user_id}"))
+        if not workers:
+            return workers
+        cutoff = time.time() - WORKER_TTL_SECONDS
+        # A worker missing from the copy may have started (or heartbeated) since it was taken
+        unknown = {w for w in workers if self._alive.get(w, 0) <= cutoff} - self._lapsed
+        if unknown:
+            await self._refresh_alive()
+            cutoff = time.time() - WORKER_TTL_SECONDS
+            self._lapsed |= {w for w in unknown if self._alive.get(w, 0) <= cutoff}
+        return {w for w in workers if self._alive.get(w, 0) > cutoff}
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.close()
+
+def get_broker():
+    if CHAT_BROKER == "redis":
+        return RedisBroker()
+    return InMemoryBroker()
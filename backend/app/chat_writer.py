@@ -0,0 +1,177 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import insert
+from starlette.concurrency import run_in_threadpool
+from . import models, crud
+from .database import SessionLocal
+
+# 2024-01-01T00:00:00Z in milliseconds; sequence numbers count from here
+SEQUENCE_EPOCH_MS = 1704067200000
+
+# Worker number (0-1023) inside sequence numbers. Unset: each worker claims one
+# from the chat broker at startup, falling back to its process id
+CHAT_WORKER_ID = os.environ.get("CHAT_WORKER_ID")
+
+class MessageSequence:
+    """
+    Time-ordered message sequence numbers, assigned when a message is accepted
+    so it can be delivered with its cursor position before it is persisted.
+
+    Layout: milliseconds since SEQUENCE_EPOCH_MS, then 10 bits of worker id and
+    a 12-bit per-millisecond counter. Numbers are strictly increasing within a
+    worker and ordered by time across workers; they are unique as long as no
+    two live workers share a worker number (messages.seq has a unique index).
+    """
+
+    def __init__(self, worker_bits: Optional[int] = None):
+        if worker_bits is None and CHAT_WORKER_ID is not None:
+            worker_bits = int(CHAT_WORKER_ID)
+        self.configured = worker_bits is not None
+        self.worker_bits = (worker_bits if self.configured else os.getpid()) & 0x3FF
+        self._last_ms = 0
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def next(self) -> int:
+        with self._lock:
+            now = int(time.time() * 1000) - SEQUENCE_EPOCH_MS
+            if now <= self._last_ms:
+                # Same millisecond or the clock stepped back: keep counting forward
+                now = self._last_ms
+                self._counter += 1
+                if self._counter > 0xFFF:
+                    now += 1
+                    self._counter = 0
+            else:
+                self._counter = 0
+            self._last_ms = now
+            return (now << 22) | (self.worker_bits << 12) | self._counter
+
+    async def claim(self, broker):
+        """Take a worker number from the broker, unless CHAT_WORKER_ID (or worker_bits) set one"""
+        if self.configured:
+            return
+        try:
+            number = await broker.claim_worker_number()
+        except Exception as e:
+            print(f"Chat worker number claim failed, using the process id: {e}")
+            return
+        if number is not None:
+            self.worker_bits = number & 0x3FF
+
+message_sequence = MessageSequence()
+
+class MessageWriter:
+    """
+    Write-behind persistence for chat messages.
+
+    Messages are delivered first and queued here; a background task inserts
+    them in batches of up to `batch_size`, or whatever arrived within
+    `flush_interval` seconds, using a short-lived session per batch. The queue
+    is bounded, so if the database falls behind, senders wait instead of
+    memory growing without limit.
+    """
+
+    def __init__(self, batch_size: int = 200, flush_interval: float = 0.05,
+                 max_pending: int = 10000, session_factory=SessionLocal):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.session_factory = session_factory
+        self.written = 0
+        self.failed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = loop.create_task(self._run())
+
+    async def start(self):
+        self._ensure_started()
+
+    async def enqueue(self, sender_id: int, content: str, receiver_id: Optional[int] = None,
+                      room: Optional[str] = None, created_at: Optional[datetime] = None,
+                      seq: Optional[int] = None):
+        self._ensure_started()
+        await self._queue.put({
+            "seq": seq if seq is not None else message_sequence.next(),
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "room": room,
+            "conversation_key": crud.conversation_key(sender_id, receiver_id, room),
+            "content": content,
+            "created_at": created_at or datetime.utcnow(),
+        })
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def flush(self):
+        """Wait until everything queued so far has been written"""
+        if self._queue is not None and self._loop is asyncio.get_running_loop():
+            await self._queue.join()
+
+    async def stop(self):
+        """Flush what is queued and stop the background task"""
+        if self._task is None or self._loop is not asyncio.get_running_loop():
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            deadline = self._loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._write_with_retry(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _write_with_retry(self, batch: List[dict], attempts: int = 3):
+        for attempt in range(attempts):
+            try:
+                await run_in_threadpool(self._write, batch)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                if attempt == attempts - 1:
+                    self.failed += len(batch)
+                    print(f"Chat persistence failed, dropping {len(batch)} messages: {e}")
+                    return
+                await asyncio.sleep(0.1 * 2 ** attempt)
+
+    def _write(self, batch: List[dict]):
+        db = self.session_factory()
+        try:
+            db.execute(insert(models.Message), batch)
+            crud.apply_conversation_summaries(db, batch)
+            db.commit()
+        finally:
+            db.close()
+
+message_writer = MessageWriter()
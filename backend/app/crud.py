@@ -1,9 +1,10 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select, union_all, or_, and_
 from . import models, schemas
 from passlib.context import CryptContext
 from typing import Optional, List
 from datetime import datetime
+import re
 import warnings
 
 # Suppress bcrypt version warning
@@ -187,3 +188,350 @@ def get_assignments(db: Session, tutor_id: Optional[int] = None):
 
 def get_submissions_for_student(db: Session, student_id: int):
     return db.query(models.Submission).filter(models.Submission.student_id == student_id).all()
+
+def _completed_session_counts(db: Session, student_ids):
+    """Completed session count per student, in one grouped query"""
+    return dict(
+        db.query(models.SessionBooking.student_id, func.count(models.SessionBooking.id))
+        .filter(
+            models.SessionBooking.student_id.in_(student_ids),
+            models.SessionBooking.status == "completed"
+        )
+        .group_by(models.SessionBooking.student_id)
+        .all()
+    )
+
+def _numeric_grade_averages(db: Session, student_ids):
+    """
+    Integer average of numeric submission grades per student.
+    Grades are free-form strings and only purely numeric ones count (same rule
+    as update_progress), which can't be expressed portably in SQL, so they are
+    folded per student from a single scan.
+    """
+    totals = {}
+    graded = db.query(models.Submission.student_id, models.Submission.grade).filter(
+        models.Submission.student_id.in_(student_ids),
+        models.Submission.grade.isnot(None)
+    )
+    for student_id, grade in graded.yield_per(500):
+        if grade and grade.isdigit():
+            total, count = totals.get(student_id, (0, 0))
+            totals[student_id] = (total + int(grade), count + 1)
+    return {student_id: total // count for student_id, (total, count) in totals.items()}
+
+def refresh_progress_for_students(db: Session, student_ids):
+    """
+    Recompute session counts and average grades for several students at once.
+    Does not commit, so callers can fold it into their own transaction.
+    """
+    student_ids = set(student_ids)
+    if not student_ids:
+        return []
+    completed = _completed_session_counts(db, student_ids)
+    averages = _numeric_grade_averages(db, student_ids)
+    existing = {
+        p.student_id: p for p in
+        db.query(models.Progress).filter(models.Progress.student_id.in_(student_ids))
+    }
+    now = datetime.utcnow()
+    for student_id in student_ids:
+        prog = existing.get(student_id)
+        if prog is None:
+            prog = models.Progress(student_id=student_id, total_sessions=0, total_hours=0)
+            db.add(prog)
+            existing[student_id] = prog
+        prog.total_sessions = completed.get(student_id, 0)
+        prog.average_grade = averages.get(student_id)
+        prog.updated_at = now
+    return list(existing.values())
+
+def get_roster_progress(db: Session, tutor_id: int):
+    """
+    Progress for every student who has booked a session with this tutor.
+    Uses a fixed number of grouped queries regardless of roster size and
+    yields one dict per student so callers can stream the result.
+    """
+    roster = db.query(models.SessionBooking.student_id).filter(
+        models.SessionBooking.tutor_id == tutor_id
+    ).distinct()
+
+    completed = _completed_session_counts(db, roster)
+
+    minutes = dict(
+        db.query(models.StudySession.student_id, func.sum(models.StudySession.duration_minutes))
+        .filter(
+            models.StudySession.student_id.in_(roster),
+            models.StudySession.duration_minutes.isnot(None)
+        )
+        .group_by(models.StudySession.student_id)
+        .all()
+    )
+
+    grade_averages = _numeric_grade_averages(db, roster)
+
+    students = db.query(models.User.id, models.User.full_name, models.User.email).filter(
+        models.User.id.in_(roster)
+    ).order_by(models.User.id)
+    for student_id, full_name, email in students.yield_per(500):
+        yield {
+            "student_id": student_id,
+            "full_name": full_name,
+            "email": email,
+            "total_sessions": completed.get(student_id, 0),
+            "total_hours": int((minutes.get(student_id) or 0) / 60),
+            "average_grade": grade_averages.get(student_id),
+        }
+
+FEED_STATUSES = ("pending", "submitted", "graded")
+
+def get_assignment_feed(
+    db: Session,
+    student_id: int,
+    due_after: Optional[datetime] = None,
+    due_before: Optional[datetime] = None,
+    status: Optional[str] = None,
+    after: Optional[tuple] = None,
+    limit: int = 20
+):
+    """
+    A student's assignments (targeted and broadcast) joined with their latest
+    submission, in one statement, ordered by (due_date, id) with undated last.
+
+    Each branch filters on a single student_id value so it can walk
+    ix_assignments_student_due in order; the branches are merged with UNION ALL.
+    `after` is the (due_date, id) of the last row of the previous page.
+    """
+    A, S = models.Assignment, models.Submission
+    latest = (
+        select(S.assignment_id, func.max(S.id).label("submission_id"))
+        .where(S.student_id == student_id)
+        .group_by(S.assignment_id)
+        .subquery()
+    )
+
+    def branch(student_filter):
+        q = (
+            select(
+                A.id, A.tutor_id, A.student_id, A.session_id, A.title, A.description,
+                A.due_date, A.created_at,
+                S.id.label("submission_id"), S.grade, S.feedback,
+                S.created_at.label("submitted_at"),
+            )
+            .outerjoin(latest, latest.c.assignment_id == A.id)
+            .outerjoin(S, S.id == latest.c.submission_id)
+            .where(student_filter)
+        )
+        if due_after is not None:
+            q = q.where(A.due_date >= due_after)
+        if due_before is not None:
+            q = q.where(A.due_date < due_before)
+        if status == "pending":
+            q = q.where(S.id.is_(None))
+        elif status == "submitted":
+            q = q.where(S.id.isnot(None), S.grade.is_(None))
+        elif status == "graded":
+            q = q.where(S.grade.isnot(None))
+        if after is not None:
+            due, last_id = after
+            if due is None:
+                q = q.where(A.due_date.is_(None), A.id > last_id)
+            else:
+                q = q.where(or_(
+                    A.due_date > due,
+                    and_(A.due_date == due, A.id > last_id),
+                    A.due_date.is_(None)
+                ))
+        return q.order_by(A.due_date.asc().nulls_last(), A.id).limit(limit).subquery()
+
+    targeted = branch(A.student_id == student_id)
+    broadcast = branch(A.student_id.is_(None))
+    merged = union_all(select(targeted), select(broadcast)).subquery()
+    stmt = select(merged).order_by(merged.c.due_date.asc().nulls_last(), merged.c.id).limit(limit)
+
+    items = []
+    for row in db.execute(stmt).mappings():
+        item = dict(row)
+        if item["submission_id"] is None:
+            item["status"] = "pending"
+        elif item["grade"] is None:
+            item["status"] = "submitted"
+        else:
+            item["status"] = "graded"
+        items.append(item)
+    return items
+
+def conversation_key(sender_id: int, receiver_id: Optional[int] = None, room: Optional[str] = None) -> Optional[str]:
+    """Normalized key shared by both directions of a direct chat, or by a room"""
+    if room:
+        return f"room:{room}"
+    if receiver_id is None:
+        return None
+    low, high = sorted((int(sender_id), int(receiver_id)))
+    return f"dm:{low}:{high}"
+
+# Rooms: one per SessionBooking and one per tutor-student pair
+ROOM_RE = re.compile(r"^(?:session:(?P<session>\d+)|pair:(?P<pair_tutor>\d+):(?P<pair_student>\d+))$")
+
+def room_participants(db: Session, rooms) -> dict:
+    """
+    Users entitled to a room: session:<id> -> the booking's student and tutor,
+    pair:<tutor>:<student> -> those two. Session rooms are resolved in one query;
+    names that don't match ROOM_RE have no participants.
+    """
+    participants = {}
+    session_ids = {}
+    for room in rooms:
+        match = ROOM_RE.match(room)
+        if match is None:
+            continue
+        if match["session"] is not None:
+            session_ids[int(match["session"])] = room
+        else:
+            participants[room] = {int(match["pair_tutor"]), int(match["pair_student"])}
+    if session_ids:
+        rows = db.query(models.SessionBooking.id, models.SessionBooking.student_id, models.SessionBooking.tutor_id).filter(
+            models.SessionBooking.id.in_(session_ids)
+        )
+        for booking_id, student_id, tutor_id in rows:
+            participants[session_ids[booking_id]] = {student_id, tutor_id}
+    return participants
+
+def can_access_room(db: Session, user_id: int, room: str) -> bool:
+    return user_id in room_participants(db, [room]).get(room, set())
+
+def apply_conversation_summaries(db: Session, messages: List[dict]):
+    """
+    Fold a batch of new messages into conversation_summaries: latest message per
+    (user, conversation) and unread counts for everyone but the sender.
+    Unread counters are incremented in SQL so concurrent writers don't lose
+    updates. Does not commit.
+    """
+    rooms = {m["room"] for m in messages if m.get("room")}
+    members = room_participants(db, rooms) if rooms else {}
+
+    updates = {}
+    for m in messages:
+        key = m.get("conversation_key")
+        if not key:
+            continue
+        if m.get("room"):
+            recipients = members.get(m["room"], set()) | {m["sender_id"]}
+        else:
+            recipients = {m["sender_id"], int(m["receiver_id"])}
+        for user_id in recipients:
+            row = updates.setdefault((user_id, key), {
+                "user_id": user_id,
+                "conversation_key": key,
+                "room": m.get("room"),
+                "peer_id": None if m.get("room") else next(iter(recipients - {user_id}), user_id),
+                "unread": 0,
+            })
+            if row.get("last_message_at") is None or m["created_at"] >= row["last_message_at"]:
+                row["last_sender_id"] = m["sender_id"]
+                row["last_content"] = m["content"][:200]
+                row["last_message_at"] = m["created_at"]
+            if user_id != m["sender_id"]:
+                row["unread"] += 1
+    if not updates:
+        return
+
+    S = models.ConversationSummary
+    existing = set(
+        db.query(S.user_id, S.conversation_key).filter(
+            S.user_id.in_({user_id for user_id, _ in updates}),
+            S.conversation_key.in_({key for _, key in updates})
+        )
+    )
+    for (user_id, key), row in updates.items():
+        if (user_id, key) in existing:
+            db.query(S).filter(S.user_id == user_id, S.conversation_key == key).update({
+                S.last_sender_id: row["last_sender_id"],
+                S.last_content: row["last_content"],
+                S.last_message_at: row["last_message_at"],
+                S.unread_count: S.unread_count + row["unread"],
+            }, synchronize_session=False)
+        else:
+            db.add(S(
+                user_id=user_id, conversation_key=key, peer_id=row["peer_id"], room=row["room"],
+                last_sender_id=row["last_sender_id"], last_content=row["last_content"],
+                last_message_at=row["last_message_at"], unread_count=row["unread"]
+            ))
+
+def get_message_history(db: Session, key: str, before: Optional[tuple] = None, limit: int = 50):
+    """Newest-first page of a conversation, continuing below the (created_at, id) cursor"""
+    M = models.Message
+    query = db.query(M).filter(M.conversation_key == key)
+    if before is not None:
+        created_at, message_id = before
+        query = query.filter(or_(M.created_at < created_at, and_(M.created_at == created_at, M.id < message_id)))
+    return query.order_by(M.created_at.desc(), M.id.desc()).limit(limit).all()
+
+def get_messages_since(db: Session, user_id: int, since: int, limit: int = 200):
+    """
+    Messages in any of the user's conversations with seq above the cursor, oldest
+    first. One statement: the user's conversation keys come from their summary
+    rows and each key is range-scanned on (conversation_key, seq).
+    """
+    M = models.Message
+    keys = db.query(models.ConversationSummary.conversation_key).filter(
+        models.ConversationSummary.user_id == user_id
+    )
+    return db.query(M).filter(M.conversation_key.in_(keys), M.seq > since).order_by(M.seq).limit(limit).all()
+
+def get_chat_cursor(db: Session, user_id: int) -> Optional[int]:
+    cursor = db.query(models.ChatCursor).filter(models.ChatCursor.user_id == user_id).first()
+    return cursor.last_seq if cursor else None
+
+def save_chat_cursor(db: Session, user_id: int, seq: int):
+    """Move the user's acknowledged position forward; never backwards"""
+    cursor = db.query(models.ChatCursor).filter(models.ChatCursor.user_id == user_id).first()
+    if cursor is None:
+        db.add(models.ChatCursor(user_id=user_id, last_seq=seq))
+    elif seq > cursor.last_seq:
+        cursor.last_seq = seq
+    db.commit()
+
+def create_study_document(db: Session, user_id: int, title: str, source: str, content_hash: str,
+                          chunks: List[str], token_counts: List[int]):
+    """Store a document and its chunks; the same text saved twice returns the existing document"""
+    existing = db.query(models.StudyDocument).filter(
+        models.StudyDocument.user_id == user_id, models.StudyDocument.content_hash == content_hash
+    ).first()
+    if existing:
+        return existing
+    document = models.StudyDocument(
+        user_id=user_id, title=title, source=source, content_hash=content_hash, token_count=sum(token_counts)
+    )
+    document.chunks = [
+        models.DocumentChunk(user_id=user_id, ordinal=i, text=text, token_count=tokens)
+        for i, (text, tokens) in enumerate(zip(chunks, token_counts))
+    ]
+    db.add(document)
+    db.commit()
+    db.refresh(document)
+    return document
+
+def list_study_documents(db: Session, user_id: int):
+    D = models.StudyDocument
+    return db.query(D).filter(D.user_id == user_id).order_by(D.created_at.desc(), D.id.desc()).all()
+
+def delete_study_document(db: Session, user_id: int, document_id: int) -> bool:
+    document = db.query(models.StudyDocument).filter(
+        models.StudyDocument.id == document_id, models.StudyDocument.user_id == user_id
+    ).first()
+    if document is None:
+        return False
+    db.delete(document)
+    db.commit()
+    return True
+
+def get_chunk_ids(db: Session, user_id: int) -> List[int]:
+    C = models.DocumentChunk
+    return [row[0] for row in db.query(C.id).filter(C.user_id == user_id).all()]
+
+def get_chunks(db: Session, user_id: int, chunk_ids: List[int]):
+    """The user's chunks among `chunk_ids`, with their documents loaded; missing or foreign ids are dropped"""
+    if not chunk_ids:
+        return []
+    C = models.DocumentChunk
+    return db.query(C).join(C.document).filter(C.user_id == user_id, C.id.in_(chunk_ids)).all()
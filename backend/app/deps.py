@@ -21,6 +21,10 @@ SECRET_KEY = os.environ.get("SECRET_KEY", "devsecret")
 ALGORITHM = "HS256"
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return user_from_token(token, db)
+
+def user_from_token(token: str, db: Session):
+    """Resolve a bearer token to its user; shared by HTTP routes and the WebSocket handshake"""
     credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials")
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
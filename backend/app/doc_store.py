@@ -0,0 +1,277 @@
+import hashlib
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import crud
+from .ai_client import get_openai_client
+from .ai_pipeline import chunk_text, estimate_tokens
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies (run a single worker there)
+    fcntl = None
+
+# Per-user retrieval over saved notes and PDFs for the AI tutor
+DOC_INDEX_DIR = os.environ.get("DOC_INDEX_DIR", "./doc_index")
+DOC_EMBEDDER = os.environ.get("DOC_EMBEDDER", "hashing")  # "hashing" (local) or "openai"
+DOC_EMBEDDING_MODEL = os.environ.get("DOC_EMBEDDING_MODEL", "text-embedding-3-small")
+DOC_EMBEDDING_DIM = int(os.environ.get("DOC_EMBEDDING_DIM", 512))
+DOC_CHUNK_TOKENS = int(os.environ.get("DOC_CHUNK_TOKENS", 300))
+DOC_CONTEXT_TOKENS = int(os.environ.get("DOC_CONTEXT_TOKENS", 1500))
+DOC_TOP_K = int(os.environ.get("DOC_TOP_K", 8))
+DOC_MIN_SCORE = float(os.environ.get("DOC_MIN_SCORE", 0.15))
+EMBED_BATCH = 64
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+class HashingEmbedder:
+    """
+    Local, stateless embeddings: word unigrams and bigrams hashed into `dim`
+    signed buckets, log-scaled and L2-normalized. No vocabulary to fit, so
+    vectors never change as documents are added and it works offline.
+    """
+
+    def __init__(self, dim: int = None):
+        self.dim = dim or DOC_EMBEDDING_DIM
+        self.name = f"hashing-{self.dim}"
+
+    def _features(self, text: str) -> List[str]:
+        words = TOKEN_RE.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed_sync(self, texts: Sequence[str]) -> np.ndarray:
+        rows, buckets, signs = [], [], []
+        for i, text in enumerate(texts):
+            for feature in self._features(text):
+                h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                rows.append(i)
+                buckets.append(h % self.dim)
+                signs.append(1.0 if h >> 63 else -1.0)
+        flat = np.array(rows, dtype=np.intp) * self.dim + np.array(buckets, dtype=np.intp)
+        counts = np.bincount(flat, weights=np.array(signs), minlength=len(texts) * self.dim)
+        vectors = counts.reshape(len(texts), self.dim).astype(np.float32)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        return _normalize(vectors)
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return await run_in_threadpool(self.embed_sync, texts)
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API through the shared client"""
+
+    def __init__(self, model: str = None, dim: int = None):
+        self.model = model or DOC_EMBEDDING_MODEL
+        self.dim = dim or DOC_EMBEDDING_DIM
+        self.name = f"openai-{self.model}-{self.dim}"
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        client = get_openai_client()
+        if client is None:
+            raise RuntimeError("OpenAI service not available")
+        response = await client.embeddings.create(model=self.model, input=list(texts), dimensions=self.dim)
+        return _normalize(np.array([item.embedding for item in response.data], dtype=np.float32))
+
+EMBEDDERS = {"hashing": HashingEmbedder, "openai": OpenAIEmbedder}
+
+_embedder = None
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        _embedder = EMBEDDERS[DOC_EMBEDDER]()
+    return _embedder
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+class VectorIndex:
+    """
+    One user's chunk vectors for one embedder: an append-only float32 matrix
+    (<name>.f32, searched through a memory map) and the chunk id of each row
+    (<name>.ids). Rows of deleted chunks are skipped at search time and dropped
+    by compact() once they make up most of the file.
+
+    Several workers (processes) share the files: writers hold an exclusive
+    flock on <name>.lock from reading the row count to the end of the write,
+    readers a shared one while loading.
+    """
+
+    def __init__(self, directory: str, name: str, dim: int):
+        self.dim = dim
+        self.vectors_path = os.path.join(directory, f"{name}.f32")
+        self.ids_path = os.path.join(directory, f"{name}.ids")
+        self.lock_path = os.path.join(directory, f"{name}.lock")
+        self.lock = threading.Lock()
+        self._loaded: Optional[Tuple[tuple, np.ndarray, np.ndarray]] = None
+        self._damaged = False
+        self.directory = directory
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with self.lock:
+            if fcntl is None or (not exclusive and not os.path.isdir(self.directory)):
+                yield
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.lock_path, "a") as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _load(self) -> Tuple[np.ndarray, np.ndarray]:
+        # The ids file is written last, so its length is the number of complete rows.
+        # Another worker may have appended or compacted, so the cache is keyed by the file itself.
+        try:
+            st = os.stat(self.ids_path)
+            signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        if self._loaded is None or self._loaded[0] != signature:
+            count = signature[1] // 8 if signature else 0
+            vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+            # Ids without their vectors can't be searched; read as empty so the next sync rebuilds the index
+            self._damaged = vectors_size < count * self.dim * 4
+            if self._damaged:
+                print(f"Vector index {self.ids_path} has {count} ids but {vectors_size // (self.dim * 4)} rows, rebuilding")
+            if count == 0 or self._damaged:
+                ids, vectors = np.zeros(0, dtype=np.int64), np.zeros((0, self.dim), dtype=np.float32)
+            else:
+                ids = np.fromfile(self.ids_path, dtype=np.int64, count=count)
+                vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+            self._loaded = (signature, ids, vectors)
+        return self._loaded[1], self._loaded[2]
+
+    def ids(self) -> np.ndarray:
+        with self._locked(exclusive=False):
+            return self._load()[0]
+
+    def append(self, ids: Sequence[int], vectors: np.ndarray):
+        with self._locked(exclusive=True):
+            existing = self._load()[0]
+            if self._damaged:
+                # Ids first, as in compact(): an interruption leaves an empty index, never misaligned rows
+                open(self.ids_path, "wb").close()
+                open(self.vectors_path, "wb").close()
+                existing = self._load()[0]
+            # Two requests can race to index the same new chunks; keep the first copy
+            fresh = ~np.isin(np.asarray(ids, dtype=np.int64), existing)
+            if not fresh.any():
+                return
+            ids, vectors = np.asarray(ids, dtype=np.int64)[fresh], vectors[fresh]
+            count = len(existing)
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.vectors_path, "ab") as out:
+                # Drop any partial rows left by an interrupted append
+                out.truncate(count * self.dim * 4)
+                out.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(self.ids_path, "ab") as out:
+                out.write(ids.tobytes())
+
+    def search(self, query: np.ndarray, live_ids: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """Top-k (chunk id, cosine) among rows whose chunk still exists"""
+        with self._locked(exclusive=False):
+            ids, vectors = self._load()
+        if len(ids) == 0:
+            return []
+        scores = vectors @ query.astype(np.float32)
+        scores[~np.isin(ids, live_ids)] = -np.inf
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def compact(self, live_ids: np.ndarray):
+        """Rewrite the files without rows for deleted chunks"""
+        with self._locked(exclusive=True):
+            ids, vectors = self._load()
+            keep = np.isin(ids, live_ids)
+            for path, data in ((self.vectors_path, np.asarray(vectors[keep])), (self.ids_path, ids[keep])):
+                with open(path + ".tmp", "wb") as out:
+                    out.write(data.tobytes())
+            # Empty the ids first: a crash part-way leaves an empty index that is rebuilt, never misaligned rows
+            open(self.ids_path, "wb").close()
+            os.replace(self.vectors_path + ".tmp", self.vectors_path)
+            os.replace(self.ids_path + ".tmp", self.ids_path)
+            self._loaded = None
+
+_indexes: Dict[Tuple[int, str], VectorIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_index(user_id: int, embedder=None) -> VectorIndex:
+    embedder = embedder or get_embedder()
+    key = (user_id, embedder.name)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = VectorIndex(os.path.join(DOC_INDEX_DIR, str(user_id)), embedder.name, embedder.dim)
+        return _indexes[key]
+
+def prepare_document(content: str) -> Tuple[str, List[str], List[int]]:
+    """Content hash, chunks and their token estimates for a new document"""
+    chunks = chunk_text(content, DOC_CHUNK_TOKENS)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest(), chunks, [estimate_tokens(c) for c in chunks]
+
+async def sync_index(db: Session, user_id: int, embedder=None) -> np.ndarray:
+    """
+    Bring the user's index up to date with their chunks: embed only chunks that
+    have no row yet (so adding a document costs just its own chunks, and a new
+    embedder backfills itself), and compact once deleted rows outnumber live
+    ones. Returns the live chunk ids.
+    """
+    embedder = embedder or get_embedder()
+    index = get_index(user_id, embedder)
+    live = np.array(await run_in_threadpool(crud.get_chunk_ids, db, user_id), dtype=np.int64)
+    indexed = await run_in_threadpool(index.ids)
+    missing = np.setdiff1d(live, indexed)
+    if len(missing):
+        chunks = {c.id: c.text for c in await run_in_threadpool(crud.get_chunks, db, user_id, missing.tolist())}
+        for start in range(0, len(missing), EMBED_BATCH):
+            batch = [int(i) for i in missing[start:start + EMBED_BATCH] if int(i) in chunks]
+            vectors = await embedder.embed([chunks[i] for i in batch])
+            await run_in_threadpool(index.append, batch, vectors)
+    dead = len(indexed) - np.isin(indexed, live).sum()
+    if dead > max(len(live), EMBED_BATCH):
+        await run_in_threadpool(index.compact, live)
+    return live
+
+async def search(db: Session, user_id: int, query: str, k: int = None, embedder=None) -> List[dict]:
+    """The user's chunks most similar to `query`, best first, as {chunk, score} dicts"""
+    embedder = embedder or get_embedder()
+    live = await sync_index(db, user_id, embedder)
+    if not len(live):
+        return []
+    query_vector = (await embedder.embed([query]))[0]
+    ranked = await run_in_threadpool(get_index(user_id, embedder).search, query_vector, live, k or DOC_TOP_K)
+    chunks = {c.id: c for c in await run_in_threadpool(crud.get_chunks, db, user_id, [i for i, _ in ranked])}
+    return [{"chunk": chunks[i], "score": score} for i, score in ranked if i in chunks]
+
+def build_context(hits: List[dict], max_tokens: int = None, min_score: float = None) -> Tuple[str, List[dict]]:
+    """
+    Pack the best hits into at most `max_tokens` estimated tokens, skipping
+    weak matches. Returns the excerpt text for the prompt and its sources.
+    """
+    max_tokens = max_tokens or DOC_CONTEXT_TOKENS
+    min_score = DOC_MIN_SCORE if min_score is None else min_score
+    parts, sources, used = [], [], 0
+    for hit in hits:
+        chunk = hit["chunk"]
+        if hit["score"] < min_score or used + chunk.token_count > max_tokens:
+            continue
+        used += chunk.token_count
+        parts.append(f"[{len(parts) + 1}] {chunk.document.title}\n{chunk.text}")
+        sources.append({
+            "document_id": chunk.document_id,
+            "title": chunk.document.title,
+            "chunk": chunk.ordinal,
+            "score": round(hit["score"], 4),
+        })
+    return "\n\n".join(parts), sources
@@ -0,0 +1,217 @@
+import os
+import re
+import calendar
+import zipfile
+import anyio
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import BinaryIO, Callable, Iterable, NamedTuple, Optional
+from urllib.parse import quote
+from fastapi import Request, HTTPException
+from starlette.responses import Response
+from starlette.types import Scope, Receive, Send
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class RangeFileResponse(Response):
+    """
+    Sends bytes [start, end] of a file. Uses the ASGI zero-copy send extension
+    (os.sendfile in the server) when the server advertises it, and otherwise
+    streams fixed-size chunks so the file is never read into memory whole.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, start: int, end: int, status_code: int = 200,
+                 headers: Optional[dict] = None, media_type: Optional[str] = None, method: str = "GET"):
+        self.path = path
+        self.start = start
+        self.count = max(end - start + 1, 0)
+        self.status_code = status_code
+        self.media_type = media_type
+        self.send_header_only = method.upper() == "HEAD"
+        self.background = None
+        self.init_headers(headers)
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.start,
+                    "count": self.count,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def _http_date(dt: datetime) -> str:
+    return formatdate(calendar.timegm(dt.utctimetuple()), usegmt=True)
+
+def _parse_http_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        return None
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def _parse_range(header: str, size: int):
+    """Returns (start, end) for a single byte range, None to ignore, or raises 416"""
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple ranges or unknown units: serving the full body is allowed
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0:
+            raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def file_download_response(request: Request, path: str, sha256: Optional[str],
+                           last_modified: datetime, filename: Optional[str] = None) -> Response:
+    """
+    Build a download response with ETag/Last-Modified validators, 304 handling
+    for conditional requests and single-range 206 responses.
+    """
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, TypeError):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Stored checksums give a strong validator; legacy rows fall back to a weak one
+    etag = f'"{sha256}"' if sha256 else f'W/"{int(st.st_mtime)}-{st.st_size}"'
+    headers = {
+        "etag": etag,
+        "last-modified": _http_date(last_modified),
+        "accept-ranges": "bytes",
+        "cache-control": "private, no-cache",
+    }
+    if filename:
+        quoted = quote(filename)
+        if quoted != filename:
+            headers["content-disposition"] = f"attachment; filename*=utf-8''{quoted}"
+        else:
+            headers["content-disposition"] = f'attachment; filename="{filename}"'
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    else:
+        since = _parse_http_date(request.headers.get("if-modified-since"))
+        if since is not None and last_modified.replace(microsecond=0) <= since:
+            return Response(status_code=304, headers=headers)
+
+    media_type = guess_type(filename or path)[0] or "application/octet-stream"
+    size = st.st_size
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and request.method in ("GET", "HEAD"):
+        if_range = request.headers.get("if-range")
+        # If-Range only honours strong validators; anything else sends the full body
+        if if_range is None or (if_range.strip() == etag and not etag.startswith("W/")):
+            byte_range = _parse_range(range_header, size)
+
+    if byte_range is None:
+        return RangeFileResponse(path, 0, size - 1, headers=headers, media_type=media_type, method=request.method)
+
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+    return RangeFileResponse(path, start, end, status_code=206, headers=headers,
+                             media_type=media_type, method=request.method)
+
+class _ZipSink:
+    """Write-only, unseekable file object that hands written bytes back to the caller"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+class ZipEntry(NamedTuple):
+    name: str
+    size: int
+    modified: datetime
+    open: Callable[[], BinaryIO]
+
+def stream_zip(entries: Iterable[ZipEntry], chunk_size: int = 1024 * 1024):
+    """
+    Generate a ZIP archive from entries without buffering it.
+
+    Entries are stored uncompressed (uploads are mostly PDFs/images that don't
+    deflate) and written with data descriptors, so bytes are yielded as soon as
+    each chunk is read and memory stays at roughly one chunk. Entries whose
+    source has disappeared are skipped.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for entry in entries:
+            try:
+                source = entry.open()
+            except FileNotFoundError:
+                continue
+            info = zipfile.ZipInfo(entry.name, date_time=entry.modified.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with source, archive.open(info, mode="w", force_zip64=entry.size >= zipfile.ZIP64_LIMIT) as dest:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
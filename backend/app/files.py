@@ -1,18 +1,158 @@
 import os
-from fastapi import UploadFile
-from uuid import uuid4
+import json
+import time
+import hashlib
+from fastapi import UploadFile, HTTPException
+from sqlalchemy.orm import Session
+from typing import NamedTuple
+from starlette.concurrency import run_in_threadpool
+from .storage import get_storage
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 UPLOAD_DIR = os.path.join(BASE_DIR, '..', 'uploads')
 UPLOAD_DIR = os.path.abspath(UPLOAD_DIR)
 
+# Uploads larger than this are rejected with 413 (override with MAX_UPLOAD_SIZE, in bytes)
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 50 * 1024 * 1024))
+CHUNK_SIZE = 1024 * 1024
+# Room for multipart boundaries, part headers and small form fields next to the file
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+# Unreferenced blobs and stale temp files younger than this are never collected,
+# which covers the gap between an upload landing and its Submission committing.
+GC_GRACE_SECONDS = 60 * 60
+
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def save_upload_file(upload_file: UploadFile) -> str:
-    ext = os.path.splitext(upload_file.filename)[1]
-    fname = f"{uuid4().hex}{ext}"
-    dest = os.path.join(UPLOAD_DIR, fname)
-    with open(dest, 'wb') as buffer:
-        for chunk in upload_file.file.read().splitlines():
-            buffer.write(chunk + b"\n")
-    return dest
+class StoredFile(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+    deduplicated: bool = False
+
+def _too_large():
+    return HTTPException(status_code=413, detail=f"File exceeds maximum upload size of {MAX_UPLOAD_SIZE} bytes")
+
+class UploadSizeLimitMiddleware:
+    """
+    Turn away oversized multipart requests before they are received: by the
+    time a route sees an UploadFile, Starlette has already spooled the whole
+    body to disk. A Content-Length over the limit gets 413 without reading the
+    body; chunked bodies are counted as they arrive and cut off at the limit.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        limit = MAX_UPLOAD_SIZE + UPLOAD_FORM_OVERHEAD
+        length = headers.get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            body = json.dumps({"detail": _too_large().detail}).encode()
+            await send({"type": "http.response.start", "status": 413, "headers": [
+                (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        received = 0
+
+        async def counted_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _too_large()
+            return message
+
+        await self.app(scope, counted_receive, send)
+
+async def save_upload_file(upload_file: UploadFile, max_size: int = None) -> StoredFile:
+    """Hash the spooled upload in chunks, enforcing the exact size limit, and store it unless that blob already exists"""
+    max_size = MAX_UPLOAD_SIZE if max_size is None else max_size
+    if upload_file.size is not None and upload_file.size > max_size:
+        raise _too_large()
+
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = await upload_file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise _too_large()
+        digest.update(chunk)
+    sha256 = digest.hexdigest()
+
+    storage = get_storage()
+    if await run_in_threadpool(storage.touch, sha256):
+        return StoredFile(storage.location(sha256), sha256, size, deduplicated=True)
+
+    await upload_file.seek(0)
+    location = await storage.save(sha256, upload_file, CHUNK_SIZE)
+    return StoredFile(location, sha256, size)
+
+def blob_refcount(db: Session, sha256: str) -> int:
+    from . import models
+    return db.query(models.Submission).filter(models.Submission.file_sha256 == sha256).count()
+
+def collect_garbage(db: Session, grace_seconds: int = GC_GRACE_SECONDS, dry_run: bool = False) -> dict:
+    """
+    Delete blobs no Submission references, plus abandoned temp files.
+
+    Safe to run alongside uploads: anything modified within grace_seconds is
+    kept, and uploads that hit an existing blob touch it first. The listing
+    can be minutes old by the time a blob comes up for deletion, so references
+    are read after it, and storage.retire() deletes each candidate in a way a
+    concurrent touch can't slip past: a duplicate upload either keeps the blob
+    or misses it and writes its own copy. A dry run skips that last check.
+    """
+    from . import models
+    cutoff = time.time() - grace_seconds
+    storage = get_storage()
+    blobs = list(storage.iter_blobs())
+    referenced = {
+        sha for (sha,) in db.query(models.Submission.file_sha256)
+        .filter(models.Submission.file_sha256.isnot(None)).distinct()
+    }
+
+    removed, freed, kept = 0, 0, 0
+    for sha256, mtime, size in blobs:
+        if sha256 in referenced or mtime > cutoff:
+            kept += 1
+            continue
+        # A duplicate upload may have touched it since the listing
+        if not dry_run and not storage.retire(sha256, cutoff):
+            kept += 1
+            continue
+        removed += 1
+        freed += size
+
+    if not dry_run:
+        storage.cleanup_temp(cutoff)
+
+    return {"removed": removed, "freed_bytes": freed, "kept": kept}
+
+if __name__ == "__main__":
+    import argparse
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Remove upload blobs no submission references")
+    parser.add_argument("--grace", type=int, default=GC_GRACE_SECONDS, help="Keep blobs modified within this many seconds")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(collect_garbage(db, grace_seconds=args.grace, dry_run=args.dry_run))
+    finally:
+        db.close()
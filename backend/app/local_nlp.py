@@ -0,0 +1,310 @@
+import hashlib
+import re
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# Offline study-material engine, used when the model is unavailable or shed:
+# extractive summaries (TextRank over TF-IDF sentence vectors), key terms for
+# flashcards and concept maps, and cloze quizzes. Everything is computed from
+# one sparse sentence x term matrix (only the nonzero entries are stored), built
+# once per text and shared by all four outputs.
+
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])|\n\s*\n|\n(?=\s*(?:[-*•]|\d+[.)])\s)")
+WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9'-]*[A-Za-z0-9]|[A-Za-z]")
+DEFINITION_RE = r"\b(is|are|was|were|refers to|means|describes|consists of)\b"
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are aren't as at be because been before being below
+between both but by can can't cannot could couldn't did didn't do does doesn't doing don't down during each
+either etc few for from further had hadn't has hasn't have haven't having he her here hers herself him himself
+his how however i if in into is isn't it it's its itself just let's like made make makes many may me might more
+most much must my myself no nor not now of off often on once one only or other our ours ourselves out over own
+per same shall she should shouldn't so some such than that that's the their theirs them themselves then there
+these they this those through thus to too two under until up upon us use used uses using very via was wasn't we
+were weren't what when where whether which while who whom whose why will with within without would you your
+yours yourself also e.g i.e called known include includes including example examples first second third
+""".split()) | frozenset(
+    # Study-text filler that ranks high on frequency but never names a concept
+    """
+help helps helped explain explains explained work works worked show shows shown describe describes described
+understand understanding important different several various often related continue continues chapter page
+pages section figure diagram textbook students student detail details way ways thing things new question
+questions compare compares compared review notes lecture unit
+""".split())
+
+MAX_SENTENCE_CHARS = 400
+SUMMARY_REDUNDANCY = 1.0  # How strongly summary sentences are penalized for repeating picked ones
+TEXTRANK_DAMPING = 0.85
+TEXTRANK_ITERATIONS = 50
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences with 3+ words; exact repeats (page headers and footers in PDF text) are kept once"""
+    sentences, seen = [], set()
+    for raw in SENTENCE_SPLIT_RE.split(text):
+        sentence = " ".join(raw.split()).lstrip("-*• ")
+        if len(WORD_RE.findall(sentence)) >= 3 and sentence.lower() not in seen:
+            seen.add(sentence.lower())
+            sentences.append(sentence[:MAX_SENTENCE_CHARS])
+    return sentences
+
+def _words(sentence: str) -> List[str]:
+    return [w.lower() for w in WORD_RE.findall(sentence)]
+
+class Document:
+    """
+    Sentences of one text and their TF-IDF matrix (rows L2-normalized), kept
+    sparse: entry k is (rows[k], cols[k]) = values[k], sorted by sentence.
+    Memory and time grow with the number of words, not sentences x vocabulary.
+
+    Terms are non-stopword unigrams plus adjacent-word bigrams that occur at
+    least twice, so "cell membrane" can be a key term on its own.
+    """
+
+    def __init__(self, text: str):
+        self.sentences = split_sentences(text)
+        vocab: Dict[str, int] = {}
+        rows, cols = [], []
+        bigram_counts: Dict[str, int] = {}
+        sentence_terms = []
+        defined: Dict[str, int] = {}
+        for sentence in self.sentences:
+            words = _words(sentence)
+            terms = [w for w in words if w not in STOPWORDS and len(w) > 2 and not w.isdigit()]
+            bigrams = [
+                f"{a} {b}" for a, b in zip(words, words[1:])
+                if a not in STOPWORDS and b not in STOPWORDS and len(a) > 2 and len(b) > 2
+            ]
+            for bigram in bigrams:
+                bigram_counts[bigram] = bigram_counts.get(bigram, 0) + 1
+            sentence_terms.append((terms, bigrams))
+            # "X is ...", "X refers to ...": the subject of a definition is likely a concept
+            match = re.search(DEFINITION_RE, sentence, re.IGNORECASE)
+            if match:
+                subject = words[:len(_words(sentence[:match.start()]))]
+                if 0 < len(subject) <= 4:
+                    for term in subject + [f"{a} {b}" for a, b in zip(subject, subject[1:])]:
+                        defined[term] = defined.get(term, 0) + 1
+
+        for i, (terms, bigrams) in enumerate(sentence_terms):
+            for term in terms + [b for b in bigrams if bigram_counts[b] >= 2]:
+                rows.append(i)
+                cols.append(vocab.setdefault(term, len(vocab)))
+
+        self.vocab = vocab
+        self.terms = sorted(vocab, key=vocab.get)
+        n, size = len(self.sentences), len(vocab)
+        # Duplicate (sentence, term) pairs collapse into counts, in sentence-major order
+        keys, counts = np.unique(np.array(rows, dtype=np.int64) * size + np.array(cols, dtype=np.int64),
+                                 return_counts=True)
+        self.rows, self.cols = keys // max(size, 1), keys % max(size, 1)
+        df = np.bincount(self.cols, minlength=size)
+        idf = np.log((1 + n) / (1 + df)) + 1.0
+        self.term_frequency = np.bincount(self.cols, weights=counts, minlength=size)
+        self.defined = np.array([defined.get(term, 0) for term in self.terms], dtype=np.float32)
+        self.is_phrase = np.array([" " in term for term in self.terms], dtype=bool)
+        values = np.log1p(counts) * idf[self.cols]
+        norms = np.sqrt(np.bincount(self.rows, weights=values ** 2, minlength=n))
+        self.values = values / norms[self.rows] if len(values) else values
+        # Column view: the sentences containing each term, ascending
+        self._term_rows = self.rows[np.argsort(self.cols, kind="stable")]
+        self._term_starts = np.concatenate(([0], np.cumsum(df)))
+        self._self_similarity = np.bincount(self.rows, weights=self.values ** 2, minlength=n)
+        self._scores = None
+
+    def sentences_with(self, term: str) -> np.ndarray:
+        column = self.vocab[term]
+        return self._term_rows[self._term_starts[column]:self._term_starts[column + 1]]
+
+    def _similarity_dot(self, x: np.ndarray) -> np.ndarray:
+        """S @ x for the sentence cosine-similarity matrix S (zero diagonal), without building S"""
+        per_term = np.bincount(self.cols, weights=self.values * x[self.rows], minlength=len(self.terms))
+        return np.bincount(self.rows, weights=self.values * per_term[self.cols],
+                           minlength=len(self.sentences)) - self._self_similarity * x
+
+    def similarity_to(self, i: int) -> np.ndarray:
+        """Cosine similarity of sentence i to every sentence"""
+        start, end = np.searchsorted(self.rows, [i, i + 1])
+        row = np.zeros(len(self.terms))
+        row[self.cols[start:end]] = self.values[start:end]
+        return np.bincount(self.rows, weights=self.values * row[self.cols], minlength=len(self.sentences))
+
+    def sentence_scores(self) -> np.ndarray:
+        """TextRank: PageRank over the cosine-similarity graph of the sentences"""
+        if self._scores is None:
+            n = len(self.sentences)
+            if n == 0:
+                self._scores = np.zeros(0)
+                return self._scores
+            out_weight = self._similarity_dot(np.ones(n))
+            # Sentences sharing no terms with any other spread their rank evenly
+            dangling = out_weight <= 1e-12
+            out_weight[dangling] = 1.0
+            scores = np.full(n, 1.0 / n)
+            for _ in range(TEXTRANK_ITERATIONS):
+                spread = self._similarity_dot(np.where(dangling, 0.0, scores / out_weight))
+                updated = (1 - TEXTRANK_DAMPING) / n + TEXTRANK_DAMPING * (spread + scores[dangling].sum() / n)
+                if np.abs(updated - scores).sum() < 1e-6:
+                    scores = updated
+                    break
+                scores = updated
+            self._scores = scores
+        return self._scores
+
+    def key_terms(self, k: int) -> List[str]:
+        """
+        Top terms by total TF-IDF weight, boosted for phrases and for terms that
+        are the subject of a definition; a word already covered by a chosen
+        phrase (or the reverse) is skipped.
+        """
+        if not self.terms:
+            return []
+        weight = np.bincount(self.cols, weights=self.values, minlength=len(self.terms))
+        weight = weight * np.where(self.term_frequency >= 2, 1.0, 0.5)
+        weight = weight * np.where(self.is_phrase, 1.5, 1.0) * (1 + np.minimum(self.defined, 3))
+        chosen: List[str] = []
+        for index in np.argsort(-weight, kind="stable"):
+            term = self.terms[index]
+            if any(term in other.split() or other in term.split() for other in chosen):
+                continue
+            chosen.append(term)
+            if len(chosen) == k:
+                break
+        return chosen
+
+    def label(self, term: str) -> str:
+        """How the term is written mid-sentence ("DNA replication"), rather than lowercased"""
+        words = r"\W+".join(map(re.escape, term.split()))
+        pattern = re.compile(rf"(?<=\w\W)\b{words}\b", re.IGNORECASE)
+        for i in self.sentences_with(term):
+            match = pattern.search(self.sentences[i])
+            if match:
+                return match.group(0)
+        return term
+
+    def best_sentence(self, term: str) -> int:
+        """Index of the highest-ranked sentence containing `term`, preferring ones that define it"""
+        candidates = self.sentences_with(term)
+        scores = self.sentence_scores()[candidates].copy()
+        pattern = re.compile(rf"\b{re.escape(term)}\b\s+{DEFINITION_RE}", re.IGNORECASE)
+        for j, i in enumerate(candidates):
+            if pattern.search(self.sentences[i]):
+                scores[j] += 1.0
+        return int(candidates[int(np.argmax(scores))])
+
+@lru_cache(maxsize=4)
+def analyze(text: str) -> Document:
+    """
+    The Document for `text`, built once: a study pack falling back for several
+    sections in a row analyzes the text a single time.
+    """
+    return Document(text)
+
+def summarize(text: str, sentences: int = 3) -> str:
+    doc = analyze(text)
+    if not doc.sentences:
+        return text.strip()[:200]
+    # Definitions make the best summary sentences for study material
+    opener = re.compile(rf"^\W*(\w+\W+){{1,4}}{DEFINITION_RE}", re.IGNORECASE)
+    defines = np.array([bool(opener.match(sentence)) for sentence in doc.sentences])
+    scores = doc.sentence_scores() * np.where(defines, 3.0, 1.0)
+    relevance = scores / scores.max()
+    # Maximal marginal relevance: each pick trades rank against overlap with the sentences already picked
+    overlap = np.zeros(len(doc.sentences))
+    chosen = []
+    for _ in range(min(sentences, len(doc.sentences))):
+        gain = relevance - SUMMARY_REDUNDANCY * overlap
+        gain[chosen] = -np.inf
+        i = int(np.argmax(gain))
+        chosen.append(i)
+        overlap = np.maximum(overlap, doc.similarity_to(i))
+    return " ".join(doc.sentences[i] for i in sorted(chosen))
+
+def flashcards(text: str, count: int = 6) -> List[dict]:
+    doc = analyze(text)
+    cards, used = [], set()
+    for term in doc.key_terms(count * 2):
+        i = doc.best_sentence(term)
+        if i in used:
+            continue
+        used.add(i)
+        sentence = doc.sentences[i]
+        defines = re.search(rf"\b{re.escape(term)}\b\s+{DEFINITION_RE}", sentence, re.IGNORECASE)
+        if defines:
+            verb = "are" if defines.group(1).lower() in ("are", "were") else "is"
+            question = f"What {verb} {doc.label(term)}?"
+        else:
+            question = f"What does the material say about {doc.label(term)}?"
+        cards.append({"q": question, "a": sentence})
+        if len(cards) == count:
+            break
+    return cards
+
+def _shuffle_position(seed: str, size: int) -> int:
+    # Deterministic per question, so the same text always produces the same quiz
+    return hashlib.sha1(seed.encode("utf-8")).digest()[0] % size
+
+def quiz(text: str, count: int = 5) -> List[dict]:
+    """Cloze questions: a key sentence with its key term blanked, other key terms as distractors"""
+    doc = analyze(text)
+    terms = doc.key_terms(max(count * 3, 8))
+    questions, used = [], set()
+    for term in terms:
+        i = doc.best_sentence(term)
+        if i in used:
+            continue
+        pattern = re.compile(rf"\b{re.escape(term)}\b", re.IGNORECASE)
+        sentence = doc.sentences[i]
+        distractors = [
+            other for other in terms
+            if other != term and not re.search(rf"\b{re.escape(other)}\b", sentence, re.IGNORECASE)
+        ]
+        # Same shape of answer (one word vs. a phrase) makes the distractors plausible
+        distractors.sort(key=lambda other: (other.count(" ") != term.count(" "), terms.index(other)))
+        if len(distractors) < 3:
+            continue
+        used.add(i)
+        options = [doc.label(other) for other in distractors[:3]]
+        answer = _shuffle_position(sentence, 4)
+        options.insert(answer, doc.label(term))
+        questions.append({
+            "question": pattern.sub("_____", sentence),
+            "options": options,
+            "correct_answer": answer,
+        })
+        if len(questions) == count:
+            break
+    return questions
+
+def concept_map(text: str, nodes: int = 8) -> Tuple[List[dict], List[dict]]:
+    """Key terms as nodes, linked when they appear in the same sentences (strongest links first)"""
+    doc = analyze(text)
+    terms = doc.key_terms(nodes)
+    if not terms:
+        return [], []
+    present = np.zeros((len(doc.sentences), len(terms)), dtype=np.float32)
+    for j, term in enumerate(terms):
+        present[doc.sentences_with(term), j] = 1
+    together = present.T @ present
+    np.fill_diagonal(together, 0)
+
+    edges = []
+    linked = set()
+    for a, b in zip(*np.nonzero(np.triu(together))):
+        edges.append((float(together[a, b]), int(a), int(b)))
+    edges.sort(key=lambda edge: (-edge[0], edge[1], edge[2]))
+    edges = edges[:len(terms) * 2]
+    for _, a, b in edges:
+        linked.update((a, b))
+    # Terms that never share a sentence hang off the most central term, so the map stays connected
+    for i in range(1, len(terms)):
+        if i not in linked:
+            edges.append((0.0, 0, i))
+            linked.update((0, i))
+    if 0 not in linked and len(terms) > 1:
+        edges.append((0.0, 0, 1))
+
+    node_list = [{"id": i, "label": doc.label(term), "type": "concept"} for i, term in enumerate(terms)]
+    edge_list = [{"from": a, "to": b, "label": "relates to"} for _, a, b in edges]
+    return node_list, edge_list
@@ -2,8 +2,12 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from .database import engine
+from .chat_writer import message_writer, message_sequence
+from .ai_client import close_openai_client
+from .pdf_extract import shutdown_pool
+from .files import UploadSizeLimitMiddleware
 from . import models
-from .routers import auth, sessions, ai, homework, ws, feedback, progress, profile, grades
+from .routers import auth, sessions, ai, homework, ws, feedback, progress, profile, grades, messages, documents
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,6 +16,8 @@ models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="TeachForward API")
 
+# Added first so it runs inside CORS: a 413 still carries the CORS headers
+app.add_middleware(UploadSizeLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:3001"],
@@ -29,6 +35,20 @@ app.include_router(progress.router)
 app.include_router(profile.router)
 app.include_router(ws.router)
 app.include_router(grades.router)
+app.include_router(messages.router)
+app.include_router(documents.router)
+
+@app.on_event("startup")
+async def start_background_writers():
+    await message_sequence.claim(ws.manager.broker)
+    await message_writer.start()
+
+@app.on_event("shutdown")
+async def flush_background_writers():
+    await ws.manager.stop()
+    await message_writer.stop()
+    await close_openai_client()
+    shutdown_pool()
 
 @app.get("/health")
 def health():
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Float
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Float, Index, BigInteger
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -51,6 +51,8 @@ class Assignment(Base):
     tutor = relationship("User", foreign_keys=[tutor_id])
     student = relationship("User", foreign_keys=[student_id])
     session = relationship("SessionBooking", foreign_keys=[session_id])
+    # Serves both feed branches: student_id = :me and student_id IS NULL, ordered by due date
+    __table_args__ = (Index("ix_assignments_student_due", "student_id", "due_date", "id"),)
 
 class Submission(Base):
     __tablename__ = "submissions"
@@ -58,11 +60,15 @@ class Submission(Base):
     assignment_id = Column(Integer, ForeignKey("assignments.id"), nullable=False)
     student_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     file_path = Column(String, nullable=True)
+    file_name = Column(String, nullable=True)
+    file_sha256 = Column(String(64), nullable=True, index=True)
+    file_size = Column(Integer, nullable=True)
     grade = Column(String, nullable=True)
     feedback = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     assignment = relationship("Assignment")
     student = relationship("User")
+    __table_args__ = (Index("ix_submissions_student_assignment", "student_id", "assignment_id", "id"),)
 
 class Feedback(Base):
     __tablename__ = "feedback"
@@ -82,10 +88,69 @@ class Message(Base):
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     receiver_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    room = Column(String, nullable=True, index=True)  # e.g. "session:12" or "pair:3:7"
+    conversation_key = Column(String, nullable=True)  # "dm:<low id>:<high id>" or "room:<room>"
+    seq = Column(BigInteger, nullable=True)  # Assigned at send time; resume cursor for reconnecting clients
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     sender = relationship("User", foreign_keys=[sender_id])
     receiver = relationship("User", foreign_keys=[receiver_id])
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_key", "created_at", "id"),
+        Index("ix_messages_conversation_seq", "conversation_key", "seq"),
+        Index("ux_messages_seq", "seq", unique=True),
+    )
+
+class ConversationSummary(Base):
+    """Per-user inbox row, maintained as messages are persisted"""
+    __tablename__ = "conversation_summaries"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    conversation_key = Column(String, primary_key=True)
+    peer_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # Other user for direct messages
+    room = Column(String, nullable=True)
+    last_sender_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    last_content = Column(Text, nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+    unread_count = Column(Integer, default=0, nullable=False)
+    __table_args__ = (Index("ix_conversation_summaries_user_recent", "user_id", "last_message_at"),)
+
+class ChatCursor(Base):
+    """Highest message sequence number a user has acknowledged over the WebSocket"""
+    __tablename__ = "chat_cursors"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    last_seq = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class RoomMembershipEvent(Base):
+    __tablename__ = "room_membership_events"
+    id = Column(Integer, primary_key=True, index=True)
+    room = Column(String, nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    action = Column(String, nullable=False)  # "join" or "leave"
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class StudyDocument(Base):
+    """Notes or extracted PDF text a student saved for the AI tutor to search"""
+    __tablename__ = "study_documents"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    title = Column(String, nullable=False)
+    source = Column(String, nullable=False, default="note")  # "note" or "pdf"
+    content_hash = Column(String, nullable=False)  # sha256 of the text; re-adding the same text is a no-op
+    token_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
+
+class DocumentChunk(Base):
+    """A retrieval unit of a StudyDocument; its vector lives in the user's index file, keyed by id"""
+    __tablename__ = "document_chunks"
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("study_documents.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    ordinal = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=False)
+    document = relationship("StudyDocument", back_populates="chunks")
 
 class Progress(Base):
     __tablename__ = "progress"
@@ -0,0 +1,17 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import HTTPException
+
+def encode_cursor(position: Optional[datetime], row_id: int) -> str:
+    """Opaque keyset cursor for a (timestamp, id) sort position"""
+    raw = json.dumps([position.isoformat() if position else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    try:
+        position, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (datetime.fromisoformat(position) if position else None, int(row_id))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, BinaryIO, List, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from .ai_cache import ResponseCache
+
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", min(4, os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 25))
+PDF_CACHE_PATH = os.environ.get("PDF_CACHE_PATH", "./pdf_text_cache.db")
+CHUNK_SIZE = 1024 * 1024
+
+# Extracted page text by (file sha256, page); a separate file so it doesn't skew AI cache metrics
+text_cache = ResponseCache(path=PDF_CACHE_PATH, memory_entries=1024)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs an event loop and threadpool isn't safe
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _page_key(sha256: str, page: int) -> str:
+    return f"pdf:{sha256}:{page}"
+
+def _count_key(sha256: str) -> str:
+    return f"pdf:{sha256}:pages"
+
+def spool_to_temp(fileobj: BinaryIO) -> Tuple[str, str]:
+    """Copy an upload to a temp file the pool workers can open, hashing it on the way"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as out:
+        while True:
+            chunk = fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return out.name, digest.hexdigest()
+
+# Per worker process: the last opened reader, so a file's xref and page tree are parsed once per worker, not per range
+_reader = (None, None)
+
+def _open_reader(path: str):
+    global _reader
+    from PyPDF2 import PdfReader
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if _reader[0] != key:
+        _reader = (key, PdfReader(path))
+    return _reader[1]
+
+def _count_pages(path: str) -> int:
+    return len(_open_reader(path).pages)
+
+def _extract_range(path: str, pages: List[int]) -> List[str]:
+    """Runs in a pool worker: text of the given 0-based pages"""
+    reader = _open_reader(path)
+    return [reader.pages[page].extract_text() or "" for page in pages]
+
+def parse_page_spec(spec: Optional[str], total: int) -> List[int]:
+    """
+    "1-3,7,10-" (1-based, inclusive, open-ended ranges allowed) -> sorted 0-based
+    page numbers. None or "" selects every page. Raises ValueError when invalid.
+    """
+    if not spec:
+        return list(range(total))
+    selected = set()
+    for part in spec.split(","):
+        part = part.strip()
+        start, sep, stop = part.partition("-")
+        if not start.isdigit() or (stop and not stop.isdigit()):
+            raise ValueError(f"Invalid page range: {part!r}")
+        first = int(start)
+        last = (int(stop) if stop else total) if sep else first
+        if first < 1 or last > total or first > last:
+            raise ValueError(f"Page range {part!r} is outside 1-{total}")
+        selected.update(range(first - 1, last))
+    return sorted(selected)
+
+async def page_count(path: str, sha256: str) -> int:
+    cached = await run_in_threadpool(text_cache.get, _count_key(sha256))
+    if cached is not None:
+        return cached
+    total = await asyncio.get_running_loop().run_in_executor(get_pool(), _count_pages, path)
+    await run_in_threadpool(text_cache.set, _count_key(sha256), total)
+    return total
+
+async def extract_pages(path: str, sha256: str, pages: List[int]) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Yield (page, text) in page order. Pages already extracted for this file
+    hash come from the cache; the rest are split into runs of
+    PDF_PAGES_PER_TASK pages and extracted in parallel on the process pool.
+    Work that hasn't started is cancelled if the consumer stops early.
+    """
+    keys = {page: _page_key(sha256, page) for page in pages}
+    cached = await run_in_threadpool(text_cache.get_many, list(keys.values()))
+    missing = [page for page in pages if keys[page] not in cached]
+
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    ranges = [missing[i:i + PDF_PAGES_PER_TASK] for i in range(0, len(missing), PDF_PAGES_PER_TASK)]
+    futures = {}
+    for run in ranges:
+        future = loop.run_in_executor(pool, _extract_range, path, run)
+        for page in run:
+            futures[page] = (run, future)
+
+    done = {}
+    try:
+        for page in pages:
+            if keys[page] in cached:
+                yield page, cached[keys[page]]
+                continue
+            if page not in done:
+                run, future = futures[page]
+                texts = await future
+                done.update(zip(run, texts))
+                await run_in_threadpool(text_cache.set_many, {keys[p]: t for p, t in zip(run, texts)})
+            yield page, done[page]
+    finally:
+        for _, future in futures.values():
+            future.cancel()
@@ -1,26 +1,39 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
-from pydantic import BaseModel
-from typing import List, Optional
-from ..deps import get_current_user
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, validator
+from typing import Callable, List, Optional, Type
+from starlette.concurrency import run_in_threadpool
+from ..ai_cache import response_cache, cache_key
+from ..ai_client import get_openai_client
+from ..ai_metrics import ai_metrics
+from ..ai_output import (
+    FlashcardSet, Quiz, ConceptMap, NoteSections, TopicFlashcards, TopicQuiz, StudyPackOutput,
+    complete_structured, output_stats,
+)
+from ..singleflight import SingleFlight
+from ..ai_pipeline import AI_SINGLE_PASS_TOKENS, estimate_tokens, chunk_text, bounded_map, reduce_hierarchically
+from ..deps import get_db, get_current_user
 from ..models import User
-import os
+from .. import pdf_extract, local_nlp, doc_store
+from sqlalchemy.orm import Session
 import json
-import re
-import io
-from PyPDF2 import PdfReader
+import os
+import time
+import anyio
 
 router = APIRouter(prefix="/ai", tags=["ai"])
 
-# Get OpenAI client lazily (called when needed, not at module load)
-def get_openai_client():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        return None
-    try:
-        from openai import OpenAI
-        return OpenAI(api_key=api_key)
-    except ImportError:
-        return None
+MODEL = "gpt-4o-mini"
+
+# Identical model calls already in flight on this worker are shared, not repeated
+inflight = SingleFlight()
+
+# Above this many distinct model calls in flight on a worker, cache misses are
+# answered by the local engine instead of queueing behind the model (0 = never)
+AI_SHED_IN_FLIGHT = int(os.environ.get("AI_SHED_IN_FLIGHT", 0))
+
+# Request header to skip the response cache ("bypass"); responses echo hit/miss/bypass/shed
+CACHE_HEADER = "X-AI-Cache"
 
 class TextIn(BaseModel):
     text: str
@@ -33,325 +46,474 @@ class GenerateQuizRequest(BaseModel):
     topic: str
     num_questions: int = 5
 
-class SummarizeRequest(BaseModel):
-    text: str
-
 class ChatRequest(BaseModel):
     message: str
     history: Optional[List[dict]] = []
+    stream: bool = False  # Reply as Server-Sent Events, one per token chunk
+    use_documents: bool = True  # Add the most relevant excerpts from the user's saved documents
 
-class QuizQuestion(BaseModel):
-    question: str
-    options: List[str]
-    correct_answer: int
+STUDY_PACK_SECTIONS = ("summary", "flashcards", "quiz", "concept_map")
+
+class StudyPackRequest(BaseModel):
+    text: str
+    sections: List[str] = list(STUDY_PACK_SECTIONS)
+
+    @validator("sections")
+    def known_sections(cls, sections):
+        unknown = set(sections) - set(STUDY_PACK_SECTIONS)
+        if unknown or not sections:
+            raise ValueError(f"sections must be a non-empty subset of {', '.join(STUDY_PACK_SECTIONS)}")
+        return [name for name in STUDY_PACK_SECTIONS if name in sections]
+
+SUMMARIZE_PROMPT = "You are a helpful study assistant. Summarize the following text concisely in 2-3 sentences."
+FLASHCARDS_PROMPT = "You are a study assistant. Generate 5-6 flashcards from the text. Return JSON: {\"cards\": [{\"q\": \"question\", \"a\": \"answer\"}]}"
+QUIZ_PROMPT = "Generate 5 multiple-choice questions from the text. Return JSON: {\"questions\": [{\"question\": \"...\", \"options\": [\"a\", \"b\", \"c\", \"d\"], \"correct_answer\": 0}]}. correct_answer is the index (0-3) of the right option."
+CONCEPT_MAP_PROMPT = "Generate a concept map from the text. Return JSON: {\"nodes\": [{\"id\": 0, \"label\": \"...\", \"type\": \"concept\"}], \"edges\": [{\"from\": 0, \"to\": 1, \"label\": \"relates to\"}]}"
+CHUNK_SUMMARY_PROMPT = "You are a helpful study assistant. This is one part of a longer document. Summarize it in a short paragraph, keeping the key facts, terms and definitions."
+REDUCE_SUMMARY_PROMPT = "You are a helpful study assistant. These are summaries of consecutive parts of one document. Merge them into one shorter summary that keeps the key facts, terms and definitions in order."
+STUDY_PACK_PROMPT = "You are a helpful study assistant. From the text, produce study material as one JSON object with exactly these keys:"
+DOCUMENT_CONTEXT_PROMPT = "Excerpts from the student's own notes and documents that may help. Use them when relevant and say which excerpt you used, e.g. [1]."
+PARSE_NOTES_PROMPT = "You are a helpful study assistant. Parse the note content into organized sections with titles, explanations, and subsections. Return JSON: {\"sections\": [{\"id\": \"1\", \"title\": \"...\", \"content\": \"explanation\", \"subsections\": [{\"id\": \"1.1\", \"title\": \"...\", \"content\": \"...\"}]}]}. Make it educational and well-structured."
+
+async def _complete(client, prompt: str, content: str, max_tokens: int) -> str:
+    response = await client.chat.completions.create(
+        model=MODEL,
+        messages=[
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": content}
+        ],
+        max_tokens=max_tokens,
+        temperature=0.7
+    )
+    return response.choices[0].message.content.strip()
+
+async def _produce_cached(key: str, produce: Callable):
+    """Run produce() once for concurrent callers with the same key and cache its result"""
+    async def run():
+        started = time.perf_counter()
+        result = await produce()
+        await run_in_threadpool(response_cache.set, key, result, time.perf_counter() - started)
+        return result
+
+    return await inflight.do(key, run)
+
+async def _cached_step(client, endpoint: str, prompt: str, content: str, max_tokens: int,
+                       schema: Type[BaseModel] = None):
+    """One cached model call inside a larger pipeline (e.g. a single chunk), structured if `schema` is given"""
+    key = cache_key(endpoint, MODEL, prompt, content)
+    cached = await run_in_threadpool(response_cache.get, key)
+    if cached is not None:
+        return cached
+
+    async def produce():
+        if schema is not None:
+            return _structured_value(await complete_structured(client, MODEL, endpoint, prompt, content, max_tokens, schema))
+        return await _complete(client, prompt, content, max_tokens)
+
+    return await _produce_cached(key, produce)
+
+async def _cached_generate(request: Request, response: Response, endpoint: str, prompt: str, text: str,
+                           max_tokens: int, fallback: Callable, schema: Type[BaseModel] = None,
+                           produce: Callable = None):
+    """
+    Serve the model reply validated against `schema` (see ai_output), or
+    `await produce(client)` for multi-step pipelines, through the response cache.
+
+    Only successful model output is cached; fallbacks are cheap to recompute and
+    shouldn't outlive an outage. Send `X-AI-Cache: bypass` to skip the lookup
+    and refresh the entry. The outcome is reported in the X-AI-Cache header.
+    Without a client, on failure, or while the worker is over AI_SHED_IN_FLIGHT
+    model calls, the local extractive engine answers instead.
+    On a miss, identical requests already waiting on the model share that call.
+    """
+    key = cache_key(endpoint, MODEL, prompt, text)
+    bypass = request.headers.get(CACHE_HEADER, "").lower() == "bypass"
+    if bypass:
+        response_cache.bypassed += 1
+    else:
+        cached = await run_in_threadpool(response_cache.get, key)
+        if cached is not None:
+            response.headers[CACHE_HEADER] = "hit"
+            return cached
 
-@router.post("/summarize")
-def summarize(payload: TextIn):
-    text = payload.text.strip()
-    if not text:
-        raise HTTPException(status_code=400, detail="No text provided")
-    
-    # Use OpenAI if available, otherwise fallback
     client = get_openai_client()
     if client is None:
-        sentences = text.split('.')
-        summary = '.'.join(sentences[:2]).strip()
-        if not summary:
-            summary = text[:200]
-        return {"summary": summary}
-    
+        return await _local_result(endpoint, fallback, "unavailable")
+    if AI_SHED_IN_FLIGHT and inflight.in_flight >= AI_SHED_IN_FLIGHT:
+        response.headers[CACHE_HEADER] = "shed"
+        return await _local_result(endpoint, fallback, "shed")
+
+    async def generate():
+        if produce is not None:
+            return await produce(client)
+        return _structured_value(await complete_structured(client, MODEL, endpoint, prompt, text, max_tokens, schema))
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful study assistant. Summarize the following text concisely in 2-3 sentences."},
-                {"role": "user", "content": text}
-            ],
-            max_tokens=200,
-            temperature=0.7
-        )
-        summary = response.choices[0].message.content.strip()
-        return {"summary": summary}
+        result = await _produce_cached(key, generate)
     except Exception as e:
-        # Fallback to simple summarization
-        sentences = text.split('.')
-        summary = '.'.join(sentences[:2]).strip()
-        if not summary:
-            summary = text[:200]
-        return {"summary": summary}
+        print(f"AI {endpoint} failed, using fallback: {e}")
+        return await _local_result(endpoint, fallback, "failed")
+    response.headers[CACHE_HEADER] = "bypass" if bypass else "miss"
+    return result
+
+def _structured_value(output: BaseModel) -> dict:
+    # Aliases keep the wire names ("from" on concept-map edges)
+    return output.dict(by_alias=True)
+
+async def _local_result(endpoint: str, fallback: Callable, reason: str):
+    """Run a local fallback off the event loop (ranking a long document is CPU work)"""
+    ai_metrics.incr(f"{endpoint}.local.{reason}")
+    return await run_in_threadpool(fallback)
+
+async def _summarize_document(client, text: str) -> dict:
+    """
+    Single prompt for short texts. Longer ones are map-reduced: chunks are
+    summarized concurrently (each cached, so editing one section re-summarizes
+    only that chunk), partial summaries are merged level by level until they
+    fit one prompt, and the final pass writes the 2-3 sentence summary.
+    """
+    return {"summary": await _complete(client, SUMMARIZE_PROMPT, await _condense(client, text), 200)}
+
+async def _condense(client, text: str) -> str:
+    """The text itself if it fits one prompt, else its merged chunk summaries (all cached per chunk)"""
+    if estimate_tokens(text) <= AI_SINGLE_PASS_TOKENS:
+        return text
+    chunks = chunk_text(text)
+    ai_metrics.incr("summarize.chunks", len(chunks))
+    partials = await bounded_map(
+        chunks, lambda chunk: _cached_step(client, "summarize.chunk", CHUNK_SUMMARY_PROMPT, chunk, 300)
+    )
+    return await reduce_hierarchically(
+        partials, lambda part: _cached_step(client, "summarize.reduce", REDUCE_SUMMARY_PROMPT, part, 500)
+    )
+
+async def _parse_note_sections(client, title: str, content: str) -> dict:
+    """Short notes in one prompt; long ones parsed chunk by chunk and the sections concatenated in order"""
+    if estimate_tokens(content) <= AI_SINGLE_PASS_TOKENS:
+        return _structured_value(await complete_structured(
+            client, MODEL, "parse-notes", PARSE_NOTES_PROMPT, f"Note Title: {title}\n\nContent:\n{content}", 1500, NoteSections
+        ))
+    chunks = chunk_text(content)
+    ai_metrics.incr("parse-notes.chunks", len(chunks))
+    parts = await bounded_map(chunks, lambda chunk: _cached_step(
+        client, "parse-notes.chunk", PARSE_NOTES_PROMPT, f"Note Title: {title}\n\nContent:\n{chunk}", 1500, NoteSections
+    ))
+    sections = []
+    for part in parts:
+        for section in part.get("sections", []):
+            number = str(len(sections) + 1)
+            subsections = [
+                {**sub, "id": f"{number}.{j}"} for j, sub in enumerate(section.get("subsections", []), 1)
+            ]
+            sections.append({**section, "id": number, "subsections": subsections})
+    return {"sections": sections}
+
+def _summary_fallback(text: str) -> dict:
+    return {"summary": local_nlp.summarize(text)}
+
+def _flashcards_fallback(text: str) -> dict:
+    return {"cards": local_nlp.flashcards(text)}
+
+def _quiz_fallback(text: str) -> dict:
+    return {"questions": local_nlp.quiz(text)}
+
+def _concept_map_fallback(text: str) -> dict:
+    nodes, edges = local_nlp.concept_map(text)
+    return {"nodes": nodes, "edges": edges}
+
+def _sections_fallback(content: str) -> dict:
+    paragraphs = [p.strip() for p in content.split('\n\n') if p.strip()]
+    sections = []
+    for i, para in enumerate(paragraphs[:5]):
+        sections.append({
+            "id": f"section-{i}",
+            "title": f"Section {i+1}",
+            "content": para,
+            "subsections": []
+        })
+    return {"sections": sections}
+
+@router.post("/summarize")
+async def summarize(payload: TextIn, request: Request, response: Response):
+    text = payload.text.strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="No text provided")
+    return await _cached_generate(
+        request, response, "summarize", SUMMARIZE_PROMPT, text,
+        200, lambda: _summary_fallback(text),
+        produce=lambda client: _summarize_document(client, text)
+    )
 
 @router.post("/flashcards")
-def flashcards(payload: TextIn):
+async def flashcards(payload: TextIn, request: Request, response: Response):
     text = payload.text.strip()
     if not text:
         raise HTTPException(status_code=400, detail="No text provided")
-    
-    # Use OpenAI if available, otherwise fallback
-    client = get_openai_client()
-    if client is None:
-        items = [s.strip() for s in text.split('\n') if s.strip()][:6]
-        cards = []
-        for i, it in enumerate(items, 1):
-            cards.append({"q": f"Key point {i}", "a": it[:120]})
-        return {"cards": cards}
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a study assistant. Generate 5-6 flashcards from the text. Return JSON array with format: [{\"q\": \"question\", \"a\": \"answer\"}]"},
-                {"role": "user", "content": text}
-            ],
-            max_tokens=500,
-            temperature=0.7
-        )
-        cards_text = response.choices[0].message.content.strip()
-        # Try to parse as JSON
-        if cards_text.startswith('['):
-            cards = json.loads(cards_text)
-        else:
-            # Extract JSON if wrapped in markdown code blocks
-            json_match = re.search(r'\[.*\]', cards_text, re.DOTALL)
-            if json_match:
-                cards = json.loads(json_match.group())
-            else:
-                raise ValueError("Could not parse flashcards")
-        return {"cards": cards}
-    except Exception as e:
-        # Fallback to simple flashcards
-        items = [s.strip() for s in text.split('\n') if s.strip()][:6]
-        cards = []
-        for i, it in enumerate(items, 1):
-            cards.append({"q": f"Key point {i}", "a": it[:120]})
-        return {"cards": cards}
+    return await _cached_generate(
+        request, response, "flashcards", FLASHCARDS_PROMPT, text,
+        500, lambda: _flashcards_fallback(text), FlashcardSet
+    )
 
 @router.post("/quiz")
-def generate_quiz(payload: TextIn):
+async def generate_quiz(payload: TextIn, request: Request, response: Response):
     text = payload.text.strip()
     if not text:
         raise HTTPException(status_code=400, detail="No text provided")
-    
-    # Use OpenAI if available, otherwise fallback
-    client = get_openai_client()
-    if client is None:
-        lines = [l.strip() for l in text.split('\n') if l.strip()]
-        questions = []
-        for i, line in enumerate(lines[:5]):
-            questions.append({
-                "question": f"What is the main concept in: '{line[:50]}...'?",
-                "options": [line[:30], "Alternative 1", "Alternative 2", "Alternative 3"],
-                "correct_answer": 0
-            })
-        return {"questions": questions}
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Generate 5 multiple-choice questions from the text. Return JSON array: [{\"question\": \"...\", \"options\": [\"a\", \"b\", \"c\", \"d\"], \"correct_answer\": 0}]. correct_answer is the index (0-3) of the right option."},
-                {"role": "user", "content": text}
-            ],
-            max_tokens=800,
-            temperature=0.7
-        )
-        quiz_text = response.choices[0].message.content.strip()
-        # Try to parse as JSON
-        if quiz_text.startswith('['):
-            questions = json.loads(quiz_text)
-        else:
-            # Extract JSON if wrapped in markdown code blocks
-            json_match = re.search(r'\[.*\]', quiz_text, re.DOTALL)
-            if json_match:
-                questions = json.loads(json_match.group())
-            else:
-                raise ValueError("Could not parse quiz")
-        return {"questions": questions}
-    except Exception as e:
-        # Fallback to simple quiz
-        lines = [l.strip() for l in text.split('\n') if l.strip()]
-        questions = []
-        for i, line in enumerate(lines[:5]):
-            questions.append({
-                "question": f"What is the main concept in: '{line[:50]}...'?",
-                "options": [line[:30], "Alternative 1", "Alternative 2", "Alternative 3"],
-                "correct_answer": 0
-            })
-        return {"questions": questions}
+    return await _cached_generate(
+        request, response, "quiz", QUIZ_PROMPT, text,
+        800, lambda: _quiz_fallback(text), Quiz
+    )
 
 @router.post("/concept-map")
-def concept_map(payload: TextIn):
+async def concept_map(payload: TextIn, request: Request, response: Response):
     text = payload.text.strip()
     if not text:
         raise HTTPException(status_code=400, detail="No text provided")
-    
-    # Use OpenAI if available, otherwise fallback
+    return await _cached_generate(
+        request, response, "concept-map", CONCEPT_MAP_PROMPT, text,
+        600, lambda: _concept_map_fallback(text), ConceptMap
+    )
+
+def _valid_summary(raw) -> dict:
+    if not isinstance(raw, str) or not raw.strip():
+        raise ValueError("summary must be a non-empty string")
+    return {"summary": raw.strip()}
+
+def _valid_flashcards(raw) -> dict:
+    return FlashcardSet(cards=raw).dict()
+
+def _valid_quiz(raw) -> dict:
+    return Quiz(questions=raw).dict()
+
+def _valid_concept_map(raw) -> dict:
+    return ConceptMap.parse_obj(raw).dict(by_alias=True)
+
+# Each study-pack section shares its cache entry (endpoint + prompt) with the
+# single endpoint that makes the same thing, in that endpoint's response shape
+PACK_SPECS = {
+    "summary": {
+        "endpoint": "summarize", "prompt": SUMMARIZE_PROMPT, "max_tokens": 200,
+        "schema": '"summary": a 2-3 sentence summary (string)',
+        "validate": _valid_summary, "fallback": _summary_fallback, "view": lambda value: value["summary"],
+    },
+    "flashcards": {
+        "endpoint": "flashcards", "prompt": FLASHCARDS_PROMPT, "max_tokens": 500,
+        "schema": '"flashcards": 5-6 cards, [{"q": "question", "a": "answer"}]',
+        "validate": _valid_flashcards, "fallback": _flashcards_fallback, "view": lambda value: value["cards"],
+    },
+    "quiz": {
+        "endpoint": "quiz", "prompt": QUIZ_PROMPT, "max_tokens": 800,
+        "schema": '"quiz": 5 multiple-choice questions, [{"question": "...", "options": ["a", "b", "c", "d"], "correct_answer": 0}] where correct_answer is the index of the right option',
+        "validate": _valid_quiz, "fallback": _quiz_fallback, "view": lambda value: value["questions"],
+    },
+    "concept_map": {
+        "endpoint": "concept-map", "prompt": CONCEPT_MAP_PROMPT, "max_tokens": 600,
+        "schema": '"concept_map": {"nodes": [{"id": 0, "label": "...", "type": "concept"}], "edges": [{"from": 0, "to": 1, "label": "relates to"}]}',
+        "validate": _valid_concept_map, "fallback": _concept_map_fallback, "view": lambda value: value,
+    },
+}
+
+async def _generate_pack(text: str, sections: List[str], keys: dict):
+    """
+    One JSON-mode call for every requested section (on the condensed text for
+    long documents). Returns the sections that validated, each already cached
+    under its single-endpoint key, and why the others are missing.
+    """
     client = get_openai_client()
     if client is None:
-        lines = [l.strip() for l in text.split('\n') if l.strip()]
-        nodes = []
-        edges = []
-        for i, line in enumerate(lines[:8]):
-            nodes.append({"id": i, "label": line[:40], "type": "concept"})
-            if i > 0:
-                edges.append({"from": i - 1, "to": i, "label": "relates to"})
-        return {"nodes": nodes, "edges": edges}
-    
+        return {}, "unavailable"
+    if AI_SHED_IN_FLIGHT and inflight.in_flight >= AI_SHED_IN_FLIGHT:
+        return {}, "shed"
+    prompt = "\n".join([STUDY_PACK_PROMPT] + [f"- {PACK_SPECS[name]['schema']}" for name in sections])
+
+    async def generate():
+        started = time.perf_counter()
+        context = await _condense(client, text)
+        max_tokens = sum(PACK_SPECS[name]["max_tokens"] for name in sections)
+        raw = await complete_structured(client, MODEL, "study-pack", prompt, context, max_tokens, StudyPackOutput)
+        values = {}
+        for name in sections:
+            try:
+                values[name] = PACK_SPECS[name]["validate"](getattr(raw, name))
+                ai_metrics.incr(f"study-pack.{name}.output.valid")
+            except (ValueError, TypeError) as e:
+                ai_metrics.incr(f"study-pack.{name}.output.invalid")
+                print(f"AI study-pack {name} section invalid, using fallback: {e}")
+        if values:
+            await run_in_threadpool(
+                response_cache.set_many, {keys[name]: value for name, value in values.items()},
+                time.perf_counter() - started
+            )
+        return values
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Generate a concept map from the text. Return JSON: {\"nodes\": [{\"id\": 0, \"label\": \"...\", \"type\": \"concept\"}], \"edges\": [{\"from\": 0, \"to\": 1, \"label\": \"relates to\"}]}"},
-                {"role": "user", "content": text}
-            ],
-            max_tokens=600,
-            temperature=0.7
-        )
-        map_text = response.choices[0].message.content.strip()
-        # Try to parse as JSON
-        if map_text.startswith('{'):
-            concept_data = json.loads(map_text)
-        else:
-            # Extract JSON if wrapped in markdown code blocks
-            json_match = re.search(r'\{.*\}', map_text, re.DOTALL)
-            if json_match:
-                concept_data = json.loads(json_match.group())
-            else:
-                raise ValueError("Could not parse concept map")
-        return concept_data
+        return await inflight.do(cache_key("study-pack", MODEL, prompt, text), generate), "invalid"
     except Exception as e:
-        # Fallback to simple concept map
-        lines = [l.strip() for l in text.split('\n') if l.strip()]
-        nodes = []
-        edges = []
-        for i, line in enumerate(lines[:8]):
-            nodes.append({"id": i, "label": line[:40], "type": "concept"})
-            if i > 0:
-                edges.append({"from": i - 1, "to": i, "label": "relates to"})
-        return {"nodes": nodes, "edges": edges}
+        print(f"AI study-pack failed, using fallback: {e}")
+        return {}, "failed"
+
+@router.post("/study-pack")
+async def study_pack(payload: StudyPackRequest, request: Request, response: Response):
+    """
+    Summary, flashcards, quiz and concept map from one model call, or only the
+    `sections` asked for. Sections share cache entries with /summarize,
+    /flashcards, /quiz and /concept-map, so only the ones not cached yet are
+    generated. Each section is validated on its own: a malformed one is made
+    by the local engine without discarding the rest. `sources` tells where
+    each section came from (cache, model or local).
+    """
+    text = payload.text.strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="No text provided")
+    keys = {name: cache_key(PACK_SPECS[name]["endpoint"], MODEL, PACK_SPECS[name]["prompt"], text)
+            for name in payload.sections}
+
+    bypass = request.headers.get(CACHE_HEADER, "").lower() == "bypass"
+    if bypass:
+        response_cache.bypassed += 1
+        cached = {}
+    else:
+        cached = await run_in_threadpool(response_cache.get_many, list(keys.values()))
+    results = {name: cached[key] for name, key in keys.items() if key in cached}
+    sources = {name: "cache" for name in results}
+
+    missing = [name for name in payload.sections if name not in results]
+    if missing:
+        generated, reason = await _generate_pack(text, missing, keys)
+        for name in missing:
+            if name in generated:
+                results[name], sources[name] = generated[name], "model"
+            else:
+                fallback = PACK_SPECS[name]["fallback"]
+                results[name] = await _local_result(f"study-pack.{name}", lambda: fallback(text), reason)
+                sources[name] = "local"
+    response.headers[CACHE_HEADER] = "hit" if not missing else ("bypass" if bypass else "miss")
+    return {
+        **{name: PACK_SPECS[name]["view"](results[name]) for name in payload.sections},
+        "sources": sources,
+    }
+
+@router.get("/metrics")
+def metrics(current_user: User = Depends(get_current_user)):
+    """Per-worker AI counters, latency percentiles, request coalescing and model output failure rates"""
+    return {**ai_metrics.snapshot(), "coalescing": inflight.stats(), "structured_output": output_stats()}
+
+@router.get("/cache/stats")
+def cache_stats(current_user: User = Depends(get_current_user)):
+    """Hit ratio and upstream latency saved by the AI response cache"""
+    return response_cache.stats()
 
 @router.post("/generate-flashcards")
-def generate_flashcards(payload: GenerateFlashcardsRequest, current_user: User = Depends(get_current_user)):
+async def generate_flashcards(payload: GenerateFlashcardsRequest, current_user: User = Depends(get_current_user)):
     """Generate flashcards for a given topic using AI"""
     client = get_openai_client()
     if not client:
         raise HTTPException(status_code=503, detail="OpenAI service not available")
     
+    prompt = f"You are a helpful study assistant. Generate exactly {payload.count} flashcards about {payload.topic}. Return JSON: {{\"flashcards\": [{{\"question\": \"...\", \"answer\": \"...\", \"difficulty\": \"Easy|Medium|Hard\"}}]}}. Make them educational and clear."
+    request_text = f"Create {payload.count} flashcards about {payload.topic}"
+
+    async def generate():
+        output = await complete_structured(client, MODEL, "generate-flashcards", prompt, request_text, 1000, TopicFlashcards)
+        return output.dict()["flashcards"]
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": f"You are a helpful study assistant. Generate exactly {payload.count} flashcards about {payload.topic}. Return JSON array with format: [{{\"question\": \"...\", \"answer\": \"...\", \"difficulty\": \"Easy|Medium|Hard\"}}]. Make them educational and clear."},
-                {"role": "user", "content": f"Create {payload.count} flashcards about {payload.topic}"}
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
-        cards_text = response.choices[0].message.content.strip()
-        
-        # Parse JSON from response
-        if cards_text.startswith('['):
-            cards = json.loads(cards_text)
-        else:
-            json_match = re.search(r'\[.*\]', cards_text, re.DOTALL)
-            if json_match:
-                cards = json.loads(json_match.group())
-            else:
-                raise ValueError("Could not parse flashcards")
-        
+        cards = await inflight.do(cache_key("generate-flashcards", MODEL, prompt, request_text), generate)
         return {"flashcards": cards, "topic": payload.topic}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate flashcards: {str(e)}")
 
 @router.post("/generate-quiz")
-def generate_quiz_endpoint(payload: GenerateQuizRequest, current_user: User = Depends(get_current_user)):
+async def generate_quiz_endpoint(payload: GenerateQuizRequest, current_user: User = Depends(get_current_user)):
     """Generate a quiz for a given topic using AI"""
     client = get_openai_client()
     if not client:
         raise HTTPException(status_code=503, detail="OpenAI service not available")
     
+    prompt = f"You are a helpful study assistant. Generate exactly {payload.num_questions} multiple-choice questions about {payload.topic}. Return JSON: {{\"questions\": [{{\"question\": \"...\", \"options\": [\"a\", \"b\", \"c\", \"d\"], \"correctAnswer\": 0}}]}}. correctAnswer is the index (0-3) of the right option."
+    request_text = f"Create {payload.num_questions} quiz questions about {payload.topic}"
+
+    async def generate():
+        output = await complete_structured(client, MODEL, "generate-quiz", prompt, request_text, 1200, TopicQuiz)
+        return output.dict()["questions"]
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": f"You are a helpful study assistant. Generate exactly {payload.num_questions} multiple-choice questions about {payload.topic}. Return JSON array: [{{\"question\": \"...\", \"options\": [\"a\", \"b\", \"c\", \"d\"], \"correctAnswer\": 0}}]. correctAnswer is the index (0-3) of the right option."},
-                {"role": "user", "content": f"Create {payload.num_questions} quiz questions about {payload.topic}"}
-            ],
-            max_tokens=1200,
-            temperature=0.7
-        )
-        quiz_text = response.choices[0].message.content.strip()
-        
-        # Parse JSON from response
-        if quiz_text.startswith('['):
-            questions = json.loads(quiz_text)
-        else:
-            json_match = re.search(r'\[.*\]', quiz_text, re.DOTALL)
-            if json_match:
-                questions = json.loads(json_match.group())
-            else:
-                raise ValueError("Could not parse quiz")
-        
+        questions = await inflight.do(cache_key("generate-quiz", MODEL, prompt, request_text), generate)
         return {"questions": questions, "topic": payload.topic}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate quiz: {str(e)}")
 
-@router.post("/summarize")
-def summarize_text(payload: SummarizeRequest, current_user: User = Depends(get_current_user)):
-    """Summarize text using AI"""
-    text = payload.text.strip()
-    if not text:
-        raise HTTPException(status_code=400, detail="No text provided")
-    
-    client = get_openai_client()
-    if not client:
-        # Fallback: simple summarization
-        sentences = text.split('.')
-        summary = '.'.join(sentences[:3]).strip()
-        return {"content": summary or text[:300], "keyPoints": []}
-    
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+async def _stream_chat(stream, started: float, sources: List[dict] = None):
+    """
+    Relay a streamed completion as SSE: a "sources" event when documents were
+    used, {"delta": ...} per chunk, then a "done" event with the full reply. If
+    the client goes away, Starlette cancels this generator and the upstream
+    stream is closed so generation stops there.
+    """
+    parts = []
+    finished = False
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful study assistant. Summarize the text and extract 3-5 key points. Return JSON: {\"summary\": \"...\", \"keyPoints\": [\"point1\", \"point2\", ...]}"},
-                {"role": "user", "content": text}
-            ],
-            max_tokens=500,
-            temperature=0.7
-        )
-        summary_text = response.choices[0].message.content.strip()
-        
-        # Parse JSON from response
-        if summary_text.startswith('{'):
-            summary_data = json.loads(summary_text)
-        else:
-            json_match = re.search(r'\{.*\}', summary_text, re.DOTALL)
-            if json_match:
-                summary_data = json.loads(json_match.group())
-            else:
-                summary_data = {"summary": summary_text, "keyPoints": []}
-        
-        return {
-            "content": summary_data.get("summary", summary_text),
-            "keyPoints": summary_data.get("keyPoints", [])
-        }
+        if sources:
+            yield _sse({"sources": sources}, event="sources")
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if not parts:
+                ai_metrics.observe("chat.time_to_first_token", time.perf_counter() - started)
+            parts.append(delta)
+            yield _sse({"delta": delta})
+        finished = True
+        ai_metrics.incr("chat.stream.completed")
+        ai_metrics.observe("chat.stream.duration", time.perf_counter() - started)
+        yield _sse({"response": "".join(parts).strip()}, event="done")
+    except Exception as e:
+        finished = True
+        ai_metrics.incr("chat.stream.failed")
+        yield _sse({"detail": f"Chat failed: {str(e)}"}, event="error")
+    finally:
+        if not finished:
+            ai_metrics.incr("chat.stream.cancelled")
+        with anyio.CancelScope(shield=True):
+            await stream.close()
+
+async def _document_context(db: Session, user_id: int, question: str):
+    """Excerpts from the user's documents relevant to the question, within DOC_CONTEXT_TOKENS"""
+    try:
+        started = time.perf_counter()
+        hits = await doc_store.search(db, user_id, question)
+        ai_metrics.observe("chat.retrieval", time.perf_counter() - started)
+        return doc_store.build_context(hits)
     except Exception as e:
-        # Fallback
-        sentences = text.split('.')
-        summary = '.'.join(sentences[:3]).strip()
-        return {"content": summary or text[:300], "keyPoints": []}
+        print(f"Document retrieval failed, answering without it: {e}")
+        return "", []
 
 @router.post("/chat")
-def chat_with_ai(payload: ChatRequest, current_user: User = Depends(get_current_user)):
-    """Chat with AI tutor"""
+async def chat_with_ai(payload: ChatRequest, db: Session = Depends(get_db),
+                       current_user: User = Depends(get_current_user)):
+    """
+    Chat with AI tutor. Unless use_documents is false, the most relevant
+    excerpts of the user's saved documents (see /documents) are added to the
+    prompt, and the reply lists them as sources.
+    """
     client = get_openai_client()
     if not client:
         raise HTTPException(status_code=503, detail="OpenAI service not available")
     
+    context, sources = ("", [])
+    if payload.use_documents:
+        context, sources = await _document_context(db, current_user.id, payload.message)
+
     try:
         messages = [
             {"role": "system", "content": "You are a helpful AI study tutor. Answer questions clearly and concisely. Help students understand concepts, not just provide answers."}
         ]
+        if context:
+            messages.append({"role": "system", "content": f"{DOCUMENT_CONTEXT_PROMPT}\n\n{context}"})
         
         # Add conversation history
         for msg in payload.history[-10:]:  # Last 10 messages for context
@@ -360,20 +522,35 @@ def chat_with_ai(payload: ChatRequest, current_user: User = Depends(get_current_
         # Add current message
         messages.append({"role": "user", "content": payload.message})
         
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        if payload.stream:
+            started = time.perf_counter()
+            stream = await client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                max_tokens=500,
+                temperature=0.7,
+                stream=True
+            )
+            return StreamingResponse(
+                _stream_chat(stream, started, sources),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        
+        response = await client.chat.completions.create(
+            model=MODEL,
             messages=messages,
             max_tokens=500,
             temperature=0.7
         )
         
         reply = response.choices[0].message.content.strip()
-        return {"response": reply}
+        return {"response": reply, "sources": sources}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
 
 @router.post("/parse-notes")
-def parse_notes(payload: dict, current_user: User = Depends(get_current_user)):
+async def parse_notes(payload: dict, request: Request, response: Response, current_user: User = Depends(get_current_user)):
     """Parse notes into organized sections and subsections with AI explanations"""
     title = payload.get("title", "").strip()
     content = payload.get("content", "").strip()
@@ -381,78 +558,57 @@ def parse_notes(payload: dict, current_user: User = Depends(get_current_user)):
     if not title or not content:
         raise HTTPException(status_code=400, detail="Title and content required")
     
-    client = get_openai_client()
-    if not client:
-        # Fallback: simple parsing by paragraphs
-        paragraphs = [p.strip() for p in content.split('\n\n') if p.strip()]
-        sections = []
-        for i, para in enumerate(paragraphs[:5]):
-            sections.append({
-                "id": f"section-{i}",
-                "title": f"Section {i+1}",
-                "content": para,
-                "subsections": []
-            })
-        return {"sections": sections}
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful study assistant. Parse the note content into organized sections with titles, explanations, and subsections. Return JSON: {\"sections\": [{\"id\": \"1\", \"title\": \"...\", \"content\": \"explanation\", \"subsections\": [{\"id\": \"1.1\", \"title\": \"...\", \"content\": \"...\"}]}]}. Make it educational and well-structured."},
-                {"role": "user", "content": f"Note Title: {title}\n\nContent:\n{content}"}
-            ],
-            max_tokens=1500,
-            temperature=0.7
-        )
-        
-        result_text = response.choices[0].message.content.strip()
-        
-        # Parse JSON from response
-        if result_text.startswith('{'):
-            result = json.loads(result_text)
-        else:
-            json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
-            if json_match:
-                result = json.loads(json_match.group())
-            else:
-                raise ValueError("Could not parse response")
-        
-        return result
-    except Exception as e:
-        # Fallback to simple parsing
-        paragraphs = [p.strip() for p in content.split('\n\n') if p.strip()]
-        sections = []
-        for i, para in enumerate(paragraphs[:5]):
-            sections.append({
-                "id": f"section-{i}",
-                "title": f"Section {i+1}",
-                "content": para,
-                "subsections": []
-            })
-        return {"sections": sections}
+    note = f"Note Title: {title}\n\nContent:\n{content}"
+    return await _cached_generate(
+        request, response, "parse-notes", PARSE_NOTES_PROMPT, note,
+        1500, lambda: _sections_fallback(content), NoteSections,
+        produce=lambda client: _parse_note_sections(client, title, content)
+    )
 
 @router.post("/extract-pdf")
-async def extract_pdf_text(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
-    """Extract text from uploaded PDF file"""
+async def extract_pdf_text(file: UploadFile = File(...), pages: Optional[str] = None, stream: bool = False,
+                           current_user: User = Depends(get_current_user)):
+    """
+    Extract text from uploaded PDF file.
+
+    `pages` selects 1-based pages or ranges ("1-5,9,20-"). With stream=true the
+    result is NDJSON, one {"page", "text"} object per page as it is extracted.
+    Extraction runs in a process pool, in parallel page ranges for long files,
+    and page text is cached by file hash.
+    """
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="File must be a PDF")
     
+    path, sha256 = await run_in_threadpool(pdf_extract.spool_to_temp, file.file)
     try:
-        # Read the PDF file
-        contents = await file.read()
-        pdf_file = io.BytesIO(contents)
-        
-        # Extract text using PyPDF2
-        reader = PdfReader(pdf_file)
-        text = ""
-        
-        for page in reader.pages:
-            text += page.extract_text() + "\n\n"
-        
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="No text found in PDF")
-        
-        return {"text": text.strip(), "pages": len(reader.pages)}
+        total = await pdf_extract.page_count(path, sha256)
+        selected = pdf_extract.parse_page_spec(pages, total)
+    except ValueError as e:
+        os.unlink(path)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        os.unlink(path)
+        raise HTTPException(status_code=400, detail=f"Could not read PDF: {str(e)}")
+
+    if stream:
+        async def lines():
+            try:
+                async for page, text in pdf_extract.extract_pages(path, sha256, selected):
+                    yield json.dumps({"page": page + 1, "text": text}) + "\n"
+            finally:
+                os.unlink(path)
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    try:
+        texts = [text async for _, text in pdf_extract.extract_pages(path, sha256, selected)]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to extract PDF text: {str(e)}")
+    finally:
+        os.unlink(path)
+    
+    text = "\n\n".join(texts).strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="No text found in PDF")
+    
+    return {"text": text, "pages": total}
@@ -0,0 +1,76 @@
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+import os
+from .. import schemas, crud, doc_store, pdf_extract
+from ..deps import get_db, get_current_user
+
+router = APIRouter(prefix="/documents", tags=["documents"])
+
+async def _add_document(db: Session, user_id: int, title: str, source: str, content: str):
+    content_hash, chunks, token_counts = doc_store.prepare_document(content)
+    document = await run_in_threadpool(
+        crud.create_study_document, db, user_id, title, source, content_hash, chunks, token_counts
+    )
+    try:
+        await doc_store.sync_index(db, user_id)
+    except Exception as e:
+        # The chunks are saved; the next search retries embedding them
+        print(f"Indexing document {document.id} failed: {e}")
+    return document
+
+@router.post("", response_model=schemas.StudyDocumentOut)
+async def add_note(payload: schemas.StudyDocumentCreate, db: Session = Depends(get_db),
+                   current_user=Depends(get_current_user)):
+    """Save note text for the AI tutor to draw on in chat"""
+    title, content = payload.title.strip(), payload.content.strip()
+    if not title or not content:
+        raise HTTPException(status_code=400, detail="Title and content required")
+    return await _add_document(db, current_user.id, title, "note", content)
+
+@router.post("/pdf", response_model=schemas.StudyDocumentOut)
+async def add_pdf(file: UploadFile = File(...), title: Optional[str] = Form(None),
+                  db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    """Extract a PDF's text and save it as a document"""
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="File must be a PDF")
+    path, sha256 = await run_in_threadpool(pdf_extract.spool_to_temp, file.file)
+    try:
+        total = await pdf_extract.page_count(path, sha256)
+        texts = [text async for _, text in pdf_extract.extract_pages(path, sha256, list(range(total)))]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not read PDF: {str(e)}")
+    finally:
+        os.unlink(path)
+    content = "\n\n".join(texts).strip()
+    if not content:
+        raise HTTPException(status_code=400, detail="No text found in PDF")
+    return await _add_document(db, current_user.id, (title or file.filename).strip(), "pdf", content)
+
+@router.get("", response_model=List[schemas.StudyDocumentOut])
+def list_documents(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    return crud.list_study_documents(db, current_user.id)
+
+@router.delete("/{document_id}")
+def delete_document(document_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    """Delete a document; its vectors are skipped from now on and dropped when the index is compacted"""
+    if not crud.delete_study_document(db, current_user.id, document_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"ok": True}
+
+@router.get("/search", response_model=List[schemas.DocumentHit])
+async def search_documents(q: str, k: int = Query(5, ge=1, le=50), db: Session = Depends(get_db),
+                           current_user=Depends(get_current_user)):
+    """The caller's document chunks most similar to `q`"""
+    hits = await doc_store.search(db, current_user.id, q, k)
+    return [
+        {
+            "document_id": hit["chunk"].document_id,
+            "title": hit["chunk"].document.title,
+            "chunk": hit["chunk"].ordinal,
+            "score": round(hit["score"], 4),
+            "text": hit["chunk"].text,
+        }
+        for hit in hits
+    ]
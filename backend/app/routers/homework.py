@@ -1,12 +1,18 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse, RedirectResponse
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 import os
+import re
+from functools import partial
 from .. import schemas, crud, models
 from ..deps import get_db, get_current_user
 from ..files import save_upload_file
+from ..downloads import file_download_response, stream_zip, ZipEntry
+from ..storage import storage_for
+from ..pagination import encode_cursor, decode_cursor
 
 router = APIRouter(prefix="/homework", tags=["homework"])
 
@@ -41,15 +47,47 @@ def list_assignments(db: Session = Depends(get_db), current_user=Depends(get_cur
         )
         return query.all()
 
+@router.get("/feed", response_model=schemas.AssignmentFeedPage)
+def assignment_feed(
+    due_after: Optional[datetime] = None,
+    due_before: Optional[datetime] = None,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Student's assignments with their latest submission status, paged by due date"""
+    if status is not None and status not in crud.FEED_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(crud.FEED_STATUSES)}")
+    items = crud.get_assignment_feed(
+        db, current_user.id,
+        due_after=due_after, due_before=due_before, status=status,
+        after=decode_cursor(cursor) if cursor else None,
+        limit=limit + 1
+    )
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1]["due_date"], items[-1]["id"])
+    return {"items": items, "next_cursor": next_cursor}
+
 @router.post("/submit")
-def submit_assignment(
+async def submit_assignment(
     assignment_id: int = Form(...),
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user)
 ):
-    path = save_upload_file(file)
-    s = models.Submission(assignment_id=assignment_id, student_id=current_user.id, file_path=path)
+    stored = await save_upload_file(file)
+    s = models.Submission(
+        assignment_id=assignment_id,
+        student_id=current_user.id,
+        file_path=stored.path,
+        file_name=file.filename,
+        file_sha256=stored.sha256,
+        file_size=stored.size
+    )
     db.add(s)
     db.commit()
     db.refresh(s)
@@ -62,7 +100,7 @@ def get_my_submissions(db: Session = Depends(get_db), current_user=Depends(get_c
 @router.get("/submissions")
 def list_submissions(assignment_id: int, db: Session = Depends(get_db)):
     subs = db.query(models.Submission).filter(models.Submission.assignment_id == assignment_id).all()
-    return [{"id": s.id, "student_id": s.student_id, "file_path": s.file_path, "grade": s.grade, "feedback": s.feedback} for s in subs]
+    return [{"id": s.id, "student_id": s.student_id, "file_path": s.file_path, "file_size": s.file_size, "grade": s.grade, "feedback": s.feedback} for s in subs]
 
 @router.post("/grade")
 def grade_submission(
@@ -79,8 +117,91 @@ def grade_submission(
     db.commit()
     return {"ok": True}
 
-@router.get("/file")
-def get_file(path: str):
-    if not path or not os.path.exists(path):
+@router.post("/grade/bulk")
+def grade_submissions_bulk(
+    payload: schemas.BulkGradeIn,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Grade many submissions in one transaction (tutor must own every assignment)"""
+    ids = [g.submission_id for g in payload.grades]
+    if not ids:
+        return {"ok": True, "graded": 0}
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Duplicate submission_id in request")
+
+    owners = db.query(models.Submission.id, models.Submission.student_id, models.Assignment.tutor_id).join(
+        models.Assignment, models.Assignment.id == models.Submission.assignment_id
+    ).filter(models.Submission.id.in_(ids)).all()
+    if len(owners) != len(ids):
+        missing = sorted(set(ids) - {row.id for row in owners})
+        raise HTTPException(status_code=404, detail=f"Submissions not found: {missing}")
+    if any(row.tutor_id != current_user.id for row in owners):
+        raise HTTPException(status_code=403, detail="Can only grade submissions for your own assignments")
+
+    db.execute(
+        update(models.Submission),
+        [{"id": g.submission_id, "grade": g.grade, "feedback": g.feedback} for g in payload.grades]
+    )
+    crud.refresh_progress_for_students(db, {row.student_id for row in owners})
+    db.commit()
+    return {"ok": True, "graded": len(ids)}
+
+@router.get("/assignments/{assignment_id}/export")
+def export_assignment_submissions(
+    assignment_id: int,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Stream a ZIP of every submission for an assignment (assignment's tutor only)"""
+    a = db.query(models.Assignment).get(assignment_id)
+    if not a:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    if a.tutor_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Only the assignment's tutor can export submissions")
+
+    rows = db.query(models.Submission, models.User).join(
+        models.User, models.User.id == models.Submission.student_id
+    ).filter(
+        models.Submission.assignment_id == assignment_id,
+        models.Submission.file_path.isnot(None)
+    ).order_by(models.User.full_name, models.Submission.id).all()
+    entries = [
+        ZipEntry(_archive_name(s, student), s.file_size or 0, s.created_at,
+                 partial(storage_for(s.file_path).open, s.file_path))
+        for s, student in rows
+    ]
+
+    filename = f"{_safe_name(a.title) or 'assignment'}-{a.id}-submissions.zip"
+    return StreamingResponse(
+        stream_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+def _safe_name(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", value or "").strip("._")
+
+def _archive_name(submission, student) -> str:
+    who = _safe_name(student.full_name or student.email.split("@")[0]) or f"student-{student.id}"
+    original = _safe_name(submission.file_name or os.path.basename(submission.file_path)) or "file"
+    return f"{who}/{submission.id}-{original}"
+
+@router.get("/submissions/{submission_id}/file")
+def download_submission_file(
+    submission_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Download a submission's file (the submitting student or the assignment's tutor only)"""
+    s = db.query(models.Submission).get(submission_id)
+    if not s or not s.file_path:
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(path)
+    if s.student_id != current_user.id and s.assignment.tutor_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not allowed to access this file")
+    storage = storage_for(s.file_path)
+    url = storage.presigned_url(s.file_path, s.file_name)
+    if url:
+        return RedirectResponse(url, status_code=307)
+    return file_download_response(request, storage.local_path(s.file_path), s.file_sha256, s.created_at, s.file_name)
@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from .. import schemas, crud, models
+from ..deps import get_db, get_current_user
+from ..pagination import encode_cursor, decode_cursor
+
+router = APIRouter(prefix="/messages", tags=["messages"])
+
+def _resolve_conversation(db: Session, user_id: int, with_user: Optional[int], room: Optional[str]) -> str:
+    if (with_user is None) == (room is None):
+        raise HTTPException(status_code=400, detail="Pass exactly one of with_user or room")
+    if room is not None and not crud.ROOM_RE.match(room):
+        raise HTTPException(status_code=400, detail="Room must be session:<id> or pair:<tutor>:<student>")
+    if room is not None and not crud.can_access_room(db, user_id, room):
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+    return crud.conversation_key(user_id, with_user, room)
+
+@router.get("/history", response_model=schemas.MessageHistoryPage)
+def message_history(
+    with_user: Optional[int] = None,
+    room: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Messages with another user or in a room, newest first; pass next_cursor to page back"""
+    key = _resolve_conversation(db, current_user.id, with_user, room)
+    items = crud.get_message_history(db, key, before=decode_cursor(cursor) if cursor else None, limit=limit + 1)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+    return {"conversation_key": key, "items": items, "next_cursor": next_cursor}
+
+@router.get("/inbox", response_model=List[schemas.ConversationSummaryOut])
+def inbox(
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Each conversation's latest message and unread count, most recent first"""
+    S = models.ConversationSummary
+    return db.query(S).filter(S.user_id == current_user.id).order_by(S.last_message_at.desc()).limit(limit).all()
+
+@router.post("/read")
+def mark_read(
+    with_user: Optional[int] = None,
+    room: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Reset the unread count for a conversation"""
+    key = _resolve_conversation(db, current_user.id, with_user, room)
+    S = models.ConversationSummary
+    db.query(S).filter(S.user_id == current_user.id, S.conversation_key == key).update(
+        {S.unread_count: 0}, synchronize_session=False
+    )
+    db.commit()
+    return {"ok": True}
@@ -1,5 +1,7 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+import json
 from .. import schemas, crud
 from ..deps import get_db, get_current_user
 
@@ -10,6 +12,18 @@ def get_my_progress(db: Session = Depends(get_db), current_user=Depends(get_curr
     progress = crud.update_progress(db, current_user.id)
     return progress
 
+@router.get("/roster")
+def get_roster_progress(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    """Stream progress for all of the tutor's students as NDJSON (one object per line)"""
+    if current_user.role != "tutor":
+        raise HTTPException(status_code=403, detail="Only tutors can view roster progress")
+
+    def rows():
+        for row in crud.get_roster_progress(db, current_user.id):
+            yield json.dumps(row) + "\n"
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
 @router.get("/student/{student_id}", response_model=schemas.ProgressOut)
 def get_student_progress(student_id: int, db: Session = Depends(get_db)):
     progress = crud.update_progress(db, student_id)
@@ -1,80 +1,602 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
-from typing import List, Dict
-from ..deps import get_db
-from sqlalchemy.orm import Session
-from .. import models
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, Depends, HTTPException, status
+from typing import List, Dict, Optional, Set
+from datetime import datetime
+from uuid import uuid4
+from starlette.concurrency import run_in_threadpool
+from ..chat_writer import message_writer, message_sequence
+from ..chat_broker import get_broker
+from ..deps import get_current_user, user_from_token
+from ..database import SessionLocal
+from .. import models, crud
+import asyncio
+import os
 import json
+import time
 
 router = APIRouter()
 
+BROADCAST_CHANNEL = "chat:broadcast"
+
+# Record join/leave events in room_membership_events when enabled
+ROOM_AUDIT = os.environ.get("CHAT_ROOM_AUDIT", "").lower() in ("1", "true", "yes")
+
+# Short-lived sessions for room checks and audit rows (swapped out by tests)
+session_factory = SessionLocal
+
+# Messages buffered per socket before it is treated as a slow consumer and dropped
+OUTBOUND_QUEUE_SIZE = int(os.environ.get("WS_OUTBOUND_QUEUE_SIZE", 256))
+
+# Limits per worker: a user's oldest socket is closed when they open one too many,
+# and new sockets are turned away once the worker is full
+MAX_CONNECTIONS_PER_USER = int(os.environ.get("WS_MAX_CONNECTIONS_PER_USER", 5))
+MAX_CONNECTIONS = int(os.environ.get("WS_MAX_CONNECTIONS", 10000))
+
+# Idle sockets get a {"type": "ping"} after WS_PING_INTERVAL seconds and are reaped
+# once nothing (pong or any other frame) has arrived for WS_IDLE_TIMEOUT seconds
+PING_INTERVAL = float(os.environ.get("WS_PING_INTERVAL", 20))
+IDLE_TIMEOUT = float(os.environ.get("WS_IDLE_TIMEOUT", 60))
+
+# Close codes by eviction reason
+CLOSE_CODES = {"slow_consumer": 1013, "send_failed": 1011, "idle_timeout": 1001, "replaced": 1008}
+
+# Missed messages sent per resume frame; clients page through longer absences
+RESUME_PAGE_SIZE = int(os.environ.get("WS_RESUME_PAGE_SIZE", 200))
+
+class ClientConnection:
+    """
+    One socket plus its bounded outbound queue, drained by a dedicated task so
+    a slow client only ever delays itself.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: str, manager: "ConnectionManager",
+                 max_queue: int = None, paused: bool = False):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.manager = manager
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue or OUTBOUND_QUEUE_SIZE)
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self.rooms: Set[str] = set()
+        self.acked_seq: Optional[int] = None
+        self.last_seen = time.monotonic()
+        self.pinged = False
+        self._ready = asyncio.Event()
+        if not paused:
+            self._ready.set()
+        self._sender = asyncio.get_running_loop().create_task(self._drain())
+
+    def send(self, message: str) -> bool:
+        """Queue a message without waiting on the network; evicts the client on overflow"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.manager.evict(self, "slow_consumer")
+            return False
+
+    def touch(self):
+        """Record inbound activity; any frame counts as proof of life"""
+        self.last_seen = time.monotonic()
+        self.pinged = False
+
+    def resume(self):
+        """Start draining live traffic that queued up while the connection was paused"""
+        self._ready.set()
+
+    async def _drain(self):
+        while True:
+            message = await self.queue.get()
+            await self._ready.wait()
+            try:
+                await self.websocket.send_text(message)
+                self.sent += 1
+            except Exception:
+                self.dropped += 1 + self.queue.qsize()
+                self.manager.evict(self, "send_failed")
+                return
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        if self._sender is not asyncio.current_task():
+            self._sender.cancel()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout=5)
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "rooms": sorted(self.rooms),
+            "queue_depth": self.queue.qsize(),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "idle_seconds": round(time.monotonic() - self.last_seen, 1),
+        }
+
 class ConnectionManager:
-    def __init__(self):
-        self.active: Dict[str, List[WebSocket]] = {}
+    """
+    Tracks this worker's sockets and routes messages across workers.
 
-    async def connect(self, websocket: WebSocket, user_id: str):
+    Delivery is local-first: sockets on this worker are written directly, and
+    a message only goes through the broker when the presence registry says the
+    recipient is also connected to another worker. Broadcasts are delivered
+    locally and published once for the other workers.
+    """
+
+    heartbeat_interval = 15
+
+    def __init__(self, broker=None, worker_id: Optional[str] = None):
+        self.active: Dict[str, List[ClientConnection]] = {}
+        self.rooms: Dict[str, Set[ClientConnection]] = {}
+        self.evictions: Dict[str, int] = {reason: 0 for reason in CLOSE_CODES}
+        self.rejected = 0
+        self.worker_id = worker_id or uuid4().hex
+        self.broker = broker if broker is not None else get_broker()
+        self._started = False
+        self._heartbeat = None
+        self._reaper = None
+        self._loop = None
+
+    @property
+    def worker_channel(self) -> str:
+        return f"chat:worker:{self.worker_id}"
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self._started and self._loop is loop:
+            return
+        self._started = True
+        self._loop = loop
+        await self.broker.subscribe(self.worker_channel, self._on_remote)
+        await self.broker.subscribe(BROADCAST_CHANNEL, self._on_remote)
+        await self.broker.heartbeat(self.worker_id)
+        self._heartbeat = asyncio.get_running_loop().create_task(self._heartbeat_loop())
+        self._reaper = asyncio.get_running_loop().create_task(self._reap_loop())
+
+    async def stop(self):
+        if not self._started:
+            return
+        self._started = False
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        if self._reaper is not None:
+            self._reaper.cancel()
+        for conns in list(self.active.values()):
+            for conn in list(conns):
+                await self.disconnect(conn)
+        await self.broker.unsubscribe(self.worker_channel, self._on_remote)
+        await self.broker.unsubscribe(BROADCAST_CHANNEL, self._on_remote)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.broker.heartbeat(self.worker_id)
+            except Exception as e:
+                print(f"Chat heartbeat failed: {e}")
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(min(PING_INTERVAL, IDLE_TIMEOUT) / 2)
+            self.reap_idle()
+
+    def reap_idle(self):
+        """Ping quiet sockets and evict the ones that stayed silent past IDLE_TIMEOUT"""
+        now = time.monotonic()
+        for conns in list(self.active.values()):
+            for conn in list(conns):
+                idle = now - conn.last_seen
+                if idle >= IDLE_TIMEOUT:
+                    self.evict(conn, "idle_timeout")
+                elif idle >= PING_INTERVAL and not conn.pinged:
+                    conn.pinged = True
+                    conn.send(PING_FRAME)
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(conns) for conns in self.active.values())
+
+    async def connect(self, websocket: WebSocket, user_id: str, paused: bool = False) -> Optional[ClientConnection]:
+        """
+        Register a socket. With paused=True live messages are queued but not sent
+        until conn.resume(), so missed messages can be written out first.
+        Returns None, after closing the socket with 1013, when the worker is full.
+        """
         await websocket.accept()
+        if self.connection_count >= MAX_CONNECTIONS:
+            self.rejected += 1
+            await websocket.close(code=1013)
+            return None
+        await self.start()
+        existing = self.active.get(user_id, [])
+        for stale in existing[:max(len(existing) - MAX_CONNECTIONS_PER_USER + 1, 0)]:
+            self.evict(stale, "replaced")
+        conn = ClientConnection(websocket, user_id, self, paused=paused)
         if user_id not in self.active:
             self.active[user_id] = []
-        self.active[user_id].append(websocket)
+        self.active[user_id].append(conn)
+        await self.broker.presence_add(user_id, self.worker_id)
+        return conn
 
-    def disconnect(self, websocket: WebSocket, user_id: str):
-        if user_id in self.active:
-            try:
-                self.active[user_id].remove(websocket)
-                if not self.active[user_id]:
-                    del self.active[user_id]
-            except ValueError:
-                pass
+    async def disconnect(self, conn: ClientConnection):
+        conns = self.active.get(conn.user_id)
+        if not conns or conn not in conns:
+            return
+        conns.remove(conn)
+        if not conns:
+            del self.active[conn.user_id]
+        for room in list(conn.rooms):
+            await self.leave(conn, room)
+        conn.closed = True
+        conn._sender.cancel()
+        await self.broker.presence_remove(conn.user_id, self.worker_id)
+
+    def evict(self, conn: ClientConnection, reason: str):
+        """Drop a connection that overflowed its queue, failed a send, went idle or was replaced"""
+        if conn.closed:
+            return
+        conn.closed = True
+        self.evictions[reason] = self.evictions.get(reason, 0) + 1
+
+        async def _close():
+            await conn.close(code=CLOSE_CODES.get(reason, 1011))
+            await self.disconnect(conn)
+
+        asyncio.get_running_loop().create_task(_close())
 
-    async def send_to_user(self, user_id: str, message: str):
-        if user_id in self.active:
-            for conn in list(self.active[user_id]):
-                try:
-                    await conn.send_text(message)
-                except:
-                    pass
+    async def join(self, conn: ClientConnection, room: str):
+        if room in conn.rooms:
+            return
+        conn.rooms.add(room)
+        members = self.rooms.setdefault(room, set())
+        members.add(conn)
+        if len(members) == 1:
+            await self.broker.presence_add(f"room:{room}", self.worker_id)
+
+    async def leave(self, conn: ClientConnection, room: str):
+        if room not in conn.rooms:
+            return
+        conn.rooms.discard(room)
+        members = self.rooms.get(room, set())
+        members.discard(conn)
+        if not members:
+            self.rooms.pop(room, None)
+            await self.broker.presence_remove(f"room:{room}", self.worker_id)
+
+    def _deliver_room(self, room: str, message: str):
+        for conn in list(self.rooms.get(room, ())):
+            conn.send(message)
+
+    def _deliver_local(self, user_id: str, message: str):
+        for conn in list(self.active.get(user_id, ())):
+            conn.send(message)
+
+    def _broadcast_local(self, message: str):
+        for conns in list(self.active.values()):
+            for conn in list(conns):
+                conn.send(message)
+
+    def metrics(self) -> dict:
+        """Live counts only; cheap enough to scrape frequently"""
+        return {
+            "worker_id": self.worker_id,
+            "connections": self.connection_count,
+            "users": len(self.active),
+            "rooms": len(self.rooms),
+            "queued": sum(conn.queue.qsize() for conns in self.active.values() for conn in conns),
+            "rejected": self.rejected,
+            "evictions": dict(self.evictions),
+            "limits": {
+                "per_user": MAX_CONNECTIONS_PER_USER,
+                "total": MAX_CONNECTIONS,
+                "ping_interval": PING_INTERVAL,
+                "idle_timeout": IDLE_TIMEOUT,
+            },
+        }
+
+    def stats(self) -> dict:
+        connections = [conn.stats() for conns in self.active.values() for conn in conns]
+        return {
+            "worker_id": self.worker_id,
+            "connections": connections,
+            "rooms": {room: len(members) for room, members in self.rooms.items()},
+            "evictions": dict(self.evictions),
+        }
+
+    def anonymous_stats(self) -> dict:
+        """
+        stats() without who is connected or which rooms exist (a pair:<tutor>:<student>
+        room name says who talks to whom): per-connection queue and drop counters,
+        each connection's room count, and room sizes
+        """
+        stats = self.stats()
+        return {
+            "worker_id": stats["worker_id"],
+            "connections": [
+                {**{k: v for k, v in conn.items() if k not in ("user_id", "rooms")}, "rooms": len(conn["rooms"])}
+                for conn in stats["connections"]
+            ],
+            "room_sizes": sorted(stats["rooms"].values(), reverse=True),
+            "evictions": stats["evictions"],
+        }
+
+    async def send_to_user(self, user_id: str, message: str, remote_copies: bool = True):
+        """remote_copies=False only writes this worker's sockets (the sender's own echo)"""
+        self._deliver_local(user_id, message)
+        if not remote_copies:
+            return
+        remote = await self.broker.presence_workers(user_id)
+        remote.discard(self.worker_id)
+        if remote:
+            envelope = json.dumps({"origin": self.worker_id, "user_id": user_id, "message": message})
+            for worker_id in remote:
+                await self.broker.publish(f"chat:worker:{worker_id}", envelope)
+
+    async def send_to_room(self, room: str, message: str):
+        """Fan out to room members only: O(members), crossing to other workers that host some"""
+        self._deliver_room(room, message)
+        remote = await self.broker.presence_workers(f"room:{room}")
+        remote.discard(self.worker_id)
+        if remote:
+            envelope = json.dumps({"origin": self.worker_id, "room": room, "message": message})
+            for worker_id in remote:
+                await self.broker.publish(f"chat:worker:{worker_id}", envelope)
 
     async def broadcast(self, message: str):
-        for user_id in list(self.active.keys()):
-            await self.send_to_user(user_id, message)
+        """Platform-wide announcement to every socket; chat traffic uses rooms instead"""
+        self._broadcast_local(message)
+        await self.broker.publish(BROADCAST_CHANNEL, json.dumps({"origin": self.worker_id, "message": message}))
+
+    async def _on_remote(self, payload: str):
+        envelope = json.loads(payload)
+        if envelope.get("origin") == self.worker_id:
+            return
+        if envelope.get("room") is not None:
+            self._deliver_room(envelope["room"], envelope["message"])
+        elif envelope.get("user_id") is not None:
+            self._deliver_local(envelope["user_id"], envelope["message"])
+        else:
+            self._broadcast_local(envelope["message"])
 
 manager = ConnectionManager()
 
+def _can_join_room(user_id: int, room: str) -> bool:
+    """session:<booking id> is open to its student and tutor; pair:<tutor>:<student> to those two"""
+    if not crud.ROOM_RE.match(room):
+        return False
+    db = session_factory()
+    try:
+        return crud.can_access_room(db, user_id, room)
+    finally:
+        db.close()
+
+def _record_membership(room: str, user_id: int, action: str):
+    db = session_factory()
+    try:
+        db.add(models.RoomMembershipEvent(room=room, user_id=user_id, action=action))
+        db.commit()
+    finally:
+        db.close()
+
+async def _audit(room: str, user_id: int, action: str):
+    if ROOM_AUDIT:
+        await run_in_threadpool(_record_membership, room, user_id, action)
+
+PING_FRAME = json.dumps({"type": "ping"})
+
+def _error(detail: str) -> str:
+    return json.dumps({"type": "error", "detail": detail})
+
+def _message_payload(seq: int, sender_id: int, content: str, created_at: datetime,
+                     receiver_id: Optional[int] = None, room: Optional[str] = None) -> dict:
+    payload = {
+        "seq": seq,
+        "sender_id": sender_id,
+        "content": content,
+        "timestamp": created_at.isoformat()
+    }
+    if room is not None:
+        payload["room"] = room
+    else:
+        payload["receiver_id"] = receiver_id
+    return payload
+
+def _authenticate(token: Optional[str]):
+    if not token:
+        return None
+    db = session_factory()
+    try:
+        return user_from_token(token, db)
+    except HTTPException:
+        return None
+    finally:
+        db.close()
+
+def _load_cursor(user_id: int) -> Optional[int]:
+    db = session_factory()
+    try:
+        return crud.get_chat_cursor(db, user_id)
+    finally:
+        db.close()
+
+def _store_cursor(user_id: int, seq: int):
+    db = session_factory()
+    try:
+        crud.save_chat_cursor(db, user_id, seq)
+    finally:
+        db.close()
+
+def _missed_messages(user_id: int, since: int) -> str:
+    """One resume frame: up to RESUME_PAGE_SIZE messages after `since`, plus where to continue"""
+    db = session_factory()
+    try:
+        rows = crud.get_messages_since(db, user_id, since, limit=RESUME_PAGE_SIZE + 1)
+    finally:
+        db.close()
+    has_more = len(rows) > RESUME_PAGE_SIZE
+    rows = rows[:RESUME_PAGE_SIZE]
+    return json.dumps({
+        "type": "resume",
+        "messages": [
+            _message_payload(m.seq, m.sender_id, m.content, m.created_at, m.receiver_id, m.room)
+            for m in rows
+        ],
+        "has_more": has_more,
+        "next_since": rows[-1].seq if rows else since,
+    })
+
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
-    user_id: str = Query(...),
-    db: Session = Depends(get_db)
+    token: Optional[str] = Query(None),
+    since: Optional[int] = Query(None)
 ):
-    await manager.connect(websocket, user_id)
+    """
+    Chat socket, authenticated by the same bearer token as the HTTP API, passed
+    as ?token= (browsers cannot set headers on a WebSocket) or an Authorization
+    header. The server sends {"type": "ping"} to quiet sockets; clients answer
+    with {"type": "pong"}, and any frame resets the idle timer.
+
+    Every message frame carries a `seq`; clients acknowledge with
+    {"type": "ack", "seq": n} and the highest ack is kept as their cursor.
+
+    On connect, messages after `since` (or the stored cursor) are sent as a
+    "resume" frame before any live traffic. If `has_more` is set, the client asks
+    for the next page with {"type": "resume", "since": next_since}. Live messages
+    that arrived during the replay may repeat the tail of a resume page; clients
+    drop frames whose seq they have already seen.
+
+    Only this worker's write-behind queue is flushed before the replay. With
+    several workers, a message another worker accepted within the last flush
+    interval (50 ms by default, longer if its database writes are retrying)
+    may not be stored yet; it is missing from the replay, and acking a later
+    seq moves the cursor past it. Clients that must not lose such messages can
+    re-read /messages/history for the conversation after resuming.
+    """
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" else None
+    user = await run_in_threadpool(_authenticate, token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    sender_id = user.id
+    user_id = str(sender_id)
+    conn = await manager.connect(websocket, user_id, paused=True)
+    if conn is None:
+        return
+    stored_cursor = await run_in_threadpool(_load_cursor, sender_id)
+    cursor = since if since is not None else stored_cursor
     try:
+        if cursor is not None:
+            # Anything this worker accepted but has not written yet belongs in the replay
+            await message_writer.flush()
+            await websocket.send_text(await run_in_threadpool(_missed_messages, sender_id, cursor))
+        conn.resume()
         while True:
             data = await websocket.receive_text()
+            conn.touch()
             try:
                 msg_data = json.loads(data)
-                sender_id = int(user_id)
-                receiver_id = msg_data.get("receiver_id")
-                content = msg_data.get("content", data)
-                
-                msg = models.Message(sender_id=sender_id, receiver_id=receiver_id, content=content)
-                db.add(msg)
-                db.commit()
-                
-                response = json.dumps({
-                    "sender_id": sender_id,
-                    "content": content,
-                    "timestamp": msg.created_at.isoformat()
-                })
-                
-                if receiver_id:
-                    await manager.send_to_user(str(receiver_id), response)
-                    await manager.send_to_user(user_id, response)
-                else:
-                    await manager.broadcast(response)
-            except json.JSONDecodeError:
-                msg = models.Message(sender_id=int(user_id), content=data)
-                db.add(msg)
-                db.commit()
-                await manager.broadcast(data)
+                if not isinstance(msg_data, dict):
+                    raise ValueError
+            except ValueError:
+                conn.send(_error("Frames must be JSON objects"))
+                continue
+
+            kind = msg_data.get("type", "message")
+            room = msg_data.get("room")
+            if kind == "pong":
+                continue
+            if kind == "ping":
+                conn.send(json.dumps({"type": "pong"}))
+                continue
+            if kind == "join":
+                if not isinstance(room, str) or not await run_in_threadpool(_can_join_room, sender_id, room):
+                    conn.send(_error(f"Cannot join room {room}"))
+                    continue
+                await manager.join(conn, room)
+                await _audit(room, sender_id, "join")
+                conn.send(json.dumps({"type": "joined", "room": room}))
+                continue
+            if kind == "leave":
+                if room in conn.rooms:
+                    await manager.leave(conn, room)
+                    await _audit(room, sender_id, "leave")
+                conn.send(json.dumps({"type": "left", "room": room}))
+                continue
+            if kind == "ack":
+                seq = msg_data.get("seq")
+                if isinstance(seq, int) and (conn.acked_seq is None or seq > conn.acked_seq):
+                    conn.acked_seq = seq
+                continue
+            if kind == "resume":
+                since = msg_data.get("since")
+                if not isinstance(since, int):
+                    conn.send(_error("resume needs an integer since"))
+                    continue
+                conn.send(await run_in_threadpool(_missed_messages, sender_id, since))
+                continue
+
+            receiver_id = msg_data.get("receiver_id")
+            content = msg_data.get("content")
+            if not content:
+                conn.send(_error("Message content is required"))
+                continue
+            if room is not None and room not in conn.rooms:
+                conn.send(_error(f"Join room {room} before sending to it"))
+                continue
+            if room is None and not receiver_id:
+                conn.send(_error("Message needs a receiver_id or room"))
+                continue
+            if room is None:
+                if isinstance(receiver_id, str) and receiver_id.isdigit():
+                    receiver_id = int(receiver_id)
+                if not isinstance(receiver_id, int) or isinstance(receiver_id, bool):
+                    conn.send(_error("receiver_id must be a user id"))
+                    continue
+
+            created_at = datetime.utcnow()
+            seq = message_sequence.next()
+            if room is not None:
+                receiver_id = None
+            payload = _message_payload(seq, sender_id, content, created_at, receiver_id, room)
+            # Queue for the background writer before delivering, so a reconnect that
+            # flushes the writer can't miss a message that was already delivered
+            await message_writer.enqueue(sender_id, content, receiver_id=receiver_id, room=room,
+                                         created_at=created_at, seq=seq)
+            if room is not None:
+                await manager.send_to_room(room, json.dumps(payload))
+            else:
+                response = json.dumps(payload)
+                await manager.send_to_user(str(receiver_id), response)
+                await manager.send_to_user(user_id, response, remote_copies=False)
     except WebSocketDisconnect:
-        manager.disconnect(websocket, user_id)
\ No newline at end of file
+        pass
+    finally:
+        # Any exit, not just a clean disconnect, releases the slot, rooms and presence
+        rooms = list(conn.rooms)
+        await manager.disconnect(conn)
+        for room in rooms:
+            await _audit(room, sender_id, "leave")
+        if conn.acked_seq is not None and (stored_cursor is None or conn.acked_seq > stored_cursor):
+            await run_in_threadpool(_store_cursor, sender_id, conn.acked_seq)
+
+@router.get("/ws/stats")
+def websocket_stats(current_user=Depends(get_current_user)):
+    """Per-connection outbound queue depth and drop counters for this worker, without user ids or room names"""
+    if current_user.role != "tutor":
+        raise HTTPException(status_code=403, detail="Only tutors can view chat statistics")
+    return manager.anonymous_stats()
+
+@router.get("/ws/metrics")
+def websocket_metrics(current_user=Depends(get_current_user)):
+    """Live connection, user and room counts for this worker, with its limits"""
+    if current_user.role != "tutor":
+        raise HTTPException(status_code=403, detail="Only tutors can view chat metrics")
+    return manager.metrics()
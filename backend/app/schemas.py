@@ -68,11 +68,25 @@ class AssignmentOut(BaseModel):
     class Config:
         orm_mode = True
 
+class AssignmentFeedItem(AssignmentOut):
+    status: str
+    submission_id: Optional[int] = None
+    grade: Optional[str] = None
+    feedback: Optional[str] = None
+    submitted_at: Optional[datetime] = None
+
+class AssignmentFeedPage(BaseModel):
+    items: List[AssignmentFeedItem]
+    next_cursor: Optional[str] = None
+
 class SubmissionOut(BaseModel):
     id: int
     assignment_id: int
     student_id: int
     file_path: Optional[str]
+    file_name: Optional[str] = None
+    file_sha256: Optional[str] = None
+    file_size: Optional[int] = None
     grade: Optional[str]
     feedback: Optional[str]
     created_at: datetime
@@ -80,6 +94,14 @@ class SubmissionOut(BaseModel):
     class Config:
         orm_mode = True
 
+class SubmissionGrade(BaseModel):
+    submission_id: int
+    grade: str
+    feedback: Optional[str] = None
+
+class BulkGradeIn(BaseModel):
+    grades: List[SubmissionGrade]
+
 class FeedbackCreate(BaseModel):
     session_id: int
     tutor_id: int
@@ -180,3 +202,53 @@ class StudySessionOut(BaseModel):
     
     class Config:
         orm_mode = True
+
+class MessageOut(BaseModel):
+    id: int
+    sender_id: int
+    receiver_id: Optional[int]
+    room: Optional[str]
+    seq: Optional[int]
+    content: str
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
+
+class MessageHistoryPage(BaseModel):
+    conversation_key: str
+    items: List[MessageOut]
+    next_cursor: Optional[str] = None
+
+class ConversationSummaryOut(BaseModel):
+    conversation_key: str
+    peer_id: Optional[int]
+    room: Optional[str]
+    last_sender_id: Optional[int]
+    last_content: Optional[str]
+    last_message_at: Optional[datetime]
+    unread_count: int
+
+    class Config:
+        orm_mode = True
+
+class StudyDocumentCreate(BaseModel):
+    title: str
+    content: str
+
+class StudyDocumentOut(BaseModel):
+    id: int
+    title: str
+    source: str
+    token_count: int
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
+
+class DocumentHit(BaseModel):
+    document_id: int
+    title: str
+    chunk: int
+    score: float
+    text: str
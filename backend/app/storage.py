@@ -0,0 +1,298 @@
+import os
+from typing import Iterator, Optional, Tuple
+from urllib.parse import quote
+from uuid import uuid4
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+# Which driver stores new uploads: "local" (default) or "s3"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+
+S3_BUCKET = os.environ.get("S3_BUCKET")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")  # e.g. http://localhost:9000 for MinIO
+S3_REGION = os.environ.get("S3_REGION")
+S3_PREFIX = os.environ.get("S3_PREFIX", "blobs/")
+S3_PRESIGN_EXPIRES = int(os.environ.get("S3_PRESIGN_EXPIRES", 300))
+S3_PART_SIZE = 8 * 1024 * 1024
+
+def _shard(sha256: str) -> str:
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+def _is_missing(error) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "NotFound")
+
+class LocalStorage:
+    """Blobs under <UPLOAD_DIR>/blobs/ab/cd/<sha256>; locations are absolute paths"""
+    name = "local"
+
+    def __init__(self, root: Optional[str] = None):
+        self._root = root
+
+    @property
+    def root(self) -> str:
+        if self._root is not None:
+            return self._root
+        from . import files
+        return files.UPLOAD_DIR
+
+    def blob_root(self) -> str:
+        return os.path.join(self.root, 'blobs')
+
+    def tmp_root(self) -> str:
+        return os.path.join(self.root, 'tmp')
+
+    def location(self, sha256: str) -> str:
+        return os.path.join(self.blob_root(), *_shard(sha256).split('/'))
+
+    def touch(self, sha256: str) -> bool:
+        """Refresh a blob's mtime so a concurrent GC pass treats it as in use"""
+        try:
+            os.utime(self.location(sha256))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def retire(self, sha256: str, cutoff: float) -> bool:
+        """
+        Delete a blob unless it was touched after `cutoff`. The blob is first
+        renamed out of place, so a touch() from then on misses it (and the
+        upload writes a fresh copy), while one that landed before the rename
+        shows in the mtime and the blob is put back.
+        """
+        os.makedirs(self.tmp_root(), exist_ok=True)
+        aside = os.path.join(self.tmp_root(), f"{sha256}.retiring")
+        try:
+            os.replace(self.location(sha256), aside)
+        except FileNotFoundError:
+            return False
+        if os.stat(aside).st_mtime > cutoff:
+            os.replace(aside, self.location(sha256))
+            return False
+        os.remove(aside)
+        return True
+
+    async def save(self, sha256: str, upload_file: UploadFile, chunk_size: int) -> str:
+        dest = self.location(sha256)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.makedirs(self.tmp_root(), exist_ok=True)
+        tmp = os.path.join(self.tmp_root(), f"{uuid4().hex}.part")
+        try:
+            async with aiofiles.open(tmp, 'wb') as buffer:
+                while True:
+                    chunk = await upload_file.read(chunk_size)
+                    if not chunk:
+                        break
+                    await buffer.write(chunk)
+            await aiofiles.os.replace(tmp, dest)
+        except BaseException:
+            if os.path.exists(tmp):
+                await aiofiles.os.remove(tmp)
+            raise
+        return dest
+
+    def open(self, location: str):
+        return open(location, 'rb')
+
+    def local_path(self, location: str) -> Optional[str]:
+        return location
+
+    def presigned_url(self, location: str, filename: Optional[str] = None) -> Optional[str]:
+        return None
+
+    def iter_blobs(self) -> Iterator[Tuple[str, float, int]]:
+        for root, _, names in os.walk(self.blob_root()):
+            for name in names:
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                yield name, st.st_mtime, st.st_size
+
+    def delete(self, sha256: str):
+        try:
+            os.remove(self.location(sha256))
+        except FileNotFoundError:
+            pass
+
+    def cleanup_temp(self, cutoff: float):
+        if not os.path.isdir(self.tmp_root()):
+            return
+        for name in os.listdir(self.tmp_root()):
+            path = os.path.join(self.tmp_root(), name)
+            try:
+                if os.stat(path).st_mtime <= cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+class S3Storage:
+    """
+    Blobs in an S3-compatible bucket (AWS, MinIO, ...) at <prefix>ab/cd/<sha256>;
+    locations are s3://bucket/key. Uploads use multipart transfers and downloads
+    redirect to presigned URLs, so file bytes never pass through app workers.
+    """
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = S3_PREFIX, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            from botocore.config import Config
+            # Only send/verify the newer flexible checksums when an operation requires
+            # them; many S3-compatible servers (older MinIO, Ceph) don't support them
+            config = Config(request_checksum_calculation="when_required", response_checksum_validation="when_required")
+            self._client = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION, config=config)
+        return self._client
+
+    def key(self, sha256: str) -> str:
+        return f"{self.prefix}{_shard(sha256)}"
+
+    def location(self, sha256: str) -> str:
+        return f"s3://{self.bucket}/{self.key(sha256)}"
+
+    def _key_from_location(self, location: str) -> str:
+        return location[len(f"s3://{self.bucket}/"):]
+
+    def lease_key(self, sha256: str) -> str:
+        return f"{self.prefix}leases/{sha256}"
+
+    def retiring_key(self, sha256: str) -> str:
+        return f"{self.prefix}retiring/{sha256}"
+
+    def touch(self, sha256: str) -> bool:
+        # The lease is written before the blob is looked at, so a retire() that
+        # deletes the blob after this finds it is bound to see the lease (see retire).
+        # A server-side copy onto itself bumps LastModified without moving bytes. S3 only
+        # allows it with MetadataDirective=REPLACE, which resets anything not passed again,
+        # so the content type and metadata set by save() are carried over.
+        from botocore.exceptions import ClientError
+        key = self.key(sha256)
+        self.client.put_object(Bucket=self.bucket, Key=self.lease_key(sha256), Body=b"")
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+            extra = {"ContentType": head["ContentType"]} if head.get("ContentType") else {}
+            self.client.copy_object(
+                Bucket=self.bucket, Key=key,
+                CopySource={"Bucket": self.bucket, "Key": key},
+                MetadataDirective="REPLACE", Metadata=head.get("Metadata", {}), **extra
+            )
+            return True
+        except ClientError as e:
+            if _is_missing(e):
+                return False
+            raise
+
+    def retire(self, sha256: str, cutoff: float) -> bool:
+        """
+        Delete a blob unless it was touched after `cutoff`. S3 has no rename, so
+        the blob is copied aside, deleted, and then the lease is checked: a touch()
+        that found the blob wrote its lease before that, so a fresh lease means
+        the copy is put back.
+        """
+        from botocore.exceptions import ClientError
+        key, aside = self.key(sha256), self.retiring_key(sha256)
+        try:
+            self.client.copy_object(Bucket=self.bucket, Key=aside, CopySource={"Bucket": self.bucket, "Key": key})
+        except ClientError as e:
+            if _is_missing(e):
+                return False
+            raise
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+        try:
+            leased = self.client.head_object(Bucket=self.bucket, Key=self.lease_key(sha256))["LastModified"].timestamp()
+        except ClientError as e:
+            if not _is_missing(e):
+                raise
+            leased = None
+        touched = leased is not None and leased > cutoff
+        if touched:
+            self.client.copy_object(Bucket=self.bucket, Key=key, CopySource={"Bucket": self.bucket, "Key": aside})
+        else:
+            self.client.delete_object(Bucket=self.bucket, Key=self.lease_key(sha256))
+        self.client.delete_object(Bucket=self.bucket, Key=aside)
+        return not touched
+
+    async def save(self, sha256: str, upload_file: UploadFile, chunk_size: int) -> str:
+        from boto3.s3.transfer import TransferConfig
+        config = TransferConfig(multipart_threshold=S3_PART_SIZE, multipart_chunksize=S3_PART_SIZE)
+        extra = {"ContentType": upload_file.content_type} if upload_file.content_type else None
+        await run_in_threadpool(
+            self.client.upload_fileobj, upload_file.file, self.bucket, self.key(sha256),
+            ExtraArgs=extra, Config=config
+        )
+        return self.location(sha256)
+
+    def open(self, location: str):
+        """The object's body stream; a missing object raises FileNotFoundError, like LocalStorage"""
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key_from_location(location))["Body"]
+        except ClientError as e:
+            if _is_missing(e):
+                raise FileNotFoundError(location) from e
+            raise
+
+    def local_path(self, location: str) -> Optional[str]:
+        return None
+
+    def presigned_url(self, location: str, filename: Optional[str] = None) -> Optional[str]:
+        params = {"Bucket": self.bucket, "Key": self._key_from_location(location)}
+        if filename:
+            params["ResponseContentDisposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=S3_PRESIGN_EXPIRES)
+
+    def iter_blobs(self) -> Iterator[Tuple[str, float, int]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        bookkeeping = (self.lease_key(""), self.retiring_key(""))
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                if obj["Key"].startswith(bookkeeping):
+                    continue
+                yield obj["Key"].rsplit("/", 1)[-1], obj["LastModified"].timestamp(), obj["Size"]
+
+    def delete(self, sha256: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(sha256))
+
+    def cleanup_temp(self, cutoff: float):
+        # Incomplete multipart uploads are best expired with a bucket lifecycle rule
+        pass
+
+_storage = None
+
+def get_storage():
+    """The driver new uploads are written to, built once from STORAGE_BACKEND"""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "s3":
+            if not S3_BUCKET:
+                raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+            _storage = S3Storage(S3_BUCKET)
+        else:
+            _storage = LocalStorage()
+    return _storage
+
+def set_storage(storage):
+    global _storage
+    _storage = storage
+
+_readers = {}
+
+def storage_for(location: str):
+    """The driver that can read an existing location (rows may predate a backend switch)"""
+    storage = get_storage()
+    if location.startswith("s3://"):
+        bucket = location[len("s3://"):].split("/", 1)[0]
+        if isinstance(storage, S3Storage) and storage.bucket == bucket:
+            return storage
+        # Written before a switch to local storage, or to another bucket
+        if bucket not in _readers:
+            _readers[bucket] = S3Storage(bucket)
+        return _readers[bucket]
+    return storage if isinstance(storage, LocalStorage) else LocalStorage()
@@ -0,0 +1,149 @@
+"""
+AI endpoint concurrency benchmark (how many model calls one worker holds open).
+
+Starts a fake OpenAI-compatible server, in its own process, that answers
+/v1/chat/completions after a fixed delay and counts how many requests it is
+serving at once. "before" is the old endpoint shape: a sync route that builds
+a new OpenAI client per call and occupies a threadpool worker until the model
+answers. "after" is the real /ai/summarize route on the shared AsyncOpenAI
+client. Every request sends X-AI-Cache: bypass so the response cache doesn't
+hide upstream calls.
+
+The load generator and the app share a process, so at low model latency the
+"after" numbers are bounded by client-side CPU rather than the app.
+
+Usage: python -m benchmarks.ai_concurrency [requests] [model latency seconds]
+"""
+
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+MODEL_PORT = 8765
+APP_PORT = 8766
+
+class Upstream:
+    in_flight = 0
+    peak = 0
+
+def fake_model_app(latency: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def completions(body: dict):
+        Upstream.in_flight += 1
+        Upstream.peak = max(Upstream.peak, Upstream.in_flight)
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            Upstream.in_flight -= 1
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "A short summary."},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        }
+
+    @app.post("/stats/reset")
+    def reset():
+        Upstream.peak = 0
+        return {}
+
+    @app.get("/stats")
+    def stats():
+        return {"peak": Upstream.peak}
+
+    return app
+
+def run_model_server(latency: float):
+    uvicorn.run(fake_model_app(latency), host="127.0.0.1", port=MODEL_PORT, log_level="warning")
+
+def legacy_app(base_url: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/ai/summarize")
+    def summarize(payload: dict):
+        from openai import OpenAI
+        client = OpenAI(api_key="sk-bench", base_url=base_url)
+        response = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": payload["text"]}],
+            max_tokens=200,
+        )
+        return {"summary": response.choices[0].message.content}
+
+    return app
+
+def serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+async def fire(n: int) -> float:
+    limits = httpx.Limits(max_connections=n, max_keepalive_connections=n)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}", limits=limits, timeout=120) as client:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.post("/ai/summarize", json={"text": f"Lecture notes {i}."}, headers={"X-AI-Cache": "bypass"})
+            for i in range(n)
+        ))
+        elapsed = time.perf_counter() - started
+    assert all(r.status_code == 200 for r in responses), {r.status_code for r in responses}
+    return elapsed
+
+def run(label: str, app, n: int, latency: float):
+    model = f"http://127.0.0.1:{MODEL_PORT}"
+    httpx.post(f"{model}/stats/reset")
+    server = serve(app, APP_PORT)
+    try:
+        elapsed = asyncio.run(fire(n))
+    finally:
+        server.should_exit = True
+        time.sleep(0.2)
+    peak = httpx.get(f"{model}/stats").json()["peak"]
+    print(f"{label:<7} {n} requests in {elapsed:6.2f}s  {n / elapsed:7.1f} req/s  "
+          f"peak upstream concurrency {peak:4d}  (ideal {latency:.2f}s)")
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    base_url = f"http://127.0.0.1:{MODEL_PORT}/v1"
+    os.environ["OPENAI_API_KEY"] = "sk-bench"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["AI_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "ai_cache.db")
+
+    model = multiprocessing.Process(target=run_model_server, args=(latency,), daemon=True)
+    model.start()
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{MODEL_PORT}/stats")
+            break
+        except httpx.TransportError:
+            time.sleep(0.05)
+    from app.routers import ai
+    after_app = FastAPI()
+    after_app.include_router(ai.router)
+    try:
+        run("before", legacy_app(base_url), n, latency)
+        run("after", after_app, n, latency)
+    finally:
+        model.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Chat retrieval over a student's saved documents.
+
+"before": the student pastes their notes into the message, so every chat turn
+carries the whole text. "after": the notes are saved once, and each turn
+embeds the question, searches the user's memory-mapped index and injects only
+the best chunks within DOC_CONTEXT_TOKENS. Also times incremental indexing
+(one more document after many) and top-k search as the index grows.
+
+Usage: python -m benchmarks.doc_retrieval [documents] [pages per document]
+"""
+
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+def main():
+    documents = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    from app import doc_store
+    from app.ai_pipeline import estimate_tokens
+    from benchmarks.local_nlp import build_text
+
+    embedder = doc_store.HashingEmbedder()
+    index = doc_store.VectorIndex(tempfile.mkdtemp(), embedder.name, embedder.dim)
+    texts = [build_text(pages, seed=i) for i in range(documents)]
+
+    next_id, chunk_tokens = 0, {}
+    started = time.perf_counter()
+    for text in texts[:-1]:
+        _, chunks, tokens = doc_store.prepare_document(text)
+        ids = list(range(next_id, next_id + len(chunks)))
+        index.append(ids, embedder.embed_sync(chunks))
+        chunk_tokens.update(zip(ids, tokens))
+        next_id += len(chunks)
+    print(f"index build        {time.perf_counter() - started:7.2f} s  ({documents - 1} documents, {next_id} chunks)")
+
+    started = time.perf_counter()
+    _, chunks, tokens = doc_store.prepare_document(texts[-1])
+    ids = list(range(next_id, next_id + len(chunks)))
+    index.append(ids, embedder.embed_sync(chunks))
+    chunk_tokens.update(zip(ids, tokens))
+    next_id += len(chunks)
+    print(f"add one more       {1000 * (time.perf_counter() - started):7.1f} ms  ({len(chunks)} chunks embedded)")
+
+    live = np.arange(next_id, dtype=np.int64)
+    question = "What is the role of mitochondria in cellular respiration?"
+    started = time.perf_counter()
+    for _ in range(100):
+        hits = index.search(embedder.embed_sync([question])[0], live, doc_store.DOC_TOP_K)
+    print(f"embed + search     {10 * (time.perf_counter() - started):7.1f} ms  (top {doc_store.DOC_TOP_K} of {next_id} chunks)")
+
+    used = 0
+    for chunk_id, _ in hits:
+        if used + chunk_tokens[chunk_id] <= doc_store.DOC_CONTEXT_TOKENS:
+            used += chunk_tokens[chunk_id]
+    print(f"before prompt      {estimate_tokens(texts[0]):7d} tokens  (one {pages}-page document pasted per turn)")
+    print(f"after prompt       {used:7d} tokens  (retrieved excerpts, budget {doc_store.DOC_CONTEXT_TOKENS})")
+
+if __name__ == "__main__":
+    main()
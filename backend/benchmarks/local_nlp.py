@@ -0,0 +1,148 @@
+"""
+Offline study-material engine on a long document.
+
+Times the endpoint fallbacks, now backed by the NumPy engine, reports peak
+memory, and prints a sample of each result. The old fallbacks (first
+sentences, first lines, "Alternative 1" options) were instant but unusable;
+the budget for the new ones is well under a second per document, so they can
+absorb shed load and not just outages.
+
+The default corpus is real prose with a realistic vocabulary: docstrings of
+the Python standard library, about 500 words per page. "notes" uses the
+generated biology notes instead (few topics, small vocabulary).
+
+Usage: python -m benchmarks.local_nlp [pages] [prose|notes]
+"""
+
+import ast
+import os
+import random
+import sys
+import sysconfig
+import time
+import tracemalloc
+
+
+TOPICS = {
+    "photosynthesis": [
+        "Photosynthesis is the process by which plants convert light energy into chemical energy.",
+        "Chlorophyll in the chloroplast absorbs red and blue light for photosynthesis.",
+        "The light reactions of photosynthesis split water and release oxygen.",
+        "The Calvin cycle fixes carbon dioxide into glucose.",
+    ],
+    "mitochondria": [
+        "Mitochondria are organelles that produce ATP through cellular respiration.",
+        "Cellular respiration breaks down glucose in the mitochondria.",
+        "The electron transport chain in the mitochondria pumps protons across the inner membrane.",
+        "Muscle cells contain many mitochondria because they need a lot of ATP.",
+    ],
+    "osmosis": [
+        "Osmosis is the movement of water across a semipermeable membrane.",
+        "Water moves by osmosis from low solute concentration to high solute concentration.",
+        "A red blood cell placed in pure water swells because of osmosis.",
+        "Plant cells rely on osmosis to maintain turgor pressure.",
+    ],
+    "enzymes": [
+        "Enzymes are proteins that lower the activation energy of chemical reactions.",
+        "Each enzyme binds its substrate at the active site.",
+        "High temperature can denature an enzyme and change the active site.",
+        "Competitive inhibitors block the active site of an enzyme.",
+    ],
+    "DNA replication": [
+        "DNA replication is the copying of the genome before the cell divides.",
+        "Helicase unwinds the double helix during DNA replication.",
+        "DNA polymerase adds nucleotides to the growing strand.",
+        "DNA replication is semiconservative because each new molecule keeps one old strand.",
+    ],
+    "natural selection": [
+        "Natural selection is the process by which favourable traits become more common.",
+        "Variation and heritability are required for natural selection.",
+        "Antibiotic resistance in bacteria is an example of natural selection.",
+        "Darwin described natural selection after observing finches.",
+    ],
+}
+WITNESSES = ["the lab", "the lecture", "the worksheet", "the field study", "the tutor", "the reading"]
+VERBS = ["showed", "noted", "explained", "measured", "demonstrated", "recorded"]
+HEADERS = ["Biology 101 lecture notes.", "Unit 3 review packet."]
+
+def build_text(pages: int, seed: int = 7) -> str:
+    """About 500 words per page of study notes, with a repeated page header like extracted PDF text"""
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    paragraphs = []
+    for page in range(pages):
+        paragraphs.append(rng.choice(HEADERS))
+        for _ in range(8):
+            topic = rng.choice(topics)
+            # A varying clause keeps sentences distinct, as in real notes (exact repeats are deduplicated)
+            sentences = [
+                f"{sentence[:-1]}, as {rng.choice(WITNESSES)} {rng.choice(VERBS)} in case {rng.randint(1, 10000)}."
+                for sentence in rng.sample(TOPICS[topic], 3)
+            ]
+            if rng.random() < 0.2:
+                other = rng.choice(topics)
+                sentences.append(f"Question {rng.randint(1, 40)} on page {page + 1} compares {topic} with {other}.")
+            paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+def build_prose(pages: int) -> str:
+    """About 500 words per page of English prose: standard library docstrings, in a fixed order"""
+    paragraphs, words = [], 0
+    root = sysconfig.get_paths()["stdlib"]
+    for directory, subdirectories, files in sorted(os.walk(root)):
+        subdirectories[:] = sorted(d for d in subdirectories if d not in ("test", "tests", "idlelib", "site-packages"))
+        for name in sorted(files):
+            if not name.endswith(".py"):
+                continue
+            try:
+                with open(os.path.join(directory, name), encoding="utf-8") as source:
+                    tree = ast.parse(source.read())
+            except (SyntaxError, UnicodeDecodeError, ValueError):
+                continue
+            for node in ast.walk(tree):
+                if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                    doc = ast.get_docstring(node)
+                    if doc and len(doc.split()) >= 20:
+                        paragraphs.append(doc)
+                        words += len(doc.split())
+                        if words >= pages * 500:
+                            return "\n\n".join(paragraphs)
+    return "\n\n".join(paragraphs)
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    corpus = sys.argv[2] if len(sys.argv) > 2 else "prose"
+    text = build_prose(pages) if corpus == "prose" else build_text(pages)
+    print(f"{pages} pages of {corpus}, {len(text.split())} words")
+
+    from app.routers import ai
+    from app import local_nlp
+    started = time.perf_counter()
+    doc = local_nlp.Document(text)
+    print(f"matrix build       {1000 * (time.perf_counter() - started):7.1f} ms  "
+          f"{len(doc.sentences)} sentences x {len(doc.terms)} terms, {len(doc.values)} nonzero")
+
+    cases = [
+        ("summarize", lambda: ai._summary_fallback(text)),
+        ("flashcards", lambda: ai._flashcards_fallback(text)),
+        ("quiz", lambda: ai._quiz_fallback(text)),
+        ("concept-map", lambda: ai._concept_map_fallback(text)),
+    ]
+    total = 0.0
+    for name, run in cases:
+        started = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - started
+        total += elapsed
+        print(f"{name:<18} {elapsed * 1000:7.1f} ms  {str(result)[:90]}")
+    print(f"all four           {total * 1000:7.1f} ms  (one shared analysis)")
+
+    # Measured separately: tracing allocations slows the run down several times
+    local_nlp.analyze.cache_clear()
+    tracemalloc.start()
+    for _, run in cases:
+        run()
+    print(f"peak memory        {tracemalloc.get_traced_memory()[1] / 1e6:7.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+PDF text extraction benchmark on a generated 500-page document.
+
+"before" replays the old /ai/extract-pdf body: PdfReader over BytesIO and a
+serial `text += page.extract_text()` loop. "after" runs the process-pool
+service cold (no cached pages), then again warm, where every page comes from
+the text cache keyed by file hash.
+
+Usage: python -m benchmarks.pdf_extract [pages] [lines per page]
+"""
+
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+
+def build_pdf(pages: int, lines_per_page: int = 40) -> bytes:
+    """A minimal text PDF (Helvetica, one content stream per page) without extra dependencies"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the kids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for p in range(pages):
+        lines = [f"Page {p + 1} line {i + 1}: the mitochondria is the powerhouse of the cell." for i in range(lines_per_page)]
+        body = "BT /F1 10 Tf 12 TL 50 780 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        stream = body.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 3 0 R >> >> >>" % content_ref
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), pages
+    )
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, obj))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+def before(data: bytes) -> int:
+    from PyPDF2 import PdfReader
+    reader = PdfReader(io.BytesIO(data))
+    text = ""
+    for page in reader.pages:
+        text += page.extract_text() + "\n\n"
+    return len(text)
+
+async def after(data: bytes) -> int:
+    from app import pdf_extract
+    path, sha256 = pdf_extract.spool_to_temp(io.BytesIO(data))
+    try:
+        total = await pdf_extract.page_count(path, sha256)
+        texts = [text async for _, text in pdf_extract.extract_pages(path, sha256, list(range(total)))]
+    finally:
+        os.unlink(path)
+    return len("\n\n".join(texts))
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    data = build_pdf(pages, lines)
+    print(f"{pages} pages, {len(data) / 1e6:.1f} MB")
+
+    started = time.perf_counter()
+    chars = before(data)
+    print(f"before       {time.perf_counter() - started:6.2f}s  ({chars} chars, serial, on the event loop)")
+
+    os.environ.setdefault("PDF_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "pdf_text_cache.db"))
+    from app import pdf_extract
+    pdf_extract.get_pool().submit(int).result()  # start the workers outside the timing
+    for label in ("after cold", "after warm"):
+        started = time.perf_counter()
+        chars = asyncio.run(after(data))
+        print(f"{label:<12} {time.perf_counter() - started:6.2f}s  ({chars} chars, {pdf_extract.PDF_WORKERS} workers)")
+    pdf_extract.shutdown_pool()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Flashcard replies in the shapes models actually send: the old greedy-regex
+parser versus app.ai_output (exact JSON extraction, pydantic validation, one
+repair call).
+
+A stand-in model returns each reply shape in turn; on a repair call it
+returns the corrected JSON unless the first reply was a refusal. "before"
+parses like the old endpoints did (startswith / re.search(r'\\[.*\\]')) and
+falls back silently; "after" goes through complete_structured and reads the
+per-endpoint counters it records.
+
+Usage: python -m benchmarks.structured_output [replies per shape]
+"""
+
+import asyncio
+import json
+import re
+import sys
+from types import SimpleNamespace
+
+CARDS = [{"q": "What do mitochondria make?", "a": "ATP"}, {"q": "What stores DNA?", "a": "The nucleus"}]
+
+SHAPES = {
+    "clean object": json.dumps({"cards": CARDS}),
+    "fenced array": "```json\n" + json.dumps(CARDS) + "\n```",
+    "prose + note [1]": "Here are your cards:\n" + json.dumps(CARDS) + "\nBased on section [1].",
+    "missing field": json.dumps({"cards": [{"q": "What stores DNA?"}]}),
+    "truncated": json.dumps({"cards": CARDS})[:60],
+    "refusal": "Sorry, I can't make flashcards from that.",
+}
+
+class ShapeModel:
+    def __init__(self, reply: str):
+        self.reply = reply
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        repair = kwargs["temperature"] == 0
+        if repair and not self.reply.startswith("Sorry"):
+            content = json.dumps({"cards": CARDS})
+        else:
+            content = self.reply
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def legacy_parse(text: str):
+    if text.startswith("["):
+        return json.loads(text)
+    match = re.search(r"\[.*\]", text, re.DOTALL)
+    if not match:
+        raise ValueError("Could not parse model output")
+    return json.loads(match.group())
+
+def legacy_usable(cards) -> bool:
+    return bool(cards) and all(isinstance(c, dict) and "q" in c and "a" in c for c in cards)
+
+async def after(reply: str, repeats: int):
+    from app.ai_output import FlashcardSet, OutputError, complete_structured
+    model, usable = ShapeModel(reply), 0
+    for _ in range(repeats):
+        try:
+            await complete_structured(model, "bench", "flashcards", "Make flashcards.", "text", 500, FlashcardSet)
+            usable += 1
+        except OutputError:
+            pass
+    return usable, model.calls
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    from app.ai_output import output_stats
+    print(f"{repeats} replies per shape")
+    print(f"{'shape':<18} {'before usable':>14} {'served bad':>11} {'after usable':>13} {'calls':>6}")
+    for shape, reply in SHAPES.items():
+        try:
+            cards = legacy_parse(reply.strip())
+            good, bad = (repeats, 0) if legacy_usable(cards) else (0, repeats)
+        except ValueError:
+            good, bad = 0, 0
+        usable, calls = asyncio.run(after(reply, repeats))
+        print(f"{shape:<18} {good:>14} {bad:>11} {usable:>13} {calls:>6}")
+    stats = output_stats()["flashcards"]
+    print(f"after: parse failure rate {stats['parse_failure_rate']:.1%}, unusable {stats['unusable_rate']:.1%}, "
+          f"{stats['wasted_tokens']} tokens spent on unusable replies (before: not measured)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Study tools on one text: the four single endpoints versus /ai/study-pack.
+
+A stand-in model client sleeps for a fixed latency per call and counts the
+input tokens it is sent. "before" calls /ai/summarize, /ai/flashcards,
+/ai/quiz and /ai/concept-map (sequentially, as separate round trips, and
+concurrently); "after" makes one /ai/study-pack request.
+
+Usage: python -m benchmarks.study_pack [latency seconds] [pages]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+class CountingModel:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.input_tokens = 0
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        from app.ai_pipeline import estimate_tokens
+        self.calls += 1
+        self.input_tokens += sum(estimate_tokens(m["content"]) for m in kwargs["messages"])
+        await asyncio.sleep(self.latency)
+        prompt = kwargs["messages"][0]["content"]
+        if "exactly these keys" in prompt:
+            reply = json.dumps({
+                "summary": "Summary.", "flashcards": [{"q": "Q?", "a": "A."}],
+                "quiz": [{"question": "Q?", "options": ["a", "b", "c", "d"], "correct_answer": 0}],
+                "concept_map": {"nodes": [{"id": 0, "label": "A"}], "edges": []},
+            })
+        elif "concept map" in prompt:
+            reply = '{"nodes": [{"id": 0, "label": "A", "type": "concept"}], "edges": []}'
+        elif "flashcards" in prompt:
+            reply = '{"cards": [{"q": "Q?", "a": "A."}]}'
+        elif "multiple-choice" in prompt:
+            reply = '{"questions": [{"question": "Q?", "options": ["a", "b", "c", "d"], "correct_answer": 0}]}'
+        else:
+            reply = "Summary."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+async def run(label: str, latency: float, text: str, requests):
+    import httpx
+    from app.main import app
+    from app.routers import ai
+    from app.ai_cache import ResponseCache
+    model = CountingModel(latency)
+    ai.get_openai_client = lambda: model
+    ai.response_cache = ResponseCache(path=os.path.join(tempfile.mkdtemp(), "cache.db"))
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        started = time.perf_counter()
+        await requests(client, text)
+        elapsed = time.perf_counter() - started
+    print(f"{label:<22} {elapsed:6.2f}s  {model.calls} model calls  {model.input_tokens:6d} input tokens")
+
+async def sequential(client, text):
+    for path in ("summarize", "flashcards", "quiz", "concept-map"):
+        await client.post(f"/ai/{path}", json={"text": text})
+
+async def concurrent(client, text):
+    await asyncio.gather(*(
+        client.post(f"/ai/{path}", json={"text": text}) for path in ("summarize", "flashcards", "quiz", "concept-map")
+    ))
+
+async def pack(client, text):
+    await client.post("/ai/study-pack", json={"text": text})
+
+def main():
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    from benchmarks.local_nlp import build_text
+    text = build_text(pages)
+    print(f"{pages} pages of notes, model latency {latency}s")
+    asyncio.run(run("before (sequential)", latency, text, sequential))
+    asyncio.run(run("before (concurrent)", latency, text, concurrent))
+    asyncio.run(run("after (study-pack)", latency, text, pack))
+
+if __name__ == "__main__":
+    main()
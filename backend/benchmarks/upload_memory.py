@@ -0,0 +1,59 @@
+"""
+Memory benchmark for homework uploads.
+Streams a 200 MB file through save_upload_file and reports the peak Python heap
+allocation next to the old read()/splitlines() implementation.
+
+Usage: python -m benchmarks.upload_memory [size_mb]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from fastapi import UploadFile
+from app import files
+
+def make_source(size_mb: int) -> str:
+    fd, path = tempfile.mkstemp(suffix=".bin")
+    block = os.urandom(1024 * 1024)
+    with os.fdopen(fd, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+    return path
+
+def legacy_save(src: str, dest: str):
+    with open(src, 'rb') as upload, open(dest, 'wb') as buffer:
+        for chunk in upload.read().splitlines():
+            buffer.write(chunk + b"\n")
+
+async def streaming_save(src: str, max_size: int):
+    with open(src, 'rb') as f:
+        return await files.save_upload_file(UploadFile(f, filename="bench.bin"), max_size=max_size)
+
+def measure(label, fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} peak={peak / 1024 / 1024:8.1f} MB  time={elapsed:6.2f}s")
+    return result
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    src = make_source(size_mb)
+    with tempfile.TemporaryDirectory() as upload_dir:
+        files.UPLOAD_DIR = upload_dir
+        try:
+            print(f"Uploading {size_mb} MB")
+            measure("legacy", lambda: legacy_save(src, os.path.join(upload_dir, "legacy.bin")))
+            stored = measure("streaming", lambda: asyncio.run(streaming_save(src, size_mb * 1024 * 1024)))
+            assert stored.size == size_mb * 1024 * 1024
+        finally:
+            os.remove(src)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Chat persistence throughput benchmark (messages/sec for one worker).
+
+"before" replays the old endpoint path: add + blocking commit per message on
+the event loop, then deliver. "after" delivers first and hands the row to the
+write-behind MessageWriter. Both run against a fresh SQLite file.
+
+Usage: python -m benchmarks.ws_throughput [messages]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import models
+from app.chat_writer import MessageWriter
+
+class FakeSocket:
+    def __init__(self):
+        self.received = 0
+
+    async def send_text(self, message: str):
+        self.received += 1
+
+def fresh_session_factory(directory: str, name: str):
+    engine = create_engine(f"sqlite:///{os.path.join(directory, name)}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async def before(n: int, Session):
+    db = Session()
+    sock = FakeSocket()
+    for i in range(n):
+        msg = models.Message(sender_id=1, receiver_id=2, content=f"message {i}")
+        db.add(msg)
+        db.commit()
+        await sock.send_text(json.dumps({"sender_id": 1, "content": msg.content, "timestamp": msg.created_at.isoformat()}))
+    db.close()
+
+async def after(n: int, Session):
+    writer = MessageWriter(session_factory=Session)
+    sock = FakeSocket()
+    for i in range(n):
+        created_at = datetime.utcnow()
+        content = f"message {i}"
+        await sock.send_text(json.dumps({"sender_id": 1, "content": content, "timestamp": created_at.isoformat()}))
+        await writer.enqueue(1, content, receiver_id=2, created_at=created_at)
+    await writer.stop()
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, fn in (("before", before), ("after", after)):
+            Session = fresh_session_factory(tmp, f"{label}.db")
+            started = time.perf_counter()
+            asyncio.run(fn(n, Session))
+            elapsed = time.perf_counter() - started
+            db = Session()
+            stored = db.query(models.Message).count()
+            db.close()
+            print(f"{label:<7} {n / elapsed:10.0f} msg/s  ({stored} persisted in {elapsed:.2f}s)")
+
+if __name__ == "__main__":
+    main()
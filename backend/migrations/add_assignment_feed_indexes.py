@@ -0,0 +1,34 @@
+"""
+Migration script to add the indexes behind the student assignment feed
+Run this script to update the database schema
+"""
+
+from sqlalchemy import create_engine, text
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./dev.db")
+engine = create_engine(DATABASE_URL)
+
+INDEXES = {
+    "ix_assignments_student_due": "CREATE INDEX IF NOT EXISTS ix_assignments_student_due ON assignments (student_id, due_date, id)",
+    "ix_submissions_student_assignment": "CREATE INDEX IF NOT EXISTS ix_submissions_student_assignment ON submissions (student_id, assignment_id, id)",
+}
+
+def run_migration():
+    with engine.connect() as conn:
+        for name, ddl in INDEXES.items():
+            try:
+                print(f"Creating {name}...")
+                conn.execute(text(ddl))
+                conn.commit()
+                print(f"✓ Created {name}")
+            except Exception as e:
+                print(f"Could not create {name}: {e}")
+
+        print("\n✅ Migration completed!")
+
+if __name__ == "__main__":
+    run_migration()
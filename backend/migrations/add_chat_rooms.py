@@ -0,0 +1,47 @@
+"""
+Migration script to add the room column to messages and the
+room_membership_events audit table
+Run this script to update the database schema
+"""
+
+from sqlalchemy import create_engine, text
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./dev.db")
+engine = create_engine(DATABASE_URL)
+
+def run_migration():
+    with engine.connect() as conn:
+        try:
+            print("Adding room column to messages table...")
+            conn.execute(text("ALTER TABLE messages ADD COLUMN room VARCHAR"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_room ON messages (room)"))
+            conn.commit()
+            print("✓ Added room column")
+        except Exception as e:
+            print(f"room column might already exist: {e}")
+
+        try:
+            print("Creating room_membership_events table...")
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS room_membership_events (
+                    id INTEGER PRIMARY KEY,
+                    room VARCHAR NOT NULL,
+                    user_id INTEGER NOT NULL REFERENCES users(id),
+                    action VARCHAR NOT NULL,
+                    created_at TIMESTAMP
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_room_membership_events_room ON room_membership_events (room)"))
+            conn.commit()
+            print("✓ Created room_membership_events table")
+        except Exception as e:
+            print(f"Could not create room_membership_events: {e}")
+
+        print("\n✅ Migration completed!")
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,76 @@
+"""
+Migration script to add messages.conversation_key (with its history index),
+backfill it for existing messages, and rebuild conversation_summaries
+Run this script from the backend directory to update the database schema
+"""
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+import os
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./dev.db")
+engine = create_engine(DATABASE_URL)
+
+def run_migration():
+    with engine.connect() as conn:
+        try:
+            print("Adding conversation_key column to messages table...")
+            conn.execute(text("ALTER TABLE messages ADD COLUMN conversation_key VARCHAR"))
+            conn.commit()
+            print("✓ Added conversation_key column")
+        except Exception as e:
+            print(f"conversation_key column might already exist: {e}")
+
+        print("Backfilling conversation keys...")
+        conn.execute(text("""
+            UPDATE messages SET conversation_key = 'room:' || room
+            WHERE conversation_key IS NULL AND room IS NOT NULL
+        """))
+        conn.execute(text("""
+            UPDATE messages SET conversation_key = 'dm:' ||
+                CAST(CASE WHEN sender_id < receiver_id THEN sender_id ELSE receiver_id END AS VARCHAR) || ':' ||
+                CAST(CASE WHEN sender_id < receiver_id THEN receiver_id ELSE sender_id END AS VARCHAR)
+            WHERE conversation_key IS NULL AND receiver_id IS NOT NULL
+        """))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_messages_conversation_created ON messages (conversation_key, created_at, id)"
+        ))
+        conn.commit()
+        print("✓ Backfilled and indexed conversation keys")
+
+    from app import models, crud
+    models.Base.metadata.create_all(bind=engine, tables=[models.ConversationSummary.__table__])
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    try:
+        print("Rebuilding conversation_summaries...")
+        db.query(models.ConversationSummary).delete()
+        M = models.Message
+        batch = []
+        rows = db.query(M.sender_id, M.receiver_id, M.room, M.conversation_key, M.content, M.created_at).filter(
+            M.conversation_key.isnot(None)
+        ).order_by(M.created_at, M.id)
+        for row in rows.yield_per(1000):
+            batch.append(dict(row._mapping))
+            if len(batch) == 1000:
+                crud.apply_conversation_summaries(db, batch)
+                db.flush()
+                batch = []
+        if batch:
+            crud.apply_conversation_summaries(db, batch)
+        # History predating the inbox shouldn't show up as unread
+        db.query(models.ConversationSummary).update({models.ConversationSummary.unread_count: 0})
+        db.commit()
+        print("✓ Rebuilt conversation_summaries")
+    finally:
+        db.close()
+
+    print("\n✅ Migration completed!")
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,28 @@
+"""
+Migration script to add the study_documents and document_chunks tables used
+by /documents and chat retrieval (chunk vectors live in DOC_INDEX_DIR files)
+Run this script from the backend directory to update the database schema
+"""
+
+from sqlalchemy import create_engine
+import os
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./dev.db")
+engine = create_engine(DATABASE_URL)
+
+def run_migration():
+    from app import models
+    models.Base.metadata.create_all(
+        bind=engine, tables=[models.StudyDocument.__table__, models.DocumentChunk.__table__]
+    )
+    print("✓ Created study_documents and document_chunks tables")
+
+    print("\n✅ Migration completed!")
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,49 @@
+"""
+Migration script to add messages.seq (with its resume index) and the
+chat_cursors table used for WebSocket reconnect replay
+Run this script from the backend directory to update the database schema
+"""
+
+from sqlalchemy import create_engine, text
+import os
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./dev.db")
+engine = create_engine(DATABASE_URL)
+
+def run_migration():
+    with engine.connect() as conn:
+        try:
+            print("Adding seq column to messages table...")
+            conn.execute(text("ALTER TABLE messages ADD COLUMN seq BIGINT"))
+            conn.commit()
+            print("✓ Added seq column")
+        except Exception as e:
+            print(f"seq column might already exist: {e}")
+
+        # Existing messages keep a NULL seq: they predate any acknowledged cursor
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_messages_conversation_seq ON messages (conversation_key, seq)"
+        ))
+        conn.commit()
+        print("✓ Indexed messages by conversation and seq")
+
+        try:
+            conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ux_messages_seq ON messages (seq)"))
+            conn.commit()
+            print("✓ Made seq unique")
+        except Exception as e:
+            print(f"Could not make seq unique (duplicate values already stored?): {e}")
+
+    from app import models
+    models.Base.metadata.create_all(bind=engine, tables=[models.ChatCursor.__table__])
+    print("✓ Created chat_cursors table")
+
+    print("\n✅ Migration completed!")
+
+if __name__ == "__main__":
+    run_migration()
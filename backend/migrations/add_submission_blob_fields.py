@@ -0,0 +1,37 @@
+"""
+Migration script to add file_name to submissions and index file_sha256
+for the content-addressed upload store
+Run this script to update the database schema
+"""
+
+from sqlalchemy import create_engine, text
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./dev.db")
+engine = create_engine(DATABASE_URL)
+
+def run_migration():
+    with engine.connect() as conn:
+        try:
+            print("Adding file_name column to submissions table...")
+            conn.execute(text("ALTER TABLE submissions ADD COLUMN file_name TEXT"))
+            conn.commit()
+            print("✓ Added file_name column")
+        except Exception as e:
+            print(f"file_name column might already exist: {e}")
+
+        try:
+            print("Indexing submissions.file_sha256...")
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_submissions_file_sha256 ON submissions (file_sha256)"))
+            conn.commit()
+            print("✓ Created ix_submissions_file_sha256")
+        except Exception as e:
+            print(f"Could not create index: {e}")
+
+        print("\n✅ Migration completed!")
+
+if __name__ == "__main__":
+    run_migration()
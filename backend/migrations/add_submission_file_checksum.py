@@ -0,0 +1,36 @@
+"""
+Migration script to add file_sha256 and file_size columns to the submissions table
+Run this script to update the database schema
+"""
+
+from sqlalchemy import create_engine, text
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./dev.db")
+engine = create_engine(DATABASE_URL)
+
+def run_migration():
+    with engine.connect() as conn:
+        try:
+            print("Adding file_sha256 column to submissions table...")
+            conn.execute(text("ALTER TABLE submissions ADD COLUMN file_sha256 VARCHAR(64)"))
+            conn.commit()
+            print("✓ Added file_sha256 column")
+        except Exception as e:
+            print(f"file_sha256 column might already exist: {e}")
+
+        try:
+            print("Adding file_size column to submissions table...")
+            conn.execute(text("ALTER TABLE submissions ADD COLUMN file_size INTEGER"))
+            conn.commit()
+            print("✓ Added file_size column")
+        except Exception as e:
+            print(f"file_size column might already exist: {e}")
+
+        print("\n✅ Migration completed!")
+
+if __name__ == "__main__":
+    run_migration()
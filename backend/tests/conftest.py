@@ -0,0 +1,140 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.main import app
+from app import database, deps, models
+from app.routers.auth import create_access_token
+from app.chat_writer import message_writer
+from app.routers import ws
+
+
+@pytest.fixture
+def db_session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    TestingSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = TestingSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[deps.get_db] = override_get_db
+    app.dependency_overrides[database.get_db] = override_get_db
+    message_writer.session_factory = TestingSession
+    ws.session_factory = TestingSession
+    db = TestingSession()
+    yield db
+    db.close()
+    app.dependency_overrides.clear()
+    message_writer.session_factory = database.SessionLocal
+    ws.session_factory = database.SessionLocal
+    engine.dispose()
+
+
+@pytest.fixture
+def client(db_session):
+    return TestClient(app)
+
+
+@pytest.fixture
+def make_user(db_session):
+    def _make_user(email, role="student", full_name=None):
+        user = models.User(email=email, hashed_password="!", full_name=full_name, role=role)
+        db_session.add(user)
+        db_session.commit()
+        token = create_access_token({"sub": str(user.id), "role": user.role})
+        return user, {"Authorization": f"Bearer {token}"}
+    return _make_user
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    from app import files
+    path = tmp_path / "uploads"
+    path.mkdir()
+    monkeypatch.setattr(files, "UPLOAD_DIR", str(path))
+    return path
+
+
+@pytest.fixture
+def ai_cache(tmp_path, monkeypatch):
+    from app.ai_cache import ResponseCache
+    from app.routers import ai
+    cache = ResponseCache(path=str(tmp_path / "ai_cache.db"))
+    monkeypatch.setattr(ai, "response_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def doc_index(tmp_path, monkeypatch):
+    from app import doc_store
+    monkeypatch.setattr(doc_store, "DOC_INDEX_DIR", str(tmp_path / "doc_index"))
+    monkeypatch.setattr(doc_store, "_indexes", {})
+    return tmp_path / "doc_index"
+
+
+class FakeOpenAI:
+    """Stands in for the OpenAI client: replies with `reply` (after any queued `replies`) and counts calls"""
+
+    def __init__(self, reply="A short summary."):
+        self.reply = reply
+        self.replies = []
+        self.calls = []
+        self.delay = 0
+        self.error = None
+        self.in_flight = 0
+        self.peak = 0
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        from types import SimpleNamespace
+        self.calls.append(kwargs)
+        if self.delay:
+            import asyncio
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            await asyncio.sleep(self.delay)
+            self.in_flight -= 1
+        if self.error is not None:
+            raise self.error
+        if kwargs.get("stream"):
+            return FakeStream(self.reply.split(" "))
+        message = SimpleNamespace(content=self.replies.pop(0) if self.replies else self.reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakeStream:
+    """Async iterator of chat.completion.chunk-shaped objects, one per word"""
+
+    def __init__(self, words):
+        self.words = words
+        self.yielded = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        from types import SimpleNamespace
+        if self.yielded == len(self.words):
+            raise StopAsyncIteration
+        word = self.words[self.yielded]
+        self.yielded += 1
+        content = word if self.yielded == 1 else " " + word
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    from app.routers import ai
+    fake = FakeOpenAI()
+    monkeypatch.setattr(ai, "get_openai_client", lambda: fake)
+    return fake
@@ -0,0 +1,286 @@
+import json
+import time
+from app.ai_cache import ResponseCache
+
+
+def test_repeated_requests_are_served_from_cache(client, ai_cache, fake_openai):
+    first = client.post("/ai/summarize", json={"text": "Photosynthesis   turns light\r\ninto sugar."})
+    assert first.json() == {"summary": "A short summary."}
+    assert first.headers["X-AI-Cache"] == "miss"
+
+    # Whitespace-only differences hit the same entry
+    second = client.post("/ai/summarize", json={"text": "Photosynthesis turns light\ninto sugar. "})
+    assert second.json() == first.json() and second.headers["X-AI-Cache"] == "hit"
+    assert len(fake_openai.calls) == 1
+
+    bypass = client.post("/ai/summarize", json={"text": "Photosynthesis turns light\ninto sugar."},
+                         headers={"X-AI-Cache": "bypass"})
+    assert bypass.headers["X-AI-Cache"] == "bypass" and len(fake_openai.calls) == 2
+
+    # Same text, different endpoint: separate entry
+    fake_openai.reply = '```json\n[{"q": "What is photosynthesis?", "a": "Light to sugar"}]\n```'
+    cards = client.post("/ai/flashcards", json={"text": "Photosynthesis turns light\ninto sugar."})
+    assert cards.json() == {"cards": [{"q": "What is photosynthesis?", "a": "Light to sugar"}]}
+    assert len(fake_openai.calls) == 3
+
+    stats = ai_cache.stats()
+    assert stats["memory_hits"] == 1 and stats["misses"] == 2 and stats["bypassed"] == 1
+    assert stats["hit_ratio"] == round(1 / 3, 4)
+
+
+def test_fallback_results_are_not_cached(client, ai_cache, fake_openai):
+    fake_openai.reply = "not json at all"
+    body = client.post("/ai/quiz", json={"text": "Cells divide.\nDNA replicates."}).json()
+    assert body == {"questions": []}  # too little text for four distinct options
+    assert ai_cache.stats()["stores"] == 0
+
+
+def test_disk_tier_ttl_and_size_eviction(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(path=path, ttl=60, max_bytes=1000, memory_entries=2)
+    cache.set("a", {"summary": "x" * 300}, cost=1.5)
+
+    # A fresh process only has the SQLite tier
+    restarted = ResponseCache(path=path, ttl=60, max_bytes=1000)
+    assert restarted.get("a") == {"summary": "x" * 300}
+    assert restarted.disk_hits == 1 and restarted.latency_saved == 1.5
+
+    for key in ("b", "c", "d"):
+        cache.set(key, {"summary": key * 300})
+    assert cache.get("a") is None  # least recently used, evicted to stay under max_bytes
+    assert cache.get("d") == {"summary": "d" * 300}
+    assert cache.evictions >= 1
+
+    expired = ResponseCache(path=str(tmp_path / "ttl.db"), ttl=0)
+    expired.set("k", {"v": 1})
+    time.sleep(0.01)
+    assert expired.get("k") is None
+
+
+def test_stores_keep_a_running_total_instead_of_rescanning(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.db"), ttl=60, max_bytes=1000, evict_every=20)
+    scans = []
+    cache._db().set_trace_callback(lambda sql: scans.append(sql) if "SUM(size)" in sql else None)
+
+    for i in range(40):
+        cache.set(f"k{i}", {"v": i})
+    # The first store counts the table; after that, one full pass per 20 stores
+    assert len(scans) == 2
+
+    # Crossing the budget evicts straight away, without waiting for the next pass
+    cache.set("big", {"v": "x" * 700})
+    assert len(scans) == 3 and cache.evictions >= 1
+    assert cache.get("big") is not None and cache._bytes <= 900
+
+
+def test_openai_client_is_shared_per_worker(monkeypatch):
+    import asyncio
+    from app import ai_client
+    monkeypatch.setattr(ai_client, "_client", None)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("OPENAI_BASE_URL", "http://127.0.0.1:9/v1")
+
+    client = ai_client.get_openai_client()
+    assert ai_client.get_openai_client() is client
+    assert str(client.base_url) == "http://127.0.0.1:9/v1/"
+    asyncio.run(ai_client.close_openai_client())
+    assert ai_client._client is None
+
+
+def test_chat_streams_tokens_as_server_sent_events(client, make_user, fake_openai):
+    from app.ai_metrics import ai_metrics
+    ai_metrics.reset()
+    _, auth = make_user("student@example.com")
+    fake_openai.reply = "Mitochondria make ATP."
+
+    with client.stream("POST", "/ai/chat", json={"message": "What do mitochondria do?", "stream": True},
+                       headers=auth) as res:
+        assert res.headers["content-type"].startswith("text/event-stream")
+        events = [e for e in res.read().decode().split("\n\n") if e]
+
+    deltas = [json.loads(e[len("data: "):])["delta"] for e in events[:-1]]
+    assert "".join(deltas) == "Mitochondria make ATP."
+    assert events[-1] == 'event: done\ndata: {"response": "Mitochondria make ATP."}'
+    assert fake_openai.calls[0]["stream"] is True
+
+    snapshot = ai_metrics.snapshot()
+    assert snapshot["counters"]["chat.stream.completed"] == 1
+    assert snapshot["latency_seconds"]["chat.time_to_first_token"]["count"] == 1
+
+
+def test_abandoned_stream_closes_upstream():
+    import asyncio
+    from app.ai_metrics import ai_metrics
+    from app.routers.ai import _stream_chat
+    from tests.conftest import FakeStream
+    ai_metrics.reset()
+
+    async def scenario():
+        upstream = FakeStream(["one", "two", "three"])
+        events = _stream_chat(upstream, time.perf_counter())
+        assert "one" in await events.__anext__()
+        await events.aclose()  # what Starlette does when the client disconnects
+        return upstream
+
+    upstream = asyncio.run(scenario())
+    assert upstream.closed and upstream.yielded == 1
+    assert ai_metrics.counters["chat.stream.cancelled"] == 1
+
+
+def test_single_flight_shares_results_and_errors():
+    import asyncio
+    from app.singleflight import SingleFlight
+
+    async def scenario():
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            if len(calls) == 2:
+                raise RuntimeError("upstream down")
+            return {"summary": "shared"}
+
+        results = await asyncio.gather(*(flights.do("k", work) for _ in range(5)))
+        assert results == [{"summary": "shared"}] * 5 and len(calls) == 1
+
+        failures = await asyncio.gather(*(flights.do("k", work) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(f, RuntimeError) for f in failures) and len(calls) == 2
+
+        # The failure isn't remembered: the next call runs again
+        assert await flights.do("k", work) == {"summary": "shared"}
+        assert flights.stats() == {"executed": 3, "coalesced": 6, "failed": 1, "in_flight": 0}
+
+        # Abandoned by every caller: the shared call is cancelled too
+        waiters = [asyncio.ensure_future(flights.do("slow", lambda: asyncio.sleep(10))) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert flights.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_identical_requests_share_one_model_call(ai_cache, fake_openai, monkeypatch):
+    import asyncio
+    import httpx
+    from app.main import app
+    from app.routers import ai
+    from app.singleflight import SingleFlight
+    monkeypatch.setattr(ai, "inflight", SingleFlight())
+    fake_openai.delay = 0.05
+
+    async def scenario():
+        async with httpx.AsyncClient(app=app, base_url="http://test") as http:
+            return await asyncio.gather(*(
+                http.post("/ai/summarize", json={"text": "Shared reading for the whole class."})
+                for _ in range(10)
+            ))
+
+    responses = asyncio.run(scenario())
+    assert {r.json()["summary"] for r in responses} == {"A short summary."}
+    assert len(fake_openai.calls) == 1
+    assert ai.inflight.stats()["coalesced"] == 9
+    assert ai_cache.stats()["stores"] == 1
+
+
+PACK_TEXT = "Mitochondria are organelles that produce ATP. Ribosomes build proteins. The nucleus stores DNA."
+PACK_REPLY = {
+    "summary": "Organelles each have a job.",
+    "flashcards": [{"q": "What makes ATP?", "a": "Mitochondria"}],
+    "quiz": [{"question": "What stores DNA?", "options": ["Nucleus", "Ribosome", "Membrane", "Vacuole"], "correct_answer": 0}],
+    "concept_map": {"nodes": [{"id": 0, "label": "Cell"}, {"id": 1, "label": "Mitochondria"}],
+                    "edges": [{"from": 0, "to": 1, "label": "contains"}]},
+}
+
+
+def test_study_pack_makes_every_section_in_one_call(client, ai_cache, fake_openai):
+    fake_openai.reply = json.dumps(PACK_REPLY)
+    res = client.post("/ai/study-pack", json={"text": PACK_TEXT})
+    body = res.json()
+    assert res.headers["X-AI-Cache"] == "miss" and len(fake_openai.calls) == 1
+    assert fake_openai.calls[0]["response_format"] == {"type": "json_object"}
+    assert body["summary"] == "Organelles each have a job."
+    assert body["concept_map"]["nodes"][0] == {"id": 0, "label": "Cell", "type": "concept"}
+    assert body["concept_map"]["edges"] == [{"from": 0, "to": 1, "label": "contains"}]
+    assert body["sources"] == dict.fromkeys(["summary", "flashcards", "quiz", "concept_map"], "model")
+
+    # Sections are cached under the single endpoints' keys, both ways
+    quiz = client.post("/ai/quiz", json={"text": PACK_TEXT})
+    assert quiz.headers["X-AI-Cache"] == "hit" and quiz.json()["questions"] == body["quiz"]
+    again = client.post("/ai/study-pack", json={"text": PACK_TEXT, "sections": ["quiz", "summary"]})
+    assert again.headers["X-AI-Cache"] == "hit" and len(fake_openai.calls) == 1
+    assert set(again.json()) == {"summary", "quiz", "sources"}
+
+
+def test_study_pack_validates_sections_independently(client, ai_cache, fake_openai):
+    fake_openai.reply = "A cached summary."
+    client.post("/ai/summarize", json={"text": PACK_TEXT})
+
+    bad_quiz = [{"question": "?", "options": ["only one"], "correct_answer": 3}]
+    fake_openai.reply = json.dumps({**PACK_REPLY, "quiz": bad_quiz})
+    body = client.post("/ai/study-pack", json={"text": PACK_TEXT, "sections": ["summary", "flashcards", "quiz"]}).json()
+    # Only the uncached sections were asked for
+    prompt = fake_openai.calls[-1]["messages"][0]["content"]
+    assert '"flashcards"' in prompt and '"quiz"' in prompt and '"summary"' not in prompt
+    assert body["summary"] == "A cached summary."
+    assert body["flashcards"] == PACK_REPLY["flashcards"]
+    assert body["sources"] == {"summary": "cache", "flashcards": "model", "quiz": "local"}
+    assert isinstance(body["quiz"], list)
+
+    # The invalid section isn't cached, the valid one is
+    fake_openai.reply = json.dumps(PACK_REPLY)
+    body = client.post("/ai/study-pack", json={"text": PACK_TEXT, "sections": ["flashcards", "quiz"]}).json()
+    assert body["sources"] == {"flashcards": "cache", "quiz": "model"}
+
+    assert client.post("/ai/study-pack", json={"text": PACK_TEXT, "sections": ["essay"]}).status_code == 422
+
+
+def test_extract_json_takes_the_first_complete_value():
+    from app.ai_output import extract_json
+    assert extract_json('```json\n{"cards": []}\n```') == {"cards": []}
+    # A greedy [.*] match would glue both arrays together
+    assert extract_json('Cards: [{"q": "a", "a": "b"}] and also [1]') == [{"q": "a", "a": "b"}]
+    assert extract_json('Note [see below]: {"nodes": [], "edges": []}') == {"nodes": [], "edges": []}
+
+
+def test_invalid_output_gets_one_repair_and_is_counted(client, make_user, ai_cache, fake_openai):
+    from app.ai_metrics import ai_metrics
+    ai_metrics.reset()
+    fake_openai.replies = ['{"cards": [{"q": "What is DNA?"}]}']
+    fake_openai.reply = '{"cards": [{"q": "What is DNA?", "a": "Genetic material"}]}'
+    body = client.post("/ai/flashcards", json={"text": "DNA is genetic material."}).json()
+    assert body == {"cards": [{"q": "What is DNA?", "a": "Genetic material"}]}
+    assert len(fake_openai.calls) == 2
+    assert fake_openai.calls[0]["response_format"] == {"type": "json_object"}
+    repair = fake_openai.calls[1]
+    assert repair["temperature"] == 0 and "What is DNA?" in repair["messages"][1]["content"]
+
+    # Still invalid after the repair: local fallback, nothing cached, no third call
+    fake_openai.reply = "Sorry, I can't help with that."
+    client.post("/ai/quiz", json={"text": "Cells divide.\nDNA replicates."})
+    assert len(fake_openai.calls) == 4
+    assert ai_metrics.counters["quiz.local.failed"] == 1
+    assert ai_cache.stats()["stores"] == 1
+
+    _, auth = make_user("student@example.com")
+    stats = client.get("/ai/metrics", headers=auth).json()["structured_output"]
+    assert stats["flashcards"]["repaired"] == 1 and stats["flashcards"]["parse_failure_rate"] == 1.0
+    assert stats["flashcards"]["unusable_rate"] == 0.0
+    assert stats["quiz"]["invalid"] == 1 and stats["quiz"]["unusable_rate"] == 1.0
+    assert stats["quiz"]["wasted_tokens"] > stats["flashcards"]["wasted_tokens"] > 0
+
+
+def test_topic_quiz_answer_index_is_validated(client, make_user, ai_cache, fake_openai):
+    from app.ai_metrics import ai_metrics
+    ai_metrics.reset()
+    _, auth = make_user("student@example.com")
+    good = {"question": "2 + 2?", "options": ["3", "4"], "correctAnswer": 1}
+    fake_openai.replies = [json.dumps({"questions": [{**good, "correctAnswer": 4}]})]
+    fake_openai.reply = json.dumps({"questions": [good]})
+    body = client.post("/ai/generate-quiz", json={"topic": "arithmetic", "num_questions": 1}, headers=auth).json()
+    assert body["questions"] == [good] and len(fake_openai.calls) == 2
+    assert ai_metrics.counters["generate-quiz.output.repaired"] == 1
@@ -0,0 +1,66 @@
+from app import ai_pipeline
+from app.ai_pipeline import chunk_text, estimate_tokens, split_sections
+
+
+def _lecture(sections=6, paragraphs=5, edit=None):
+    parts = []
+    for s in range(sections):
+        parts.append(f"# Topic {s}")
+        for p in range(paragraphs):
+            text = f"Paragraph {p} of topic {s} explains one idea in detail. " * 6
+            if (s, p) == edit:
+                text = "Edited: " + text
+            parts.append(text.strip())
+    return "\n\n".join(parts)
+
+
+def test_chunks_follow_headings_and_stay_under_budget():
+    text = _lecture()
+    assert len(split_sections(text)) == 6
+    chunks = chunk_text(text, max_tokens=200)
+    assert all(estimate_tokens(c) <= 200 for c in chunks)
+    assert all(c.count("# Topic") <= 1 for c in chunks)
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
+
+    # A paragraph edit only changes chunks of its own section
+    edited = chunk_text(_lecture(edit=(3, 2)), max_tokens=200)
+    changed = set(edited) - set(chunks)
+    assert changed and all("topic 3" in c for c in changed)
+    assert len(changed) < len(chunks) // 2
+
+
+def test_long_summaries_are_map_reduced_with_per_chunk_cache(client, ai_cache, fake_openai, monkeypatch):
+    from app.routers import ai
+    monkeypatch.setattr(ai, "AI_SINGLE_PASS_TOKENS", 300)
+    monkeypatch.setattr(ai_pipeline, "AI_SINGLE_PASS_TOKENS", 300)
+    monkeypatch.setattr(ai_pipeline, "AI_CHUNK_TOKENS", 200)
+    monkeypatch.setattr(ai_pipeline, "AI_MAP_CONCURRENCY", 2)
+    fake_openai.delay = 0.01
+
+    text = _lecture()
+    chunks = chunk_text(text)
+    body = client.post("/ai/summarize", json={"text": text}).json()
+    assert body == {"summary": "A short summary."}
+    # One call per chunk, then the final pass (the partials already fit one prompt)
+    assert len(fake_openai.calls) == len(chunks) + 1
+    assert fake_openai.peak == 2
+    assert all(estimate_tokens(call["messages"][1]["content"]) <= 200 for call in fake_openai.calls[:-1])
+
+    fake_openai.calls.clear()
+    client.post("/ai/summarize", json={"text": _lecture(edit=(3, 2))})
+    changed = len(set(chunk_text(_lecture(edit=(3, 2)))) - set(chunks))
+    assert len(fake_openai.calls) == changed + 1
+
+
+def test_reduce_merges_level_by_level_until_it_fits():
+    import asyncio
+    calls = []
+
+    async def combine(text):
+        calls.append(text)
+        return "m" * 40
+
+    parts = ["p" * 400] * 8  # ~100 tokens each
+    result = asyncio.run(ai_pipeline.reduce_hierarchically(parts, combine, max_tokens=250))
+    assert estimate_tokens(result) <= 250
+    assert len(calls) == 4  # one level: four pairs
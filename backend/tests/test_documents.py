@@ -0,0 +1,133 @@
+import numpy as np
+
+from app import doc_store
+
+BIOLOGY = """Mitochondria are organelles that produce ATP through cellular respiration.
+
+The electron transport chain in the inner membrane of mitochondria pumps protons."""
+
+HISTORY = """The French Revolution began in 1789 with the storming of the Bastille.
+
+The Estates-General was called because the monarchy was bankrupt."""
+
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    embedder = doc_store.HashingEmbedder(dim=64)
+    vectors = embedder.embed_sync(["cell membrane", "cell membrane", "French Revolution", ""])
+    assert vectors.shape == (4, 64) and vectors.dtype == np.float32
+    assert np.allclose(vectors[0], vectors[1])
+    assert np.isclose(np.linalg.norm(vectors[0]), 1.0) and not vectors[3].any()
+    assert vectors[0] @ vectors[2] < 0.5
+
+
+def test_documents_are_indexed_incrementally_and_searched(client, make_user, doc_index, monkeypatch):
+    _, auth = make_user("notes@example.com")
+    embedded = []
+    embedder = doc_store.get_embedder()
+    original = embedder.embed_sync
+    monkeypatch.setattr(embedder, "embed_sync", lambda texts: embedded.append(len(texts)) or original(texts))
+
+    bio = client.post("/documents", json={"title": "Cells", "content": BIOLOGY}, headers=auth).json()
+    assert bio["source"] == "note" and bio["token_count"] > 0
+    client.post("/documents", json={"title": "Revolution", "content": HISTORY}, headers=auth)
+    # Each document embeds only its own chunks; the same text again is a no-op
+    assert embedded == [1, 1]
+    again = client.post("/documents", json={"title": "Cells copy", "content": BIOLOGY}, headers=auth).json()
+    assert again["id"] == bio["id"] and embedded == [1, 1]
+    assert [d["title"] for d in client.get("/documents", headers=auth).json()] == ["Revolution", "Cells"]
+
+    hits = client.get("/documents/search", params={"q": "what do mitochondria produce?"}, headers=auth).json()
+    assert hits[0]["title"] == "Cells" and hits[0]["score"] > hits[-1]["score"]
+
+    # Another user sees nothing
+    _, other = make_user("other@example.com")
+    assert client.get("/documents/search", params={"q": "mitochondria"}, headers=other).json() == []
+
+    assert client.delete(f"/documents/{bio['id']}", headers=auth).json() == {"ok": True}
+    hits = client.get("/documents/search", params={"q": "mitochondria"}, headers=auth).json()
+    assert [h["title"] for h in hits] == ["Revolution"]
+    assert client.delete(f"/documents/{bio['id']}", headers=auth).status_code == 404
+
+
+def test_compaction_drops_deleted_rows(tmp_path):
+    index = doc_store.VectorIndex(str(tmp_path), "hashing-4", 4)
+    vectors = np.eye(4, dtype=np.float32)
+    index.append([1, 2, 3, 4], vectors)
+    index.append([4], vectors[:1])  # a racing duplicate is ignored
+    assert index.ids().tolist() == [1, 2, 3, 4]
+    index.compact(np.array([2, 4]))
+    assert index.ids().tolist() == [2, 4]
+    assert index.search(vectors[3], np.array([2, 4]), k=5) == [(4, 1.0), (2, 0.0)]
+
+
+def test_workers_appending_at_once_keep_ids_and_rows_aligned(tmp_path):
+    import threading
+    # Separate instances have separate in-process locks, like two uvicorn workers
+    workers = [doc_store.VectorIndex(str(tmp_path), "hashing-8", 8) for _ in range(2)]
+
+    def index_chunks(worker, first):
+        for i in range(first, first + 100, 2):
+            worker.append([i, i + 1], np.full((2, 8), i, dtype=np.float32))
+
+    threads = [threading.Thread(target=index_chunks, args=(w, n * 1000)) for n, w in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reader = doc_store.VectorIndex(str(tmp_path), "hashing-8", 8)
+    ids, vectors = reader._load()
+    assert len(ids) == 200 and vectors.shape == (200, 8)
+    assert np.array_equal(vectors[:, 0], ids - ids % 2)
+
+
+def test_misaligned_index_is_rebuilt_on_next_sync(client, make_user, doc_index):
+    _, auth = make_user("notes@example.com")
+    client.post("/documents", json={"title": "Cells", "content": BIOLOGY}, headers=auth)
+    index = next(iter(doc_store._indexes.values()))
+    # Ids whose vector rows were cut off, as an unlocked concurrent append could leave them
+    with open(index.ids_path, "ab") as out:
+        out.write(np.array([98, 99], dtype=np.int64).tobytes())
+
+    res = client.get("/documents/search", params={"q": "mitochondria"}, headers=auth)
+    assert res.status_code == 200 and res.json()[0]["title"] == "Cells"
+    ids, vectors = index._load()
+    assert len(ids) == len(vectors) == 1
+
+
+def test_chat_injects_relevant_excerpts_within_budget(client, make_user, doc_index, fake_openai, monkeypatch):
+    _, auth = make_user("chat@example.com")
+    client.post("/documents", json={"title": "Cells", "content": BIOLOGY}, headers=auth)
+    client.post("/documents", json={"title": "Revolution", "content": HISTORY}, headers=auth)
+    fake_openai.reply = "They produce ATP [1]."
+
+    body = client.post("/ai/chat", json={"message": "What do mitochondria produce?"}, headers=auth).json()
+    assert body["response"] == "They produce ATP [1]."
+    assert [s["title"] for s in body["sources"]] == ["Cells"]
+    prompt = fake_openai.calls[-1]["messages"]
+    assert "cellular respiration" in prompt[1]["content"] and "Bastille" not in prompt[1]["content"]
+
+    monkeypatch.setattr(doc_store, "DOC_CONTEXT_TOKENS", 5)
+    body = client.post("/ai/chat", json={"message": "What do mitochondria produce?"}, headers=auth).json()
+    assert body["sources"] == [] and len(fake_openai.calls[-1]["messages"]) == 2
+
+    body = client.post("/ai/chat", json={"message": "mitochondria", "use_documents": False}, headers=auth).json()
+    assert body["sources"] == []
+
+
+def test_pdf_becomes_a_searchable_document(client, make_user, doc_index, tmp_path, monkeypatch):
+    from app import pdf_extract
+    from app.ai_cache import ResponseCache
+    from benchmarks.pdf_extract import build_pdf
+    monkeypatch.setattr(pdf_extract, "text_cache", ResponseCache(path=str(tmp_path / "pdf.db")))
+    monkeypatch.setattr(pdf_extract, "PDF_WORKERS", 1)
+    _, auth = make_user("pdfdoc@example.com")
+    try:
+        response = client.post("/documents/pdf", headers=auth,
+                               files={"file": ("bio.pdf", build_pdf(3, lines_per_page=2), "application/pdf")})
+    finally:
+        pdf_extract.shutdown_pool()
+    assert response.status_code == 200
+    assert response.json()["title"] == "bio.pdf" and response.json()["source"] == "pdf"
+    hits = client.get("/documents/search", params={"q": "powerhouse of the cell"}, headers=auth).json()
+    assert hits and hits[0]["title"] == "bio.pdf"
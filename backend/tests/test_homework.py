@@ -0,0 +1,380 @@
+import hashlib
+import os
+import pytest
+from app import models, files
+from app.storage import get_storage
+
+
+def _assignment(db_session, tutor):
+    a = models.Assignment(tutor_id=tutor.id, title="HW 1")
+    db_session.add(a)
+    db_session.commit()
+    return a
+
+
+def test_submit_preserves_binary_and_records_checksum(client, db_session, make_user, upload_dir):
+    tutor, _ = make_user("tutor@example.com", role="tutor")
+    student, headers = make_user("student@example.com")
+    a = _assignment(db_session, tutor)
+    payload = b"%PDF-1.4\r\n\x00\xff\r\nbinary\rdata" + os.urandom(3 * files.CHUNK_SIZE // 2)
+
+    r = client.post("/homework/submit", data={"assignment_id": a.id},
+                    files={"file": ("work.pdf", payload, "application/pdf")}, headers=headers)
+    assert r.status_code == 200, r.text
+
+    sub = db_session.get(models.Submission, r.json()["submission_id"])
+    assert sub.file_size == len(payload)
+    assert sub.file_sha256 == hashlib.sha256(payload).hexdigest()
+    with open(sub.file_path, "rb") as f:
+        assert f.read() == payload
+
+
+def test_submit_rejects_oversized_upload(client, db_session, make_user, upload_dir, monkeypatch):
+    monkeypatch.setattr(files, "MAX_UPLOAD_SIZE", 1024)
+    tutor, _ = make_user("tutor@example.com", role="tutor")
+    student, headers = make_user("student@example.com")
+    a = _assignment(db_session, tutor)
+
+    r = client.post("/homework/submit", data={"assignment_id": a.id},
+                    files={"file": ("big.bin", b"x" * 2048)}, headers=headers)
+    assert r.status_code == 413
+    assert list(upload_dir.iterdir()) == []
+    assert db_session.query(models.Submission).count() == 0
+
+
+def test_oversized_upload_is_refused_before_the_body_is_read(client, make_user, upload_dir, monkeypatch):
+    monkeypatch.setattr(files, "MAX_UPLOAD_SIZE", 1024)
+    monkeypatch.setattr(files, "UPLOAD_FORM_OVERHEAD", 512)
+    _, headers = make_user("student@example.com")
+    read = []
+
+    def body():
+        for _ in range(8):
+            read.append(1)
+            yield b"x" * 1024
+
+    # Declared length over the limit: answered without touching the body
+    r = client.post("/homework/submit", content=body(), headers={
+        **headers, "content-type": "multipart/form-data; boundary=b", "content-length": str(8 * 1024)})
+    assert r.status_code == 413 and read == []
+
+    # Chunked: no length up front, so it's counted as it arrives
+    r = client.post("/homework/submit", content=body(), headers={
+        **headers, "content-type": "multipart/form-data; boundary=b"})
+    assert r.status_code == 413
+
+    # ... and cut off at the limit rather than after the whole body
+    import asyncio
+    import pytest
+    from fastapi import HTTPException
+    received = []
+
+    async def receive():
+        received.append(1)
+        return {"type": "http.request", "body": b"x" * 1024, "more_body": True}
+
+    async def app(scope, receive, send):
+        while (await receive())["more_body"]:
+            pass
+
+    scope = {"type": "http", "headers": [(b"content-type", b"multipart/form-data; boundary=b")]}
+    with pytest.raises(HTTPException) as refused:
+        asyncio.run(files.UploadSizeLimitMiddleware(app)(scope, receive, None))
+    assert refused.value.status_code == 413 and len(received) == 2
+
+
+def test_identical_uploads_share_one_blob(client, db_session, make_user, upload_dir):
+    tutor, _ = make_user("tutor@example.com", role="tutor")
+    a = _assignment(db_session, tutor)
+    payload = b"same handout" * 1000
+
+    paths = []
+    for i in range(3):
+        _, headers = make_user(f"s{i}@example.com")
+        r = client.post("/homework/submit", data={"assignment_id": a.id},
+                        files={"file": (f"copy{i}.txt", payload)}, headers=headers)
+        assert r.status_code == 200, r.text
+        paths.append(db_session.get(models.Submission, r.json()["submission_id"]).file_path)
+
+    sha = hashlib.sha256(payload).hexdigest()
+    assert set(paths) == {get_storage().location(sha)}
+    assert paths[0].endswith(os.path.join(sha[:2], sha[2:4], sha))
+    assert files.blob_refcount(db_session, sha) == 3
+    assert sum(len(f) for _, _, f in os.walk(get_storage().blob_root())) == 1
+
+
+def test_garbage_collection_keeps_referenced_and_recent_blobs(db_session, make_user, upload_dir):
+    student, _ = make_user("student@example.com")
+    tutor, _ = make_user("tutor@example.com", role="tutor")
+    a = _assignment(db_session, tutor)
+
+    def write_blob(data, age):
+        sha = hashlib.sha256(data).hexdigest()
+        path = get_storage().location(sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, (os.path.getmtime(path) - age,) * 2)
+        return sha, path
+
+    kept_sha, kept = write_blob(b"referenced", age=10_000)
+    _, orphan = write_blob(b"orphan", age=10_000)
+    _, in_flight = write_blob(b"in flight", age=0)
+    db_session.add(models.Submission(assignment_id=a.id, student_id=student.id, file_path=kept, file_sha256=kept_sha))
+    db_session.commit()
+
+    result = files.collect_garbage(db_session, grace_seconds=3600)
+    assert result["removed"] == 1
+    assert os.path.exists(kept) and os.path.exists(in_flight)
+    assert not os.path.exists(orphan)
+
+
+def test_garbage_collection_keeps_blobs_touched_after_listing(db_session, upload_dir, monkeypatch):
+    data = b"old upload"
+    sha = hashlib.sha256(data).hexdigest()
+    path = get_storage().location(sha)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, (os.path.getmtime(path) - 10_000,) * 2)
+
+    # A duplicate upload lands between the listing and the deletion; its Submission isn't committed yet
+    backend = get_storage()
+    listing = backend.iter_blobs
+
+    def list_then_upload():
+        blobs = list(listing())
+        assert backend.touch(sha)
+        return iter(blobs)
+
+    monkeypatch.setattr(backend, "iter_blobs", list_then_upload)
+    result = files.collect_garbage(db_session, grace_seconds=3600)
+    assert result == {"removed": 0, "freed_bytes": 0, "kept": 1}
+    assert os.path.exists(path)
+
+
+@pytest.mark.parametrize("upload_first", [True, False])
+def test_garbage_collection_racing_a_duplicate_upload(db_session, upload_dir, monkeypatch, upload_first):
+    import asyncio
+    import io
+    from fastapi import UploadFile
+    from app import storage
+
+    data = b"old upload"
+    sha = hashlib.sha256(data).hexdigest()
+    path = get_storage().location(sha)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, (os.path.getmtime(path) - 10_000,) * 2)
+
+    # The duplicate upload runs just before or just after GC moves the blob aside
+    replace = os.replace
+    uploads = []
+
+    def racing_replace(src, dst):
+        if src == path and not uploads:
+            if not upload_first:
+                replace(src, dst)
+            uploads.append(asyncio.run(files.save_upload_file(UploadFile(io.BytesIO(data), filename="again.pdf"))))
+            if not upload_first:
+                return
+        replace(src, dst)
+
+    monkeypatch.setattr(storage.os, "replace", racing_replace)
+    result = files.collect_garbage(db_session, grace_seconds=3600)
+    monkeypatch.undo()
+
+    assert [u.deduplicated for u in uploads] == [upload_first]
+    assert result["removed"] == (0 if upload_first else 1)
+    # Either way the upload's Submission would point at a blob that is still there
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+
+def _submit(client, db_session, headers, assignment, payload, name="notes.pdf"):
+    r = client.post("/homework/submit", data={"assignment_id": assignment.id},
+                    files={"file": (name, payload)}, headers=headers)
+    assert r.status_code == 200, r.text
+    return db_session.get(models.Submission, r.json()["submission_id"])
+
+
+def test_download_checks_ownership(client, db_session, make_user, upload_dir):
+    tutor, tutor_headers = make_user("tutor@example.com", role="tutor")
+    _, other_tutor_headers = make_user("other@example.com", role="tutor")
+    student, headers = make_user("student@example.com")
+    _, other_headers = make_user("other-student@example.com")
+    sub = _submit(client, db_session, headers, _assignment(db_session, tutor), b"my work")
+
+    url = f"/homework/submissions/{sub.id}/file"
+    assert client.get(url, headers=headers).content == b"my work"
+    assert client.get(url, headers=tutor_headers).status_code == 200
+    assert client.get(url, headers=other_headers).status_code == 403
+    assert client.get(url, headers=other_tutor_headers).status_code == 403
+    assert client.get("/homework/submissions/999/file", headers=headers).status_code == 404
+
+
+def test_download_conditional_and_range_requests(client, db_session, make_user, upload_dir):
+    tutor, _ = make_user("tutor@example.com", role="tutor")
+    student, headers = make_user("student@example.com")
+    payload = bytes(range(256)) * 1000
+    sub = _submit(client, db_session, headers, _assignment(db_session, tutor), payload)
+    url = f"/homework/submissions/{sub.id}/file"
+
+    r = client.get(url, headers=headers)
+    etag = r.headers["etag"]
+    assert etag == f'"{sub.file_sha256}"'
+    assert r.headers["accept-ranges"] == "bytes"
+    assert 'filename="notes.pdf"' in r.headers["content-disposition"]
+
+    assert client.get(url, headers={**headers, "If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={**headers, "If-Modified-Since": r.headers["last-modified"]}).status_code == 304
+    assert client.get(url, headers={**headers, "If-None-Match": '"stale"'}).status_code == 200
+
+    r = client.get(url, headers={**headers, "Range": "bytes=100-199"})
+    assert r.status_code == 206
+    assert r.content == payload[100:200]
+    assert r.headers["content-range"] == f"bytes 100-199/{len(payload)}"
+
+    r = client.get(url, headers={**headers, "Range": "bytes=-10"})
+    assert r.content == payload[-10:]
+
+    r = client.get(url, headers={**headers, "Range": "bytes=1000-", "If-Range": etag})
+    assert r.status_code == 206 and r.content == payload[1000:]
+    r = client.get(url, headers={**headers, "Range": "bytes=1000-", "If-Range": '"stale"'})
+    assert r.status_code == 200 and r.content == payload
+
+    r = client.get(url, headers={**headers, "Range": f"bytes={len(payload)}-"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == f"bytes */{len(payload)}"
+
+
+def test_export_streams_zip_of_submissions(client, db_session, make_user, upload_dir):
+    import io
+    import zipfile
+    tutor, tutor_headers = make_user("tutor@example.com", role="tutor")
+    alice, alice_headers = make_user("alice@example.com", full_name="Alice Smith")
+    bob, bob_headers = make_user("bob@example.com", full_name="Bob")
+    a = _assignment(db_session, tutor)
+    first = _submit(client, db_session, alice_headers, a, b"alice work", name="essay.pdf")
+    _submit(client, db_session, bob_headers, a, os.urandom(300_000), name="photo.png")
+
+    r = client.get(f"/homework/assignments/{a.id}/export", headers=tutor_headers)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(r.content))
+    assert archive.testzip() is None
+    assert archive.read(f"Alice_Smith/{first.id}-essay.pdf") == b"alice work"
+    assert len(archive.namelist()) == 2
+
+    assert client.get(f"/homework/assignments/{a.id}/export", headers=alice_headers).status_code == 403
+
+
+def test_stream_zip_yields_bounded_chunks(tmp_path):
+    import io
+    import zipfile
+    from datetime import datetime
+    from app.downloads import stream_zip, ZipEntry
+    source = tmp_path / "big.bin"
+    data = os.urandom(1_000_000)
+    source.write_bytes(data)
+
+    entries = [ZipEntry(name, len(data), datetime(2024, 1, 1), lambda: open(source, "rb")) for name in ("a.bin", "b.bin")]
+    chunks = list(stream_zip(entries, chunk_size=64 * 1024))
+    assert max(len(c) for c in chunks) < 64 * 1024 + 1024
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert archive.read("b.bin") == data
+
+
+def test_bulk_grade_applies_all_and_refreshes_progress(client, db_session, make_user):
+    from sqlalchemy import event
+    tutor, tutor_headers = make_user("tutor@example.com", role="tutor")
+    a = _assignment(db_session, tutor)
+    students = [make_user(f"s{i}@example.com")[0] for i in range(3)]
+    subs = [models.Submission(assignment_id=a.id, student_id=s.id) for s in students for _ in range(2)]
+    db_session.add_all(subs)
+    db_session.commit()
+
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        r = client.post("/homework/grade/bulk", headers=tutor_headers, json={"grades": [
+            {"submission_id": s.id, "grade": str(70 + i * 2), "feedback": "ok"} for i, s in enumerate(subs)
+        ]})
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert r.status_code == 200, r.text
+    assert r.json()["graded"] == 6
+    assert len([s for s in statements if s.startswith("UPDATE submissions")]) == 1
+
+    db_session.expire_all()
+    assert [s.grade for s in db_session.query(models.Submission).order_by(models.Submission.id)] == \
+        ["70", "72", "74", "76", "78", "80"]
+    progress = {p.student_id: p.average_grade for p in db_session.query(models.Progress)}
+    assert progress == {students[0].id: 71, students[1].id: 75, students[2].id: 79}
+
+
+def test_bulk_grade_rejects_other_tutors_submissions(client, db_session, make_user):
+    tutor, tutor_headers = make_user("tutor@example.com", role="tutor")
+    other, _ = make_user("other@example.com", role="tutor")
+    student, _ = make_user("student@example.com")
+    mine, theirs = _assignment(db_session, tutor), _assignment(db_session, other)
+    s1 = models.Submission(assignment_id=mine.id, student_id=student.id)
+    s2 = models.Submission(assignment_id=theirs.id, student_id=student.id)
+    db_session.add_all([s1, s2])
+    db_session.commit()
+
+    r = client.post("/homework/grade/bulk", headers=tutor_headers, json={"grades": [
+        {"submission_id": s1.id, "grade": "90"}, {"submission_id": s2.id, "grade": "90"}
+    ]})
+    assert r.status_code == 403
+    db_session.expire_all()
+    assert db_session.get(models.Submission, s1.id).grade is None
+
+    r = client.post("/homework/grade/bulk", headers=tutor_headers, json={"grades": [{"submission_id": 999, "grade": "1"}]})
+    assert r.status_code == 404
+
+
+def test_assignment_feed_joins_status_and_pages_by_due_date(client, db_session, make_user):
+    from datetime import datetime, timedelta
+    tutor, _ = make_user("tutor@example.com", role="tutor")
+    student, headers = make_user("student@example.com")
+    other, _ = make_user("other@example.com")
+    base = datetime(2024, 3, 1)
+
+    assignments = []
+    for i in range(6):
+        target = [student.id, None, other.id][i % 3]
+        a = models.Assignment(tutor_id=tutor.id, student_id=target, title=f"A{i}", due_date=base + timedelta(days=i))
+        db_session.add(a)
+        assignments.append(a)
+    undated = models.Assignment(tutor_id=tutor.id, title="Undated")
+    db_session.add(undated)
+    db_session.commit()
+    visible = [a for a in assignments if a.student_id != other.id] + [undated]
+
+    db_session.add_all([
+        models.Submission(assignment_id=visible[0].id, student_id=student.id, grade="88"),
+        models.Submission(assignment_id=visible[1].id, student_id=student.id),
+        models.Submission(assignment_id=visible[1].id, student_id=other.id, grade="50"),
+    ])
+    db_session.commit()
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/homework/feed", params=params, headers=headers).json()
+        seen.extend(page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert [item["id"] for item in seen] == [a.id for a in visible]
+    assert [item["status"] for item in seen] == ["graded", "submitted", "pending", "pending", "pending"]
+    assert seen[0]["grade"] == "88"
+
+    graded = client.get("/homework/feed", params={"status": "pending", "due_after": (base + timedelta(days=2)).isoformat()},
+                        headers=headers).json()
+    assert [item["id"] for item in graded["items"]] == [visible[2].id, visible[3].id]
+    assert client.get("/homework/feed", params={"status": "bogus"}, headers=headers).status_code == 400
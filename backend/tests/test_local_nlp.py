@@ -0,0 +1,99 @@
+import time
+
+from app import local_nlp
+from benchmarks.local_nlp import build_text
+
+NOTES = """
+Photosynthesis is the process by which plants convert light energy into chemical energy.
+Chlorophyll in the chloroplast absorbs light for photosynthesis. The Calvin cycle fixes carbon dioxide into glucose.
+
+Mitochondria are organelles that produce ATP through cellular respiration.
+Cellular respiration breaks down glucose in the mitochondria. Muscle cells contain many mitochondria.
+
+Osmosis is the movement of water across a semipermeable membrane.
+Plant cells rely on osmosis to keep their shape. Water moves by osmosis toward higher solute concentration.
+
+Enzymes are proteins that lower the activation energy of chemical reactions.
+Each enzyme binds its substrate at the active site. Heat can change the active site of an enzyme.
+"""
+
+
+def test_summary_prefers_distinct_definitions():
+    summary = local_nlp.summarize(NOTES, sentences=3)
+    assert summary.count(".") == 3
+    assert sum(s in summary for s in ("Photosynthesis is", "Mitochondria are", "Osmosis is", "Enzymes are")) >= 2
+
+
+def test_flashcards_quiz_and_concept_map_use_key_terms():
+    cards = local_nlp.flashcards(NOTES)
+    assert {"q": "What are mitochondria?", "a": "Mitochondria are organelles that produce ATP through cellular respiration."} in cards
+
+    questions = local_nlp.quiz(NOTES)
+    assert questions
+    for question in questions:
+        assert "_____" in question["question"]
+        assert len(set(question["options"])) == 4
+        answer = question["options"][question["correct_answer"]]
+        filled = question["question"].replace("_____", answer)
+        assert filled.lower() in NOTES.lower().replace("\n", " ")
+    assert local_nlp.quiz(NOTES) == questions  # deterministic
+
+    nodes, edges = local_nlp.concept_map(NOTES)
+    labels = {node["label"] for node in nodes}
+    assert {"photosynthesis", "mitochondria", "osmosis"} <= labels
+    linked = {edge["from"] for edge in edges} | {edge["to"] for edge in edges}
+    assert linked == {node["id"] for node in nodes}
+
+
+def test_fifty_pages_well_under_a_second():
+    text = build_text(50)
+    started = time.perf_counter()
+    local_nlp.summarize(text)
+    local_nlp.flashcards(text)
+    local_nlp.quiz(text)
+    local_nlp.concept_map(text)
+    assert time.perf_counter() - started < 1.0
+
+
+def test_endpoints_use_local_engine_without_a_model(client, ai_cache, monkeypatch):
+    from app.routers import ai
+    monkeypatch.setattr(ai, "get_openai_client", lambda: None)
+    cards = client.post("/ai/flashcards", json={"text": NOTES}).json()["cards"]
+    assert cards and all(card["a"] in NOTES.replace("\n", " ") for card in cards)
+    assert "Key point" not in str(cards)
+    assert ai_cache.stats()["stores"] == 0
+
+
+def test_shed_load_to_local_engine(client, ai_cache, fake_openai, monkeypatch):
+    from app.routers import ai
+    monkeypatch.setattr(ai, "AI_SHED_IN_FLIGHT", 1)
+    monkeypatch.setattr(ai.inflight, "_calls", {"busy": object()})
+    response = client.post("/ai/summarize", json={"text": NOTES})
+    assert response.headers["X-AI-Cache"] == "shed"
+    assert response.json()["summary"]
+    assert fake_openai.calls == []
+
+
+def test_fallbacks_share_one_analysis_per_text(monkeypatch):
+    built = []
+    original = local_nlp.Document.__init__
+
+    def counting_init(self, text):
+        built.append(text)
+        original(self, text)
+
+    monkeypatch.setattr(local_nlp.Document, "__init__", counting_init)
+    local_nlp.analyze.cache_clear()
+    text = "Osmosis is the movement of water across a membrane. " * 3 + "Diffusion spreads solutes. Osmosis needs a membrane."
+    local_nlp.summarize(text)
+    local_nlp.flashcards(text)
+    local_nlp.quiz(text)
+    local_nlp.concept_map(text)
+    assert built == [text]
+
+
+def test_study_vocabulary_is_not_a_stopword():
+    assert not {"concept", "frequency", "names", "#"} & local_nlp.STOPWORDS
+    text = ("A concept is an idea that groups related facts. Each concept links to other ideas. "
+            "Students review every concept before the exam.")
+    assert "concept" in local_nlp.analyze(text).key_terms(3)
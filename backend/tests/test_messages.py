@@ -0,0 +1,84 @@
+import asyncio
+from datetime import datetime, timedelta
+from app import models
+from app.chat_writer import MessageWriter
+
+
+def _persist(db_session, rows):
+    from sqlalchemy.orm import sessionmaker
+    writer = MessageWriter(session_factory=sessionmaker(bind=db_session.get_bind()))
+
+    async def run():
+        for row in rows:
+            await writer.enqueue(**row)
+        await writer.stop()
+
+    asyncio.run(run())
+
+
+def test_history_pages_backwards_through_a_conversation(client, db_session, make_user):
+    alice, alice_headers = make_user("alice@example.com")
+    bob, bob_headers = make_user("bob@example.com")
+    carol, _ = make_user("carol@example.com")
+    base = datetime(2024, 5, 1, 12)
+    rows = []
+    for i in range(7):
+        sender, receiver = (alice, bob) if i % 2 == 0 else (bob, alice)
+        rows.append({"sender_id": sender.id, "receiver_id": receiver.id, "content": f"m{i}",
+                     "created_at": base + timedelta(seconds=i // 2)})  # shared timestamps exercise the id tiebreak
+    rows.append({"sender_id": alice.id, "receiver_id": carol.id, "content": "elsewhere", "created_at": base})
+    _persist(db_session, rows)
+
+    seen, cursor = [], None
+    while True:
+        params = {"with_user": bob.id, "limit": 3, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/messages/history", params=params, headers=alice_headers).json()
+        seen.extend(item["content"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == [f"m{i}" for i in reversed(range(7))]
+
+    page = client.get("/messages/history", params={"with_user": alice.id}, headers=bob_headers).json()
+    assert page["conversation_key"] == f"dm:{alice.id}:{bob.id}"
+    assert len(page["items"]) == 7
+
+
+def test_inbox_reads_from_summary_table(client, db_session, make_user):
+    tutor, tutor_headers = make_user("tutor@example.com", role="tutor")
+    student, student_headers = make_user("student@example.com")
+    outsider, outsider_headers = make_user("outsider@example.com")
+    room = f"pair:{tutor.id}:{student.id}"
+    base = datetime(2024, 5, 1, 12)
+    _persist(db_session, [
+        {"sender_id": tutor.id, "receiver_id": student.id, "content": "hi", "created_at": base},
+        {"sender_id": tutor.id, "receiver_id": student.id, "content": "you there?", "created_at": base + timedelta(minutes=1)},
+        {"sender_id": tutor.id, "room": room, "content": "room note", "created_at": base + timedelta(minutes=2)},
+    ])
+    _persist(db_session, [
+        {"sender_id": student.id, "receiver_id": tutor.id, "content": "yes", "created_at": base + timedelta(minutes=3)},
+    ])
+
+    inbox = client.get("/messages/inbox", headers=student_headers).json()
+    assert [(c["conversation_key"], c["last_content"], c["unread_count"]) for c in inbox] == [
+        (f"dm:{tutor.id}:{student.id}", "yes", 2),
+        (f"room:{room}", "room note", 1),
+    ]
+    assert inbox[0]["peer_id"] == tutor.id
+
+    tutor_inbox = client.get("/messages/inbox", headers=tutor_headers).json()
+    assert [c["unread_count"] for c in tutor_inbox] == [1, 0]
+
+    assert client.post("/messages/read", params={"with_user": tutor.id}, headers=student_headers).status_code == 200
+    assert client.get("/messages/inbox", headers=student_headers).json()[0]["unread_count"] == 0
+
+    assert client.get("/messages/history", params={"room": room}, headers=outsider_headers).status_code == 403
+    assert client.get("/messages/history", params={"room": room}, headers=student_headers).json()["items"][0]["content"] == "room note"
+
+
+def test_malformed_room_names_are_rejected(client, make_user):
+    tutor, tutor_headers = make_user("tutor@example.com", role="tutor")
+    student, _ = make_user("student@example.com")
+    for room in ("pair:x:y", f"pair:{tutor.id}:{student.id}:{tutor.id}", "session:abc", "lobby"):
+        assert client.get("/messages/history", params={"room": room}, headers=tutor_headers).status_code == 400
+        assert client.post("/messages/read", params={"room": room}, headers=tutor_headers).status_code == 400
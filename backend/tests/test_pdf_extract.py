@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from app import pdf_extract
+from app.ai_cache import ResponseCache
+from benchmarks.pdf_extract import build_pdf
+
+
+@pytest.fixture
+def pdf_cache(tmp_path, monkeypatch):
+    cache = ResponseCache(path=str(tmp_path / "pdf_text_cache.db"))
+    monkeypatch.setattr(pdf_extract, "text_cache", cache)
+    monkeypatch.setattr(pdf_extract, "PDF_WORKERS", 2)
+    monkeypatch.setattr(pdf_extract, "PDF_PAGES_PER_TASK", 3)
+    yield cache
+    pdf_extract.shutdown_pool()
+
+
+def _upload(client, headers, data, **params):
+    return client.post(
+        "/ai/extract-pdf", params=params, headers=headers,
+        files={"file": ("notes.pdf", data, "application/pdf")},
+    )
+
+
+def test_parse_page_spec():
+    assert pdf_extract.parse_page_spec(None, 4) == [0, 1, 2, 3]
+    assert pdf_extract.parse_page_spec("3, 1-2", 10) == [0, 1, 2]
+    assert pdf_extract.parse_page_spec("8-", 10) == [7, 8, 9]
+    for bad in ("0", "5-2", "11", "a-b", "1-20"):
+        with pytest.raises(ValueError):
+            pdf_extract.parse_page_spec(bad, 10)
+
+
+def test_extract_pdf_selected_pages_and_cache(client, make_user, pdf_cache):
+    _, headers = make_user("pdf@example.com")
+    data = build_pdf(10, lines_per_page=2)
+
+    response = _upload(client, headers, data)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["pages"] == 10
+    assert body["text"].index("Page 1 line 1") < body["text"].index("Page 10 line 2")
+    stores = pdf_cache.stores
+
+    response = _upload(client, headers, data, pages="2,9-")
+    assert response.status_code == 200
+    text = response.json()["text"]
+    assert "Page 2 line 1" in text and "Page 9 line 1" in text and "Page 10 line 1" in text
+    assert "Page 1 line" not in text and "Page 3 line" not in text
+    # Same bytes: page count and text come from the cache, nothing is extracted again
+    assert pdf_cache.stores == stores
+
+    response = _upload(client, headers, data, pages="4-2")
+    assert response.status_code == 400
+
+
+def test_extract_pdf_streams_ndjson_in_page_order(client, make_user, pdf_cache):
+    _, headers = make_user("pdfstream@example.com")
+    data = build_pdf(7, lines_per_page=1)
+
+    response = _upload(client, headers, data, pages="5-", stream="true")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["page"] for line in lines] == [5, 6, 7]
+    assert lines[0]["text"].startswith("Page 5 line 1")
@@ -0,0 +1,69 @@
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from app import models
+
+
+def test_roster_progress_streams_ndjson(client, db_session, make_user):
+    tutor, headers = make_user("tutor@example.com", role="tutor")
+    other_tutor, _ = make_user("other@example.com", role="tutor")
+    students = [make_user(f"s{i}@example.com", full_name=f"Student {i}")[0] for i in range(3)]
+    outsider, _ = make_user("outsider@example.com")
+
+    start = datetime(2024, 1, 1, 10)
+    for i, s in enumerate(students):
+        for n in range(i + 1):
+            db_session.add(models.SessionBooking(
+                student_id=s.id, tutor_id=tutor.id, start=start, end=start + timedelta(hours=1),
+                status="completed" if n else "scheduled"
+            ))
+    db_session.add(models.SessionBooking(
+        student_id=outsider.id, tutor_id=other_tutor.id, start=start, end=start, status="completed"
+    ))
+    assignment = models.Assignment(tutor_id=tutor.id, title="HW")
+    db_session.add(assignment)
+    db_session.flush()
+    db_session.add_all([
+        models.Submission(assignment_id=assignment.id, student_id=students[0].id, grade="90"),
+        models.Submission(assignment_id=assignment.id, student_id=students[0].id, grade="81"),
+        models.Submission(assignment_id=assignment.id, student_id=students[0].id, grade="A"),
+        models.StudySession(student_id=students[1].id, start_time=start, duration_minutes=150),
+    ])
+    db_session.commit()
+
+    r = client.get("/progress/roster", headers=headers)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [row["student_id"] for row in rows] == [s.id for s in students]
+    assert [row["total_sessions"] for row in rows] == [0, 1, 2]
+    assert rows[0]["average_grade"] == 85
+    assert rows[1]["average_grade"] is None
+    assert rows[1]["total_hours"] == 2
+
+
+def test_roster_progress_query_count_is_constant(client, db_session, make_user):
+    tutor, headers = make_user("tutor@example.com", role="tutor")
+    start = datetime(2024, 1, 1, 10)
+
+    def count_statements(n_students):
+        for i in range(n_students):
+            s, _ = make_user(f"s{n_students}-{i}@example.com")
+            db_session.add(models.SessionBooking(student_id=s.id, tutor_id=tutor.id, start=start, end=start))
+        db_session.commit()
+        statements = []
+        engine = db_session.get_bind()
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            assert client.get("/progress/roster", headers=headers).status_code == 200
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        return len(statements)
+
+    assert count_statements(2) == count_statements(20)
+
+
+def test_roster_progress_requires_tutor(client, make_user):
+    _, headers = make_user("student@example.com")
+    assert client.get("/progress/roster", headers=headers).status_code == 403
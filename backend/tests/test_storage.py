@@ -0,0 +1,136 @@
+import hashlib
+import io
+import zipfile
+import pytest
+from app import models, files, storage
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+
+@pytest.fixture
+def s3_storage(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        from botocore.config import Config
+        client = boto3.client("s3", region_name="us-east-1", config=Config(
+            request_checksum_calculation="when_required", response_checksum_validation="when_required"))
+        client.create_bucket(Bucket="uploads")
+        backend = storage.S3Storage("uploads", client=client)
+        storage.set_storage(backend)
+        yield backend
+        storage.set_storage(None)
+
+
+def test_s3_upload_dedup_redirect_and_export(client, db_session, make_user, s3_storage, monkeypatch):
+    monkeypatch.setattr(storage, "S3_PART_SIZE", 5 * 1024 * 1024)
+    tutor, tutor_headers = make_user("tutor@example.com", role="tutor")
+    a = models.Assignment(tutor_id=tutor.id, title="HW")
+    db_session.add(a)
+    db_session.commit()
+    payload = b"\x00pdf" * (3 * 1024 * 1024)  # 12 MB: exercises multipart upload
+
+    ids = []
+    for i in range(2):
+        _, headers = make_user(f"s{i}@example.com", full_name=f"Student {i}")
+        r = client.post("/homework/submit", data={"assignment_id": a.id},
+                        files={"file": ("scan.pdf", payload, "application/pdf")}, headers=headers)
+        assert r.status_code == 200, r.text
+        ids.append(r.json()["submission_id"])
+
+    sha = hashlib.sha256(payload).hexdigest()
+    sub = db_session.get(models.Submission, ids[0])
+    assert sub.file_path == f"s3://uploads/{storage.S3Storage('uploads').key(sha)}"
+    listed = s3_storage.client.list_objects_v2(Bucket="uploads")["Contents"]
+    # One blob, plus the lease the duplicate upload's touch left for GC
+    assert [obj["Key"] for obj in listed] == [s3_storage.key(sha), s3_storage.lease_key(sha)]
+    assert [name for name, _, _ in s3_storage.iter_blobs()] == [sha]
+    # The duplicate upload's touch kept the content type save() set
+    head = s3_storage.client.head_object(Bucket="uploads", Key=s3_storage.key(sha))
+    assert head["ContentType"] == "application/pdf"
+
+    r = client.get(f"/homework/submissions/{ids[0]}/file", headers=tutor_headers, follow_redirects=False)
+    assert r.status_code == 307
+    assert s3_storage.key(sha) in r.headers["location"]
+
+    r = client.get(f"/homework/assignments/{a.id}/export", headers=tutor_headers)
+    archive = zipfile.ZipFile(io.BytesIO(r.content))
+    assert [archive.read(name) == payload for name in archive.namelist()] == [True, True]
+
+
+def test_s3_export_skips_missing_objects(client, db_session, make_user, s3_storage):
+    tutor, tutor_headers = make_user("tutor@example.com", role="tutor")
+    a = models.Assignment(tutor_id=tutor.id, title="HW")
+    db_session.add(a)
+    db_session.commit()
+    kept_sha, gone_sha = hashlib.sha256(b"kept").hexdigest(), hashlib.sha256(b"gone").hexdigest()
+    s3_storage.client.put_object(Bucket="uploads", Key=s3_storage.key(kept_sha), Body=b"kept")
+    for i, sha in enumerate((gone_sha, kept_sha)):
+        student, _ = make_user(f"s{i}@example.com", full_name=f"Student {i}")
+        db_session.add(models.Submission(assignment_id=a.id, student_id=student.id, file_name="scan.pdf",
+                                         file_path=s3_storage.location(sha), file_sha256=sha, file_size=4))
+    db_session.commit()
+
+    with pytest.raises(FileNotFoundError):
+        s3_storage.open(s3_storage.location(gone_sha))
+    r = client.get(f"/homework/assignments/{a.id}/export", headers=tutor_headers)
+    assert r.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(r.content))
+    assert [archive.read(name) for name in archive.namelist()] == [b"kept"]
+
+
+def test_s3_rows_stay_readable_after_switching_back_to_local(client, db_session, make_user, s3_storage,
+                                                            upload_dir, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setattr(storage, "_readers", {})
+    tutor, tutor_headers = make_user("tutor@example.com", role="tutor")
+    a = models.Assignment(tutor_id=tutor.id, title="HW")
+    db_session.add(a)
+    db_session.commit()
+    _, headers = make_user("student@example.com")
+    r = client.post("/homework/submit", data={"assignment_id": a.id},
+                    files={"file": ("scan.pdf", b"old scan", "application/pdf")}, headers=headers)
+    submission_id = r.json()["submission_id"]
+
+    storage.set_storage(storage.LocalStorage())
+    r = client.get(f"/homework/submissions/{submission_id}/file", headers=tutor_headers, follow_redirects=False)
+    assert r.status_code == 307 and "uploads" in r.headers["location"]
+
+
+def test_s3_garbage_collection(db_session, s3_storage):
+    s3_storage.client.put_object(Bucket="uploads", Key=s3_storage.key("ab" * 32), Body=b"orphan")
+    assert files.collect_garbage(db_session, grace_seconds=3600)["removed"] == 0
+    assert files.collect_garbage(db_session, grace_seconds=-60)["removed"] == 1
+    assert s3_storage.client.list_objects_v2(Bucket="uploads").get("Contents") is None
+
+
+@pytest.mark.parametrize("upload_first", [True, False])
+def test_s3_garbage_collection_racing_a_duplicate_upload(db_session, s3_storage, upload_first):
+    import time
+    sha = hashlib.sha256(b"orphan").hexdigest()
+    stored_at = time.time()
+    s3_storage.client.put_object(Bucket="uploads", Key=s3_storage.key(sha), Body=b"orphan", ContentType="text/plain")
+    # LastModified has one-second resolution: let the blob age past the cutoff and the lease land after it
+    time.sleep(1.6)
+    client = s3_storage.client
+    delete_object = client.delete_object
+    uploads = []
+
+    # The duplicate upload lands right around the moment GC deletes the blob
+    def racing_delete(**kwargs):
+        if kwargs["Key"] == s3_storage.key(sha) and not uploads:
+            if not upload_first:
+                delete_object(**kwargs)
+            uploads.append(s3_storage.touch(sha))
+            if not upload_first:
+                return
+        return delete_object(**kwargs)
+
+    client.delete_object = racing_delete
+    result = files.collect_garbage(db_session, grace_seconds=time.time() - (stored_at + 0.5))
+    # Found or missed, the upload's lease makes GC put the blob back (a miss would also write its own copy)
+    assert uploads == [upload_first] and result["removed"] == 0
+    assert client.get_object(Bucket="uploads", Key=s3_storage.key(sha))["Body"].read() == b"orphan"
+    assert client.head_object(Bucket="uploads", Key=s3_storage.key(sha))["ContentType"] == "text/plain"
+    assert [name for name, _, _ in s3_storage.iter_blobs()] == [sha]
@@ -0,0 +1,434 @@
+import json
+import time
+from fastapi.testclient import TestClient
+from app.main import app
+from app import models
+from app.routers import ws
+from app.chat_writer import message_writer
+
+
+def test_direct_message_is_delivered_then_persisted(db_session, make_user, monkeypatch):
+    alice, alice_auth = make_user("alice@example.com")
+    bob, bob_auth = make_user("bob@example.com")
+    lookups = []
+    presence_workers = ws.manager.broker.presence_workers
+
+    async def counted(user_id):
+        lookups.append(user_id)
+        return await presence_workers(user_id)
+
+    monkeypatch.setattr(ws.manager.broker, "presence_workers", counted)
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws", headers=alice_auth) as a, \
+                client.websocket_connect("/ws", headers=bob_auth) as b:
+            a.send_text(json.dumps({"receiver_id": bob.id, "content": "hi bob"}))
+            assert json.loads(b.receive_text())["content"] == "hi bob"
+            assert json.loads(a.receive_text())["content"] == "hi bob"
+            # The sender's echo is written locally without a presence lookup
+            assert lookups == [str(bob.id)]
+            client.portal.call(message_writer.flush)
+
+    rows = db_session.query(models.Message).all()
+    assert [(m.sender_id, m.receiver_id, m.content) for m in rows] == [(alice.id, bob.id, "hi bob")]
+
+
+def test_writer_batches_inserts(db_session):
+    import asyncio
+    from sqlalchemy import event
+    from app.chat_writer import MessageWriter
+    from sqlalchemy.orm import sessionmaker
+
+    writer = MessageWriter(batch_size=50, flush_interval=0.5,
+                           session_factory=sessionmaker(bind=db_session.get_bind()))
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+
+    async def run():
+        for i in range(120):
+            await writer.enqueue(1, f"m{i}")
+        await writer.stop()
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        asyncio.run(run())
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert db_session.query(models.Message).count() == 120
+    assert len([s for s in statements if s.startswith("INSERT INTO messages")]) == 3
+
+
+class FakeSocket:
+    def __init__(self, delay=0.0, fail=False):
+        self.sent = []
+        self.delay = delay
+        self.fail = fail
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        import asyncio
+        if self.fail:
+            raise RuntimeError("connection reset")
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+async def _settle():
+    import asyncio
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def _run(coro):
+    import asyncio
+    return asyncio.run(coro)
+
+
+def test_cross_worker_routing_is_local_first():
+    from app.chat_broker import InMemoryBroker
+    from app.routers.ws import ConnectionManager
+
+    async def scenario():
+        broker = InMemoryBroker()
+        w1, w2 = ConnectionManager(broker, "w1"), ConnectionManager(broker, "w2")
+        alice, bob, carol = FakeSocket(), FakeSocket(), FakeSocket()
+        await w1.connect(alice, "1")
+        await w1.connect(carol, "3")
+        await w2.connect(bob, "2")
+
+        await w1.send_to_user("3", "local only")
+        await _settle()
+        assert carol.sent == ["local only"] and broker.published == 0
+
+        await w1.send_to_user("2", "to bob")
+        await _settle()
+        assert bob.sent == ["to bob"] and broker.published == 1
+
+        await w2.broadcast("hello all")
+        await _settle()
+        assert [s.sent[-1] for s in (alice, bob, carol)] == ["hello all"] * 3
+        assert bob.sent.count("hello all") == 1
+
+        await w2.disconnect(w2.active["2"][0])
+        assert await broker.presence_workers("2") == set()
+        published = broker.published
+        await w1.send_to_user("2", "offline")
+        assert broker.published == published
+        await w1.stop()
+        await w2.stop()
+
+    _run(scenario())
+
+
+def test_redis_broker_routes_between_workers():
+    import asyncio
+    fakeredis = __import__("pytest").importorskip("fakeredis")
+    from app.chat_broker import RedisBroker
+    from app.routers.ws import ConnectionManager
+
+    async def scenario():
+        server = fakeredis.FakeServer()
+        b1 = RedisBroker(client=fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+        b2 = RedisBroker(client=fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+        w1, w2 = ConnectionManager(b1, "w1"), ConnectionManager(b2, "w2")
+        alice, bob = FakeSocket(), FakeSocket()
+        await w1.connect(alice, "1")
+        await w2.connect(bob, "2")
+
+        liveness_reads = []
+        zrangebyscore = b1.redis.zrangebyscore
+
+        async def counted(*args, **kwargs):
+            liveness_reads.append(args)
+            return await zrangebyscore(*args, **kwargs)
+
+        b1.redis.zrangebyscore = counted
+        for i in range(3):
+            await w1.send_to_user("2", f"over redis {i}")
+        for _ in range(50):
+            if len(bob.sent) == 3:
+                break
+            await asyncio.sleep(0.02)
+        assert bob.sent == [f"over redis {i}" for i in range(3)]
+        # w2 started after w1's last heartbeat: one re-read, then the cached set answers
+        assert len(liveness_reads) == 1
+
+        # A worker whose heartbeat lapsed stops receiving publishes
+        await b1.redis.zadd("chat:workers", {"w2": 0})
+        await b1.heartbeat("w1")
+        published = b1.published
+        await w1.send_to_user("2", "lapsed")
+        await w1.send_to_user("2", "lapsed")
+        assert b1.published == published and len(liveness_reads) == 3
+        await w1.stop()
+        await w2.stop()
+        await b1.close()
+        await b2.close()
+
+    _run(scenario())
+
+
+def test_slow_and_dead_clients_are_evicted_without_stalling_others(monkeypatch):
+    import asyncio
+    import time
+    from app.chat_broker import InMemoryBroker
+    from app.routers import ws
+
+    monkeypatch.setattr(ws, "OUTBOUND_QUEUE_SIZE", 8)
+
+    async def scenario():
+        manager = ws.ConnectionManager(InMemoryBroker(), "w1")
+        slow, dead = FakeSocket(delay=0.5), FakeSocket(fail=True)
+        fast = [FakeSocket() for _ in range(3)]
+        await manager.connect(slow, "slow")
+        await manager.connect(dead, "dead")
+        for i, sock in enumerate(fast):
+            await manager.connect(sock, f"fast{i}")
+
+        started = time.perf_counter()
+        for i in range(50):
+            await manager.broadcast(f"m{i}")
+            await asyncio.sleep(0)  # next inbound frame
+        assert time.perf_counter() - started < 0.1  # broadcasts never wait on sockets
+
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+        assert all(len(sock.sent) == 50 for sock in fast)
+        assert set(manager.active) == {"fast0", "fast1", "fast2"}
+        assert manager.evictions["slow_consumer"] == 1 and manager.evictions["send_failed"] == 1
+        assert slow.close_code == 1013 and dead.close_code == 1011
+
+        stats = manager.stats()
+        assert [c["queue_depth"] for c in stats["connections"]] == [0, 0, 0]
+        assert [c["sent"] for c in stats["connections"]] == [50, 50, 50]
+        await manager.stop()
+
+    _run(scenario())
+
+
+def test_rooms_scope_fan_out_and_require_membership(db_session, make_user, monkeypatch):
+    from datetime import datetime
+    monkeypatch.setattr(ws, "ROOM_AUDIT", True)
+    tutor, tutor_auth = make_user("tutor@example.com", role="tutor")
+    student, student_auth = make_user("student@example.com")
+    outsider, outsider_auth = make_user("outsider@example.com")
+    booking = models.SessionBooking(student_id=student.id, tutor_id=tutor.id,
+                                    start=datetime(2024, 1, 1), end=datetime(2024, 1, 1, 1))
+    db_session.add(booking)
+    db_session.commit()
+    room = f"session:{booking.id}"
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws", headers=tutor_auth) as t, \
+                client.websocket_connect("/ws", headers=student_auth) as s, \
+                client.websocket_connect("/ws", headers=outsider_auth) as o:
+            for sock in (t, s):
+                sock.send_text(json.dumps({"type": "join", "room": room}))
+                assert json.loads(sock.receive_text()) == {"type": "joined", "room": room}
+
+            o.send_text(json.dumps({"type": "join", "room": room}))
+            assert json.loads(o.receive_text())["type"] == "error"
+            o.send_text(json.dumps({"room": room, "content": "let me in"}))
+            assert json.loads(o.receive_text())["type"] == "error"
+            o.send_text("not json")
+            assert json.loads(o.receive_text())["type"] == "error"
+
+            t.send_text(json.dumps({"room": room, "content": "welcome"}))
+            for sock in (t, s):
+                msg = json.loads(sock.receive_text())
+                assert (msg["room"], msg["content"]) == (room, "welcome")
+            assert ws.manager.stats()["rooms"] == {room: 2}
+            # Tutors only, and even then it names neither users nor rooms
+            assert client.get("/ws/stats", headers=outsider_auth).status_code == 403
+            public = client.get("/ws/stats", headers=tutor_auth).json()
+            assert public["room_sizes"] == [2] and sorted(c["rooms"] for c in public["connections"]) == [0, 1, 1]
+            assert room not in json.dumps(public) and all("user_id" not in c for c in public["connections"])
+
+            s.send_text(json.dumps({"type": "leave", "room": room}))
+            assert json.loads(s.receive_text())["type"] == "left"
+            client.portal.call(message_writer.flush)
+
+            # The outsider never saw room traffic
+            o.send_text(json.dumps({"receiver_id": outsider.id, "content": "ping"}))
+            assert json.loads(o.receive_text())["content"] == "ping"
+
+    stored = db_session.query(models.Message).filter(models.Message.room == room).all()
+    assert [m.content for m in stored] == ["welcome"]
+    events = [(e.user_id, e.action) for e in db_session.query(models.RoomMembershipEvent).order_by(models.RoomMembershipEvent.id)]
+    assert events == [(tutor.id, "join"), (student.id, "join"), (student.id, "leave"), (tutor.id, "leave")]
+
+
+def test_reconnect_replays_missed_messages_from_acked_cursor(db_session, make_user, monkeypatch):
+    monkeypatch.setattr(ws, "RESUME_PAGE_SIZE", 2)
+    alice, alice_auth = make_user("alice@example.com")
+    bob, bob_auth = make_user("bob@example.com")
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws", headers=alice_auth) as a:
+            with client.websocket_connect("/ws", headers=bob_auth) as b:
+                a.send_text(json.dumps({"receiver_id": bob.id, "content": "seen"}))
+                seen = json.loads(b.receive_text())
+                b.send_text(json.dumps({"type": "ack", "seq": seen["seq"]}))
+                a.receive_text()
+                client.portal.call(message_writer.flush)
+
+            # The closed socket stores its cursor in the background
+            for _ in range(100):
+                db_session.expire_all()
+                if db_session.query(models.ChatCursor).filter_by(user_id=bob.id).count():
+                    break
+                time.sleep(0.01)
+
+            for i in range(3):
+                a.send_text(json.dumps({"receiver_id": bob.id, "content": f"missed {i}"}))
+                a.receive_text()
+
+            with client.websocket_connect("/ws", headers=bob_auth) as b:
+                first = json.loads(b.receive_text())
+                assert first["type"] == "resume" and first["has_more"]
+                assert [m["content"] for m in first["messages"]] == ["missed 0", "missed 1"]
+                assert first["messages"][0]["seq"] > seen["seq"]
+
+                b.send_text(json.dumps({"type": "resume", "since": first["next_since"]}))
+                second = json.loads(b.receive_text())
+                assert [m["content"] for m in second["messages"]] == ["missed 2"]
+                assert not second["has_more"]
+
+                # Live traffic follows the replay
+                a.send_text(json.dumps({"receiver_id": bob.id, "content": "live"}))
+                live = json.loads(b.receive_text())
+                assert live["content"] == "live" and live["seq"] > second["next_since"]
+
+    cursor = db_session.query(models.ChatCursor).filter_by(user_id=bob.id).one()
+    assert cursor.last_seq == seen["seq"]
+
+
+def test_handshake_requires_a_valid_token(db_session, make_user):
+    import pytest
+    from starlette.websockets import WebSocketDisconnect
+    alice, alice_auth = make_user("alice@example.com")
+    token = alice_auth["Authorization"].split()[1]
+    with TestClient(app) as client:
+        for url in ("/ws", "/ws?token=not-a-jwt"):
+            with pytest.raises(WebSocketDisconnect) as rejected:
+                with client.websocket_connect(url):
+                    pass
+            assert rejected.value.code == 1008
+        with client.websocket_connect(f"/ws?token={token}") as a:
+            a.send_text(json.dumps({"type": "ping"}))
+            assert json.loads(a.receive_text()) == {"type": "pong"}
+        assert client.get("/ws/metrics", headers=alice_auth).status_code == 403
+        _, tutor_auth = make_user("tutor@example.com", role="tutor")
+        metrics = client.get("/ws/metrics", headers=tutor_auth).json()
+        assert metrics["connections"] == 0 and metrics["limits"]["per_user"] == ws.MAX_CONNECTIONS_PER_USER
+
+
+def test_idle_reaping_and_connection_caps(monkeypatch):
+    import asyncio
+    from app.chat_broker import InMemoryBroker
+
+    monkeypatch.setattr(ws, "MAX_CONNECTIONS_PER_USER", 2)
+    monkeypatch.setattr(ws, "MAX_CONNECTIONS", 3)
+
+    async def scenario():
+        manager = ws.ConnectionManager(InMemoryBroker(), "w1")
+        quiet, chatty = FakeSocket(), FakeSocket()
+        quiet_conn = await manager.connect(quiet, "1")
+        chatty_conn = await manager.connect(chatty, "2")
+
+        quiet_conn.last_seen -= ws.PING_INTERVAL
+        manager.reap_idle()
+        await _settle()
+        assert quiet.sent == [ws.PING_FRAME] and chatty.sent == []
+
+        quiet_conn.last_seen -= ws.IDLE_TIMEOUT
+        chatty_conn.last_seen -= ws.IDLE_TIMEOUT
+        chatty_conn.touch()
+        manager.reap_idle()
+        await _settle()
+        assert quiet.close_code == 1001 and quiet_conn.closed
+        assert set(manager.active) == {"2"}
+
+        # Third socket for user 2 replaces the oldest; the worker-wide cap turns away the rest
+        extra = [FakeSocket() for _ in range(2)]
+        for sock in extra:
+            await manager.connect(sock, "2")
+        await _settle()
+        assert chatty.close_code == 1008 and len(manager.active["2"]) == 2
+        await manager.connect(FakeSocket(), "3")
+        refused = FakeSocket()
+        assert await manager.connect(refused, "4") is None
+        assert refused.close_code == 1013
+
+        metrics = manager.metrics()
+        assert metrics["connections"] == 3 and metrics["users"] == 2 and metrics["rejected"] == 1
+        assert metrics["evictions"]["idle_timeout"] == 1 and metrics["evictions"]["replaced"] == 1
+        await manager.stop()
+
+    _run(scenario())
+
+
+def test_connection_is_released_when_the_handler_fails(db_session, make_user, monkeypatch):
+    import pytest
+    alice, alice_auth = make_user("alice@example.com")
+
+    async def broken_send(user_id, message):
+        raise RuntimeError("broker unavailable")
+
+    monkeypatch.setattr(ws.manager, "send_to_user", broken_send)
+    with TestClient(app) as client:
+        with pytest.raises(RuntimeError):
+            with client.websocket_connect("/ws", headers=alice_auth) as a:
+                a.send_text(json.dumps({"receiver_id": alice.id, "content": "hi"}))
+                a.receive_text()
+        assert str(alice.id) not in ws.manager.active
+        assert ws.manager.metrics()["connections"] == 0
+
+
+def test_non_integer_receiver_id_gets_an_error_frame(db_session, make_user):
+    alice, alice_auth = make_user("alice@example.com")
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws", headers=alice_auth) as a:
+            for receiver_id in ("abc", 1.5, True, [alice.id]):
+                a.send_text(json.dumps({"receiver_id": receiver_id, "content": "x"}))
+                assert json.loads(a.receive_text()) == {"type": "error", "detail": "receiver_id must be a user id"}
+            # The socket survives and still delivers, including to a numeric string id
+            a.send_text(json.dumps({"receiver_id": str(alice.id), "content": "still here"}))
+            assert json.loads(a.receive_text())["content"] == "still here"
+
+
+def test_sequence_worker_numbers_are_claimed_and_seq_is_unique(db_session, monkeypatch):
+    import pytest
+    from sqlalchemy.exc import IntegrityError
+    from app.chat_broker import InMemoryBroker
+    from app.chat_writer import MessageSequence
+
+    assert MessageSequence(worker_bits=7).worker_bits == 7
+    monkeypatch.setattr("app.chat_writer.CHAT_WORKER_ID", "12")
+    configured = MessageSequence()
+    _run(configured.claim(InMemoryBroker()))
+    assert configured.worker_bits == 12
+    monkeypatch.setattr("app.chat_writer.CHAT_WORKER_ID", None)
+
+    fakeredis = pytest.importorskip("fakeredis")
+    from app.chat_broker import RedisBroker
+    server = fakeredis.FakeServer()
+    sequences = [MessageSequence() for _ in range(2)]
+
+    async def claim_all():
+        for sequence in sequences:
+            await sequence.claim(RedisBroker(client=fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)))
+
+    _run(claim_all())
+    assert sequences[0].worker_bits != sequences[1].worker_bits
+
+    db_session.add_all([models.Message(sender_id=1, content="a", seq=42), models.Message(sender_id=1, content="b", seq=42)])
+    with pytest.raises(IntegrityError):
+        db_session.commit()
+    db_session.rollback()
@@ -11,20 +11,65 @@ import {
   ListItem,
   ListItemAvatar,
   Divider,
+  Alert,
 } from '@mui/material';
 import { Send } from '@mui/icons-material';
 
+const API_URL = 'http://localhost:8000';
+
 interface Message {
+  seq?: number;
   sender_id?: number;
   content: string;
   timestamp?: string;
+  room?: string;
+}
+
+interface Session {
+  id: number;
+  student_id: number;
+  tutor_id: number;
+  topic?: string | null;
+}
+
+interface Conversation {
+  room: string;
+  label: string;
 }
 
+// One pair:<tutor>:<student> room per person the user has booked sessions with
+const conversationsFrom = (sessions: Session[], userId: number): Conversation[] => {
+  const topics = new Map<string, string[]>();
+  sessions.forEach((s) => {
+    const room = `pair:${s.tutor_id}:${s.student_id}`;
+    const list = topics.get(room) || [];
+    if (s.topic && !list.includes(s.topic)) list.push(s.topic);
+    topics.set(room, list);
+  });
+  return Array.from(topics, ([room, list]) => {
+    const [, tutorId, studentId] = room.split(':');
+    const other = Number(tutorId) === userId ? `Student #${studentId}` : `Tutor #${tutorId}`;
+    return { room, label: list.length ? `${other} · ${list.join(', ')}` : other };
+  });
+};
+
+// Live frames can repeat the tail of a resume page or of the history; keep one copy per seq
+const mergeMessages = (current: Message[], incoming: Message[]): Message[] => {
+  const seen = new Set(current.map((m) => m.seq));
+  const merged = [...current, ...incoming.filter((m) => m.seq === undefined || !seen.has(m.seq))];
+  return merged.sort((a, b) => (a.seq ?? Infinity) - (b.seq ?? Infinity));
+};
+
 const Chat: React.FC = () => {
   const [messages, setMessages] = useState<Message[]>([]);
   const [input, setInput] = useState('');
-  const [userId] = useState('1');
+  const [userId, setUserId] = useState<number | null>(null);
+  const [conversations, setConversations] = useState<Conversation[]>([]);
+  const [room, setRoom] = useState('');
+  const [connected, setConnected] = useState(false);
+  const [error, setError] = useState('');
   const wsRef = useRef<WebSocket | null>(null);
+  const roomRef = useRef('');
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
   const scrollToBottom = () => {
@@ -36,34 +81,122 @@ const Chat: React.FC = () => {
   }, [messages]);
 
   useEffect(() => {
-    const url = `ws://localhost:8000/ws?user_id=${userId}`;
-    const ws = new WebSocket(url);
+    const token = localStorage.getItem('access_token');
+    const headers: HeadersInit = token ? { Authorization: `Bearer ${token}` } : {};
+    const load = async () => {
+      try {
+        const [userRes, sessionsRes] = await Promise.all([
+          fetch(`${API_URL}/auth/me`, { headers }),
+          fetch(`${API_URL}/sessions/my-sessions`, { headers }),
+        ]);
+        if (!userRes.ok || !sessionsRes.ok) {
+          setError('Could not load your conversations');
+          return;
+        }
+        const user = await userRes.json();
+        const list = conversationsFrom(await sessionsRes.json(), user.id);
+        setUserId(user.id);
+        setConversations(list);
+        if (list.length) setRoom(list[0].room);
+      } catch (err) {
+        console.error('Error loading conversations:', err);
+        setError('Could not load your conversations');
+      }
+    };
+    load();
+  }, []);
+
+  useEffect(() => {
+    const token = localStorage.getItem('access_token');
+    const ws = new WebSocket(`ws://localhost:8000/ws?token=${token}`);
     wsRef.current = ws;
-    
+
+    const receive = (msg: Message) => {
+      if (msg.seq !== undefined) {
+        ws.send(JSON.stringify({ type: 'ack', seq: msg.seq }));
+      }
+      if (msg.room && msg.room === roomRef.current) {
+        setMessages((prev) => mergeMessages(prev, [msg]));
+      }
+    };
+
     ws.onmessage = (e) => {
+      let msg;
       try {
-        const msg = JSON.parse(e.data);
-        setMessages(prev => [...prev, msg]);
+        msg = JSON.parse(e.data);
       } catch (err) {
-        setMessages(prev => [...prev, { content: e.data }]);
+        console.warn('Ignoring non-JSON chat frame:', e.data);
+        return;
+      }
+      switch (msg.type) {
+        case 'ping':
+          ws.send(JSON.stringify({ type: 'pong' }));
+          return;
+        case 'error':
+          setError(msg.detail);
+          return;
+        case 'resume':
+          msg.messages.forEach(receive);
+          if (msg.has_more) {
+            ws.send(JSON.stringify({ type: 'resume', since: msg.next_since }));
+          }
+          return;
+        case 'joined':
+        case 'left':
+        case 'pong':
+          return;
+        default:
+          receive(msg);
       }
     };
-    
-    ws.onopen = () => console.log('WebSocket connected');
-    ws.onclose = () => console.log('WebSocket disconnected');
+
+    ws.onopen = () => setConnected(true);
+    ws.onclose = () => setConnected(false);
     ws.onerror = (err) => console.error('WebSocket error:', err);
-    
+
     return () => ws.close();
-  }, [userId]);
+  }, []);
+
+  useEffect(() => {
+    roomRef.current = room;
+    setMessages([]);
+    const ws = wsRef.current;
+    if (!room || !connected || !ws) return;
+
+    ws.send(JSON.stringify({ type: 'join', room }));
+    const token = localStorage.getItem('access_token');
+    fetch(`${API_URL}/messages/history?room=${encodeURIComponent(room)}&limit=50`, {
+      headers: token ? { Authorization: `Bearer ${token}` } : {},
+    })
+      .then((res) => (res.ok ? res.json() : { items: [] }))
+      .then((page) => {
+        if (roomRef.current !== room) return;
+        const history: Message[] = page.items.map((m: any) => ({
+          seq: m.seq ?? undefined,
+          sender_id: m.sender_id,
+          content: m.content,
+          timestamp: m.created_at,
+          room: m.room,
+        }));
+        setMessages((prev) => mergeMessages(prev, history));
+      })
+      .catch((err) => console.error('Error loading chat history:', err));
+
+    return () => {
+      if (ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ type: 'leave', room }));
+      }
+    };
+  }, [room, connected]);
 
   const send = () => {
-    if (!input.trim()) return;
-    
+    if (!input.trim() || !room) return;
+
     const message = {
-      content: input,
-      receiver_id: null
+      room,
+      content: input
     };
-    
+
     wsRef.current?.send(JSON.stringify(message));
     setInput('');
   };
@@ -83,14 +216,45 @@ const Chat: React.FC = () => {
           <Typography variant="caption" color="text.secondary">
             Real-time messaging with tutors and students
           </Typography>
+          {conversations.length > 0 && (
+            <TextField
+              select
+              fullWidth
+              size="small"
+              label="Conversation"
+              value={room}
+              onChange={(e) => setRoom(e.target.value)}
+              SelectProps={{
+                native: true,
+              }}
+              sx={{ mt: 2 }}
+            >
+              {conversations.map((c) => (
+                <option key={c.room} value={c.room}>
+                  {c.label}
+                </option>
+              ))}
+            </TextField>
+          )}
         </Box>
 
+        {error && (
+          <Alert severity="error" onClose={() => setError('')} sx={{ m: 2, mb: 0 }}>
+            {error}
+          </Alert>
+        )}
+        {userId !== null && conversations.length === 0 && (
+          <Alert severity="info" sx={{ m: 2, mb: 0 }}>
+            Book a session to start chatting with a tutor.
+          </Alert>
+        )}
+
         <Box sx={{ flex: 1, overflow: 'auto', p: 2 }}>
           <List>
             {messages.map((msg, i) => {
-              const isCurrentUser = msg.sender_id?.toString() === userId;
+              const isCurrentUser = userId !== null && msg.sender_id === userId;
               return (
-                <React.Fragment key={i}>
+                <React.Fragment key={msg.seq ?? i}>
                   <ListItem
                     alignItems="flex-start"
                     sx={{
@@ -136,8 +300,9 @@ const Chat: React.FC = () => {
               onChange={(e) => setInput(e.target.value)}
               onKeyPress={handleKeyPress}
               size="small"
+              disabled={!room}
             />
-            <IconButton color="primary" onClick={send} disabled={!input.trim()}>
+            <IconButton color="primary" onClick={send} disabled={!input.trim() || !room || !connected}>
               <Send />
             </IconButton>
           </Box>